@@ -0,0 +1,226 @@
+"""
+    benchmarks.build
+    ----------------
+
+    Times builds of a synthetic project (see benchmarks.synthetic) through
+    `builder.main`: a cold build (with an empty user cache), a no-op rebuild
+    with --reuse, and --reuse rebuilds after changing a single view, SASS
+    partial or image.  Each scenario is run a number of times and its median
+    is reported.
+
+    The results can be stored as a baseline, and later runs compared against
+    it: a scenario more than --tolerance slower than its baseline (and by more
+    than --min-delta milliseconds, to ignore noise on fast scenarios) is a
+    regression, and the benchmark exits with a non-zero status.  Baselines
+    only compare meaningfully with runs on the same machine, for the same
+    project and builder arguments.
+
+    Arguments after `--` are passed to the builder, e.g.
+    `python benchmarks/build.py -- --favicon-in-memory --precompress`
+
+    Requirements:
+    * the builder's requirements (libsass, inkscape and imagemagick, ...)
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+import os
+import os.path
+from os.path import abspath, dirname, join
+from argparse import ArgumentParser, RawDescriptionHelpFormatter, REMAINDER
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from statistics import median
+from io import StringIO
+from time import perf_counter
+from sys import exit, path as sys_path
+import json
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+BUILDER_DIR = join(dirname(BENCHMARKS_DIR), 'bottle-builder')
+sys_path.insert(0, BUILDER_DIR)
+
+import builder
+from synthetic import generate_project, change_file, add_project_arguments, \
+                      get_project_options
+
+
+##### Constants ################################################################
+
+DEFAULT_BASELINE = join(BENCHMARKS_DIR, 'baseline.json')
+
+BASELINE_VERSION = 1
+
+# (scenario, kind of file changed before each rebuild)
+REBUILDS = [
+    ('no-op rebuild', None),
+    ('change view', 'view'),
+    ('change partial', 'partial'),
+    ('change image', 'image'),
+]
+
+
+##### Helpers ##################################################################
+
+def _build(path, args):
+    # returns the seconds builder.main took, its output is discarded
+    cwd = os.getcwd()
+    try:
+        start = perf_counter()
+        with redirect_stdout(StringIO()):
+            builder.main([ '-p', path ] + args)
+        return perf_counter() - start
+    finally:
+        os.chdir(cwd) # NOTE: the builder works in the project's directory
+
+def _time_cold(path, args, repeat):
+    times = []
+    for _ in range(repeat):
+        # NOTE: nothing is reused from earlier builds, by the manifest or cache
+        with TemporaryDirectory() as cache_dir:
+            os.environ['BOTTLE_BUILDER_CACHE'] = cache_dir
+            times.append(_build(path, args))
+    return times
+
+def _time_rebuild(path, args, kind, repeat):
+    times = []
+    for n in range(repeat):
+        if kind:
+            change_file(path, kind, n)
+        times.append(_build(path, [ '--reuse' ] + args))
+    return times
+
+def run_benchmarks(project, args, repeat):
+    results, cache = {}, os.environ.get('BOTTLE_BUILDER_CACHE')
+    try:
+        with TemporaryDirectory() as path, TemporaryDirectory() as cache_dir:
+            generate_project(path, **project)
+            results['cold build'] = _time_cold(path, args, repeat)
+            # NOTE: rebuilds share one cache, as on a developer's machine
+            os.environ['BOTTLE_BUILDER_CACHE'] = cache_dir
+            _build(path, args)
+            for name, kind in REBUILDS:
+                results[name] = _time_rebuild(path, args, kind, repeat)
+    finally:
+        if cache is None:
+            os.environ.pop('BOTTLE_BUILDER_CACHE', None)
+        else:
+            os.environ['BOTTLE_BUILDER_CACHE'] = cache
+    return { name: { 'median': median(times), 'min': min(times), 'runs': times }
+             for name, times in results.items() }
+
+def load_baseline(fp):
+    try:
+        with open(fp, 'r') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return None
+    if baseline.get('version') != BASELINE_VERSION:
+        print('Ignoring baseline with an unknown version:', fp)
+        return None
+    return baseline
+
+def compare(results, baseline, tolerance, min_delta):
+    # returns the scenarios that regressed, printing every comparison
+    regressions = []
+    print('{:<18}{:>12}{:>14}{:>10}'.format('scenario', 'median (ms)',
+                                           'baseline (ms)', 'change'))
+    for name, result in results.items():
+        now = result['median']
+        before = baseline['results'].get(name, {}).get('median') if baseline else None
+        if before is None:
+            print('{:<18}{:>12.1f}{:>14}{:>10}'.format(name, now * 1000, '-', '-'))
+            continue
+        change = (now - before) / before if before else 0
+        regressed = change > tolerance and (now - before) * 1000 > min_delta
+        print('{:<18}{:>12.1f}{:>14.1f}{:>+9.0f}%{}'.format(name, now * 1000,
+              before * 1000, change * 100, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+##### Command Line Interface ###################################################
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        formatter_class=RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    add_project_arguments(parser)
+    parser.add_argument(
+        '-n', '--repeat',
+        type=int,
+        default=5,
+        help='the number of times each scenario is run. (default 5)'
+    )
+    parser.add_argument(
+        '-b', '--baseline',
+        type=str,
+        default=DEFAULT_BASELINE,
+        help='the baseline to compare against. (default benchmarks/baseline.json)'
+    )
+    parser.add_argument(
+        '-u', '--update-baseline',
+        action='store_true',
+        help='store the results as the baseline, rather than comparing them'
+    )
+    parser.add_argument(
+        '-t', '--tolerance',
+        type=float,
+        default=0.2,
+        help='the fraction a scenario may be slower than its baseline before '
+        'it\'s a regression. (default 0.2)'
+    )
+    parser.add_argument(
+        '--min-delta',
+        type=float,
+        default=20,
+        help='the milliseconds a scenario may be slower than its baseline, '
+        'regardless of --tolerance. (default 20)'
+    )
+    parser.add_argument(
+        'builder_args',
+        nargs=REMAINDER,
+        help='arguments passed to the builder, after --'
+    )
+    options = parser.parse_args(args)
+    if options.builder_args[:1] == [ '--' ]:
+        options.builder_args = options.builder_args[1:]
+    return options
+
+def main(args=None):
+    options = parse_args(args)
+    project = get_project_options(options)
+    results = run_benchmarks(project, options.builder_args, options.repeat)
+    current = {
+        'version': BASELINE_VERSION,
+        'project': project,
+        'builder_args': options.builder_args,
+        'results': results,
+    }
+    if options.update_baseline:
+        compare(results, None, options.tolerance, options.min_delta)
+        with open(options.baseline, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+        print('Baseline written to', options.baseline)
+        return
+    baseline = load_baseline(options.baseline)
+    if baseline and (baseline['project'], baseline['builder_args']) != \
+                    (project, options.builder_args):
+        print('Baseline was measured for a different project or builder '
+              'arguments, not comparing:', options.baseline)
+        baseline = None
+    elif baseline is None:
+        print('No baseline at {}, store one with --update-baseline'.format(
+            options.baseline))
+    regressions = compare(results, baseline, options.tolerance, options.min_delta)
+    if regressions:
+        print('\n{} scenario(s) regressed: {}'.format(
+            len(regressions), ', '.join(regressions)))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+    benchmarks.load
+    ---------------
+
+    Load tests the app.py generated for a project, on each server backend.
+    The project (a synthetic one, see benchmarks.synthetic, unless --project
+    is given) is built with the given builder arguments, then the app is
+    launched locally with `--deploy --server <backend>` for every backend and
+    driven by concurrent clients, each in its own process and on a keep-alive
+    connection, requesting a mix of main routes (the views) and static routes.
+
+    For each backend the throughput, the p50/p95/p99 latencies, the number of
+    failed requests and the peak resident memory of the app (and of any
+    worker processes it started) are reported.
+
+    Arguments after `--` are passed to the builder, e.g.
+    `python benchmarks/load.py --backends wsgiref waitress -- --precompress`
+
+    Requirements:
+    * the builder's requirements (libsass, inkscape and imagemagick, ...)
+    * each backend's server package (all that are installed are tested)
+    * psutil (optional, memory is read from /proc on linux without it)
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+import os
+import os.path
+from os.path import abspath, dirname, join
+from argparse import ArgumentParser, RawDescriptionHelpFormatter, REMAINDER
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from http.client import HTTPConnection, HTTPException
+from importlib.util import find_spec
+from subprocess import Popen, DEVNULL
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from io import StringIO
+from sys import executable, path as sys_path
+import random
+import socket
+import json
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+BUILDER_DIR = join(dirname(BENCHMARKS_DIR), 'bottle-builder')
+sys_path.insert(0, BUILDER_DIR)
+
+import builder
+from routes import RouteGenerator
+from synthetic import generate_project, add_project_arguments, get_project_options
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+##### Constants ################################################################
+
+# server backend: the module it requires
+BACKENDS = {
+    'wsgiref': 'wsgiref',
+    'prefork': 'wsgiref',
+    'waitress': 'waitress',
+    'cheroot': 'cheroot',
+    'cherrypy': 'cherrypy',
+    'paste': 'paste',
+    'tornado': 'tornado',
+    'gunicorn': 'gunicorn',
+    'meinheld': 'meinheld',
+    'bjoern': 'bjoern',
+}
+
+HOST = '127.0.0.1'
+
+# seconds to wait for the app to start answering
+STARTUP_TIMEOUT = 30
+
+# seconds between samples of the app's memory
+MEMORY_INTERVAL = 0.1
+
+
+##### Helpers ##################################################################
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+def _rss(pid): # the resident memory of a process and its children, in bytes
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in
+                       [ process ] + process.children(recursive=True))
+        except psutil.Error:
+            return None
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            rss = next(int(l.split()[1]) * 1024 for l in f if l.startswith('VmRSS:'))
+        children = []
+        for tid in os.listdir('/proc/{}/task'.format(pid)):
+            with open('/proc/{}/task/{}/children'.format(pid, tid)) as f:
+                children += [ int(c) for c in f.read().split() ]
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(_rss(child) or 0 for child in children)
+
+def _get_paths(www):
+    # (main route urls, static route urls) the app serves
+    generator = RouteGenerator(dirname(www), www)
+    main = [ '/' + r['path'] for _, r in generator.get_main_routes() ]
+    static = [ '/' + r['path'] for getter in [
+        generator.get_favicon_routes, generator.get_image_routes,
+        generator.get_font_routes, generator.get_css_routes,
+        generator.get_js_routes,
+    ] for _, r in getter() ]
+    return main, static
+
+def _client(port, paths, duration, seed):
+    # runs in a client process, returns (latencies, errors, bytes received)
+    rng = random.Random(seed)
+    connection = HTTPConnection(HOST, port, timeout=10)
+    latencies, errors, received = [], 0, 0
+    end = perf_counter() + duration
+    while perf_counter() < end:
+        path = rng.choice(paths)
+        start = perf_counter()
+        try:
+            connection.request('GET', path, headers={ 'Accept-Encoding': 'gzip, br' })
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, HTTPException):
+            errors += 1
+            connection.close()
+            continue
+        latencies.append(perf_counter() - start)
+        received += len(body)
+        if response.status >= 400:
+            errors += 1
+    connection.close()
+    return latencies, errors, received
+
+def _percentile(ordered, p):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def _wait_until_ready(process, port):
+    deadline = perf_counter() + STARTUP_TIMEOUT
+    while perf_counter() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            connection = HTTPConnection(HOST, port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return True
+        except (OSError, HTTPException):
+            sleep(0.1)
+    return False
+
+
+##### Load Test ################################################################
+
+def load_test(www, backend, paths, clients, duration, warmup):
+    port = _free_port()
+    process = Popen([ executable, 'app.py', '--deploy', '--server', backend,
+                      '--ip', HOST, '--port', str(port) ],
+                    cwd=www, stdout=DEVNULL, stderr=DEVNULL)
+    try:
+        if not _wait_until_ready(process, port):
+            return None
+        with ProcessPoolExecutor(max_workers=clients) as executor:
+            if warmup:
+                list(executor.map(_client, [ port ] * clients, [ paths ] * clients,
+                                  [ warmup ] * clients, range(clients)))
+            futures = [ executor.submit(_client, port, paths, duration, seed)
+                        for seed in range(clients) ]
+            peak = 0
+            while not all(f.done() for f in futures):
+                peak = max(peak, _rss(process.pid) or 0)
+                sleep(MEMORY_INTERVAL)
+            results = [ f.result() for f in futures ]
+    finally:
+        process.terminate()
+        process.wait()
+    latencies = sorted(l for r in results for l in r[0])
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / duration,
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+        'errors': sum(r[1] for r in results),
+        'received': sum(r[2] for r in results),
+        'rss': peak or None,
+    }
+
+
+##### Command Line Interface ###################################################
+
+def parse_args(args=None):
+    parser = ArgumentParser(
+        formatter_class=RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        '--project',
+        type=str,
+        default=None,
+        help='an existing project to build and load test, rather than a '
+        'synthetic one'
+    )
+    parser.add_argument(
+        '--no-build',
+        action='store_true',
+        help='load test the --project as it was last built'
+    )
+    add_project_arguments(parser)
+    parser.add_argument(
+        '--backends',
+        nargs='+',
+        default=None,
+        choices=sorted(BACKENDS),
+        help='the server backends to test. (default every installed one)'
+    )
+    parser.add_argument(
+        '-c', '--clients',
+        type=int,
+        default=8,
+        help='the number of concurrent clients. (default 8)'
+    )
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=10,
+        help='the seconds each backend is tested for. (default 10)'
+    )
+    parser.add_argument(
+        '--warmup',
+        type=float,
+        default=1,
+        help='the seconds of requests before each test. (default 1)'
+    )
+    parser.add_argument(
+        '--static-ratio',
+        type=float,
+        default=0.7,
+        help='the fraction of requests made to static routes. (default 0.7)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default=None,
+        help='write the results to this file as json'
+    )
+    parser.add_argument(
+        'builder_args',
+        nargs=REMAINDER,
+        help='arguments passed to the builder, after --'
+    )
+    options = parser.parse_args(args)
+    if options.builder_args[:1] == [ '--' ]:
+        options.builder_args = options.builder_args[1:]
+    return options
+
+def _mix(main, static, ratio):
+    # a list of urls to choose from uniformly, with the requested ratio
+    if not main or not static:
+        return main or static
+    if ratio <= 0:
+        return main
+    if ratio >= 1:
+        return static
+    # NOTE: the rarer kind of url is weighted by the other's count, so that
+    # neither weight rounds down to nothing
+    if ratio >= 0.5:
+        weight = round(len(main) * ratio / (1 - ratio))
+        return main * len(static) + static * max(1, weight)
+    weight = round(len(static) * (1 - ratio) / ratio)
+    return main * max(1, weight) + static * len(main)
+
+def main(args=None):
+    options = parse_args(args)
+    backends = options.backends or [
+        b for b, module in sorted(BACKENDS.items()) if find_spec(module) ]
+    with TemporaryDirectory() as tmp:
+        path = abspath(options.project or tmp)
+        if not options.project:
+            generate_project(path, **get_project_options(options))
+        if not options.no_build:
+            cwd = os.getcwd()
+            try:
+                with redirect_stdout(StringIO()):
+                    builder.main([ '-p', path ] + options.builder_args)
+            finally:
+                os.chdir(cwd)
+        www = join(path, 'www')
+        main_paths, static_paths = _get_paths(www)
+        paths = _mix(main_paths, static_paths, options.static_ratio)
+        print('{} main and {} static routes, {} clients for {:.0f}s'.format(
+            len(main_paths), len(static_paths), options.clients, options.duration))
+        print('{:<10}{:>10}{:>10}{:>10}{:>10}{:>8}{:>10}'.format(
+            'backend', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'errors',
+            'rss (MB)'))
+        results = {}
+        for backend in backends:
+            result = load_test(www, backend, paths, options.clients,
+                               options.duration, options.warmup)
+            results[backend] = result
+            if result is None:
+                print('{:<10}  failed to start'.format(backend))
+                continue
+            print('{:<10}{:>10.0f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8}{:>10}'.format(
+                backend, result['throughput'], result['p50'] * 1000,
+                result['p95'] * 1000, result['p99'] * 1000, result['errors'],
+                '{:.1f}'.format(result['rss'] / (1 << 20)) if result['rss'] else '-'))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'builder_args': options.builder_args,
+                'clients': options.clients,
+                'duration': options.duration,
+                'static_ratio': options.static_ratio,
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
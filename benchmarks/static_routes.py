@@ -0,0 +1,129 @@
+"""
+    benchmarks.static_routes
+    ------------------------
+
+    Compares the app.py generated with a route per static file against the one
+    generated with --static-table, measuring app startup time (compiling and
+    executing app.py) and the cost of matching a request against the router.
+
+    Each variant is measured in a fresh interpreter, with bottle's `run`
+    replaced so that the app is only defined and never served.
+
+    Requirements:
+    * bottle
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+import os
+import os.path
+from os.path import abspath, dirname, join
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from subprocess import check_output
+from tempfile import TemporaryDirectory
+from sys import executable, path as sys_path
+import json
+
+BUILDER_DIR = join(dirname(dirname(abspath(__file__))), 'bottle-builder')
+sys_path.insert(0, BUILDER_DIR)
+
+from routes import RouteGenerator
+
+
+##### Constants ################################################################
+
+STATIC_FOLDERS = [ 'img', 'font', 'css', 'js', 'favicon' ]
+
+# NOTE: runs in a fresh interpreter inside the generated www directory
+MEASURE_SCRIPT = """\
+import bottle, json, random, sys, time
+bottle.run = lambda *args, **kwargs: None
+sys.argv = [ 'app.py' ]
+start = time.perf_counter()
+with open('app.py') as f:
+    exec(compile(f.read(), 'app.py', 'exec'), {{ '__name__': '__main__' }})
+startup = time.perf_counter() - start
+paths = {paths!r}
+random.seed(0)
+environs = [ {{ 'PATH_INFO': random.choice(paths), 'REQUEST_METHOD': 'GET' }}
+             for _ in range({matches}) ]
+router = bottle.default_app().router
+start = time.perf_counter()
+for environ in environs:
+    router.match(environ)
+match = (time.perf_counter() - start) / len(environs)
+print(json.dumps({{ 'startup': startup, 'match': match,
+                    'routes': len(bottle.default_app().routes) }}))
+"""
+
+
+##### Helpers ##################################################################
+
+def _create_project(path, files):
+    os.makedirs(join(path, 'dev', 'py'))
+    with open(join(path, 'dev', 'py', 'routes.py'), 'w') as f:
+        f.write('')
+    os.makedirs(join(path, 'www', 'views'))
+    with open(join(path, 'www', 'views', 'index.tpl'), 'w') as f:
+        f.write('<html></html>')
+    paths = []
+    for i in range(files):
+        folder = STATIC_FOLDERS[i % len(STATIC_FOLDERS)]
+        os.makedirs(join(path, 'www', 'static', folder), exist_ok=True)
+        filename = 'asset-{}.{}'.format(i, folder)
+        with open(join(path, 'www', 'static', folder, filename), 'w') as f:
+            f.write(filename)
+        paths.append('/' + filename)
+    return paths
+
+def _measure(path, paths, static_table, matches):
+    generator = RouteGenerator(path, join(path, 'www'), static_table=static_table)
+    generator.populate_app_file()
+    script = MEASURE_SCRIPT.format(paths=paths, matches=matches)
+    output = check_output([ executable, '-c', script ], cwd=join(path, 'www'))
+    result = json.loads(output.decode())
+    result['size'] = os.path.getsize(join(path, 'www', 'app.py'))
+    return result
+
+
+##### Command Line Interface ###################################################
+
+def parse_args():
+    parser = ArgumentParser(
+        formatter_class=RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        '-n', '--files',
+        type=int,
+        default=4000,
+        help='the number of static files to generate routes for. (default 4000)'
+    )
+    parser.add_argument(
+        '-m', '--matches',
+        type=int,
+        default=20000,
+        help='the number of requests to match per variant. (default 20000)'
+    )
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    with TemporaryDirectory() as path:
+        paths = _create_project(path, options.files)
+        results = [
+            ('route per file', _measure(path, paths, False, options.matches)),
+            ('static table', _measure(path, paths, True, options.matches)),
+        ]
+    print('{} static files, {} matches'.format(options.files, options.matches))
+    print('{:<16}{:>10}{:>14}{:>14}{:>12}'.format(
+        'variant', 'routes', 'app.py (KB)', 'startup (ms)', 'match (us)'))
+    for name, r in results:
+        print('{:<16}{:>10}{:>14.0f}{:>14.1f}{:>12.2f}'.format(
+            name, r['routes'], r['size'] / 1024, r['startup'] * 1000,
+            r['match'] * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+    benchmarks.synthetic
+    --------------------
+
+    Generates synthetic bottle-builder projects of a configurable size, for
+    benchmarking builds: views nested in folders (each including the ~head,
+    ~nav and ~footer partials), a chain of SASS partials imported by every
+    stylesheet, critical and non-critical stylesheets for each top level view,
+    scripts, PNG images, fonts and a res/favicon.svg.
+
+    The same arguments (and seed) always generate the same project.  Images
+    are encoded without pillow, so nothing beyond the builder's own
+    requirements is needed.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+import os
+import os.path
+from os.path import join, dirname
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+import random
+import struct
+import zlib
+
+
+##### Constants ################################################################
+
+HEAD_VIEW = """\
+<head>
+    <title>{{title}}</title>
+    <meta name="favicon_resources">
+    <meta name="open_graph">
+    <meta name="style_sheets">
+</head>
+"""
+
+NAV_VIEW = """\
+<nav class="site-nav">
+    <a class="nav-link" href="/">Home</a>
+    <a class="nav-link" href="/about">About</a>
+</nav>
+"""
+
+FOOTER_VIEW = """\
+<footer class="site-footer">
+    <p class="footer-text">&copy; synthetic</p>
+</footer>
+"""
+
+PAGE_VIEW = """\
+% include('~head.tpl', title='{title}', description='{title} page')
+<body>
+% include('~nav.tpl')
+    <!-- {title} -->
+    <main class="page page-{index}">
+        <h1 id="title-{index}" class="page-title">{title}</h1>
+{sections}
+    </main>
+% include('~footer.tpl')
+</body>
+"""
+
+SECTION_VIEW = """\
+        <section class="section section-{0}">
+            <h2 class="section-title">Section {0}</h2>
+            <p class="text text-{1}">Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>
+            <img class="image" src="/image-{1}.png" alt="">
+        </section>"""
+
+SVG_FAVICON = """\
+<svg xmlns="http://www.w3.org/2000/svg" width="512" height="512" viewBox="0 0 512 512">
+    <rect width="512" height="512" rx="96" fill="#2a6"/>
+    <circle cx="256" cy="256" r="160" fill="#fff"/>
+</svg>
+"""
+
+API_ROUTES = """\
+@get("/api/ping")
+def ping():
+    return "pong"
+"""
+
+# folders views are nested in, up to the project's depth
+SECTION_FOLDERS = [ 'guides', 'articles', 'archive', 'drafts' ]
+
+
+##### Helpers ##################################################################
+
+def _write(path, *parts, content=''):
+    fp = join(path, *parts)
+    os.makedirs(dirname(fp), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(fp, mode) as f:
+        f.write(content)
+    return fp
+
+def _png(width, height, seed):
+    # an RGB gradient with a little noise, compressible like a real image
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        row = bytearray(b'\x00') # no filter
+        for x in range(width):
+            noise = rng.randrange(8)
+            row += bytes(((x + seed) & 0xFF, (y * 2 + noise) & 0xFF, (x + y) & 0xFF))
+        rows.append(bytes(row))
+    chunk = lambda kind, data: struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data))
+    return b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) + \
+        chunk(b'IEND', b'')
+
+def _get_view_name(i, depth):
+    # index, then page-1, guides/page-2, guides/articles/page-3, ...
+    if i == 0:
+        return 'index'
+    folders = SECTION_FOLDERS[:i % (depth + 1)]
+    return '/'.join(folders + [ 'page-{}'.format(i) ])
+
+def _rules(name, rng, count=6):
+    return '\n'.join(
+        '.{0}-{1} {{ color: $color; margin: {2}px; padding: {3}px; }}\n'
+        '.{0}-{1}:hover {{ color: darken($color, {4}%); }}'.format(
+            name, i, rng.randrange(32), rng.randrange(32), rng.randrange(1, 50))
+        for i in range(count)
+    )
+
+
+##### Project Generator ########################################################
+
+def generate_project(path, views=20, depth=2, images=10, fonts=2, partials=10,
+                     scripts=4, seed=0):
+    rng = random.Random(seed)
+    _write(path, 'dev', 'py', 'routes.py', content=API_ROUTES)
+    _write(path, 'res', 'favicon.svg', content=SVG_FAVICON)
+    _write(path, 'res', 'static', 'robots.txt', content='User-agent: *\n')
+
+    # views
+    _write(path, 'dev', 'views', '~head.tpl', content=HEAD_VIEW)
+    _write(path, 'dev', 'views', '~nav.tpl', content=NAV_VIEW)
+    _write(path, 'dev', 'views', '~footer.tpl', content=FOOTER_VIEW)
+    pages = []
+    for i in range(views):
+        name = _get_view_name(i, depth)
+        sections = '\n'.join(SECTION_VIEW.format(s, rng.randrange(max(images, 1)))
+                             for s in range(rng.randrange(2, 6)))
+        _write(path, 'dev', 'views', name + '.tpl', content=PAGE_VIEW.format(
+            title=name.split('/')[-1].title(), index=i, sections=sections))
+        if '/' not in name:
+            pages.append(name)
+
+    # stylesheets, every one importing the chain of partials
+    _write(path, 'dev', 'sass', 'modules', '_vars.scss', content='$color: #333;\n')
+    _write(path, 'dev', 'sass', 'non-critical', 'modules', '_vars.scss',
+           content='$color: #666;\n')
+    for k in range(partials):
+        imports = '@import "part-{}";\n'.format(k - 1) if k else ''
+        _write(path, 'dev', 'sass', 'partials', '_part-{}.scss'.format(k),
+               content=imports + _rules('part-{}'.format(k), rng) + '\n')
+    _write(path, 'dev', 'sass', 'styles.scss', content='@import "all";\n' +
+           _rules('page', rng) + '\n')
+    _write(path, 'dev', 'sass', 'non-critical', 'styles.scss',
+           content='@import "all";\n' + _rules('footer', rng) + '\n')
+    for page in pages:
+        _write(path, 'dev', 'sass', page + '.scss',
+               content='@import "all";\n' + _rules(page, rng, 2) + '\n')
+        _write(path, 'dev', 'sass', 'non-critical', page + '.scss',
+               content='@import "all";\n' + _rules(page + '-late', rng, 2) + '\n')
+
+    # scripts
+    for s in range(scripts):
+        _write(path, 'dev', 'js', 'script-{}.js'.format(s), content=(
+            '// script {0}\n'
+            'document.addEventListener("DOMContentLoaded", function () {{\n'
+            '    var links = document.querySelectorAll(".nav-link");\n'
+            '    for (var i = 0; i < links.length; i++) {{\n'
+            '        links[i].classList.add("is-ready-{0}");\n'
+            '    }}\n'
+            '}});\n').format(s))
+
+    # images and fonts
+    for m in range(images):
+        size = 64 + rng.randrange(4) * 64
+        _write(path, 'res', 'img', 'image-{}.png'.format(m), content=_png(size, size, m))
+    for f in range(fonts):
+        _write(path, 'res', 'font', 'font-{}.woff2'.format(f),
+               content=bytes(rng.randrange(256) for _ in range(16 * 1024)))
+
+def change_file(path, kind, n=0):
+    # modifies one file of the project, returns its filepath
+    if kind == 'view':
+        fp = join(path, 'dev', 'views', 'index.tpl')
+        with open(fp, 'a') as f:
+            f.write('<!-- change {} -->\n'.format(n))
+    elif kind == 'partial':
+        fp = join(path, 'dev', 'sass', 'partials', '_part-0.scss')
+        with open(fp, 'a') as f:
+            f.write('.change-{} {{ color: red; }}\n'.format(n))
+    elif kind == 'image':
+        fp = join(path, 'res', 'img', 'image-0.png')
+        _write(fp, content=_png(64, 64, 1000 + n))
+    else:
+        raise ValueError('unknown kind of change: ' + kind)
+    return fp
+
+
+##### Command Line Interface ###################################################
+
+def add_project_arguments(parser):
+    parser.add_argument(
+        '--views',
+        type=int,
+        default=20,
+        help='the number of views. (default 20)'
+    )
+    parser.add_argument(
+        '--depth',
+        type=int,
+        default=2,
+        help='the deepest folder views are nested in. (default 2)'
+    )
+    parser.add_argument(
+        '--images',
+        type=int,
+        default=10,
+        help='the number of images in res/img. (default 10)'
+    )
+    parser.add_argument(
+        '--fonts',
+        type=int,
+        default=2,
+        help='the number of fonts in res/font. (default 2)'
+    )
+    parser.add_argument(
+        '--partials',
+        type=int,
+        default=10,
+        help='the number of SASS partials. (default 10)'
+    )
+    parser.add_argument(
+        '--scripts',
+        type=int,
+        default=4,
+        help='the number of scripts in dev/js. (default 4)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='seeds the generated content. (default 0)'
+    )
+
+def get_project_options(options):
+    return { k: getattr(options, k) for k in
+             [ 'views', 'depth', 'images', 'fonts', 'partials', 'scripts', 'seed' ] }
+
+def parse_args():
+    parser = ArgumentParser(
+        formatter_class=RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        'path',
+        type=str,
+        help='where to generate the project, which must not exist yet'
+    )
+    add_project_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    os.makedirs(options.path)
+    generate_project(options.path, **get_project_options(options))
+    print('Generated', options.path)
+
+
+if __name__ == '__main__':
+    main()
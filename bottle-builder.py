@@ -486,14 +486,12 @@ if not args.deploy:
     #sCall('python', 'app.py', '-p', '8081')
     exit(0)
 
-from zipfile import ZipFile
+# NOTE: deflated in parallel, byte-identical for identical sites
+from sys import path as sys_path
+sys_path.insert(0, join(dirname(abspath(__file__)), 'bottle-builder'))
+from package import PackageGenerator
 os.chdir('..') # work on this
-if isfile('www.zip'): os.remove('www.zip')
-with ZipFile('www.zip', 'w') as zip_file:
-    for root, dirs, files in os.walk( join(os.getcwd(), 'www') ):
-        rel_path = relpath(root, os.getcwd())
-        for f in files:
-            zip_file.write( join(rel_path, f) )
+PackageGenerator('www', 'www.zip').package()
 
 # set up watch for template and js files using watchdog
 
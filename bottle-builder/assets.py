@@ -0,0 +1,101 @@
+"""
+    bottle-builder.assets
+    ---------------------
+
+    The assets module writes the asset manifest, a record of every static
+    resource the app serves: its size, modification time, mime type and a
+    strong ETag derived from its content, along with the same for each of its
+    precompressed variants.
+
+    The generated app loads the manifest once at startup, and answers
+    conditional requests (`If-None-Match`, `If-Modified-Since`) for unchanged
+    resources with a 304 straight from memory, without touching the
+    filesystem.
+
+    Entries are keyed by the resource's path relative to the app, e.g.
+
+        "static/css/styles.css": {
+            "size": 5120, "mtime": 1500000000.0, "type": "text/css",
+            "etag": "\\"<sha1>\\"",
+            "encodings": { "gzip": { "size": 1024, "mtime": ..., "etag": ... } }
+        }
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'AssetManifestGenerator', 'ASSETS_FILE' ]
+
+import os
+import os.path
+from os.path import isfile, abspath, normpath, join, relpath
+import mimetypes
+import json
+
+from manifest import hash_file
+from compression import ENCODINGS
+
+
+##### Constants ################################################################
+
+ASSETS_FILE = 'assets.json'
+
+STATIC_DIR = 'static'
+
+
+##### Asset Manifest Generator Class ###########################################
+
+class AssetManifestGenerator:
+
+    def __init__(self, dest_dir):
+        self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www
+
+    def _load(self):
+        try:
+            with open(self.dest_path(ASSETS_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _get_representation(self, fp, previous, timestamp):
+        stat = os.stat(fp)
+        # NOTE: only resources whose size or mtime changed are hashed again
+        if previous and (previous['size'], previous['mtime']) == \
+                        (stat.st_size, stat.st_mtime):
+            etag = previous['etag']
+        else:
+            etag = '"{}"'.format(hash_file(fp))
+        mtime = stat.st_mtime if timestamp is None else timestamp
+        return { 'size': stat.st_size, 'mtime': mtime, 'etag': etag }
+
+    def _get_asset(self, fp, previous, timestamp):
+        asset = self._get_representation(fp, previous, timestamp)
+        asset['type'] = mimetypes.guess_type(fp)[0] or 'application/octet-stream'
+        asset['encodings'] = {}
+        for coding, ext in ENCODINGS:
+            if isfile(fp + ext):
+                asset['encodings'][coding] = self._get_representation(fp + ext,
+                    previous.get('encodings', {}).get(coding), timestamp)
+        return asset
+
+    def _get_resources(self):
+        compressed = tuple(ext for _, ext in ENCODINGS)
+        for root, dirs, files in os.walk(self.dest_path(STATIC_DIR)):
+            for filename in files:
+                if filename.startswith('~'):
+                    continue
+                fp = join(root, filename)
+                if filename.endswith(compressed) and isfile(os.path.splitext(fp)[0]):
+                    continue # a variant, recorded with its original
+                yield fp
+
+    def generate(self, timestamp=None):
+        # timestamp: the mtime to record, that the packaged site's files get
+        previous = self._load()
+        assets = {}
+        for fp in self._get_resources():
+            key = relpath(fp, self.dest_path()).replace('\\', '/')
+            assets[key] = self._get_asset(fp, previous.get(key, {}), timestamp)
+        with open(self.dest_path(ASSETS_FILE), 'w') as f:
+            json.dump(assets, f, indent=1, sort_keys=True)
+        return assets
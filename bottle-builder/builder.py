@@ -3,21 +3,34 @@
 
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from tempfile import gettempdir
+from os.path import abspath, normpath, join, relpath
 import os
 import os.path
 import shutil
+import time
 
 from stylesheets import StylesheetGenerator
 from favicon import FaviconGenerator
 from routes import RouteGenerator
 from head import HeadGenerator
+from compression import CompressionGenerator
+from fingerprint import FingerprintGenerator
+from assets import AssetManifestGenerator
+from views import ViewGenerator
+from javascript import JavascriptGenerator
+from images import ImageGenerator
+from package import PackageGenerator
+from manifest import BuildManifest
+from watcher import Watcher
+from tracing import span
+import tracing
 
 
 ################################################################################
 ##### Command Line Interface ###################################################
 ################################################################################
 
-def parse_args():
+def parse_args(args=None):
     parser = ArgumentParser(
         formatter_class=RawDescriptionHelpFormatter,
         description=__doc__
@@ -30,17 +43,130 @@ def parse_args():
     parser.add_argument(
         "-d", "--deploy",
         action="store_true",
-        help="package site for movement to deployment server. Default path is the"
-        "current working directory, but the path flag will override that value"
+        help="package site for movement to deployment server, as www.zip next "
+        "to www. Default path is the current working directory, but the path "
+        "flag will override that value"
     )
     parser.add_argument(
         "-r", "--reuse",
         action="store_true",
         help="if an already built website exists at the targeted path, attempt to"
         "reuse already present resources (i.e. images, favicon elements and other"
-        "static resources)"
+        "static resources). Resources whose sources are unchanged since the last "
+        "build are skipped, and resources whose sources were removed are deleted"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="the number of build tasks (i.e. favicon renders and stylesheet "
+        "compilations) to run concurrently. Defaults to the number of cores"
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="print the reason each stylesheet is recompiled during a --reuse "
+        "build"
+    )
+    parser.add_argument(
+        "--auto-critical",
+        action="store_true",
+        help="inline only the rules of the compiled stylesheets that match the "
+        "elements, classes and ids in each view (up to its <!-- fold --> "
+        "comment), and defer the rest of the critical css"
+    )
+    parser.add_argument(
+        "--safelist",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="a class or id name (or a pattern, e.g. is-*) whose rules are "
+        "never removed as unused from a --deploy build's stylesheets, for "
+        "names added at runtime. Can be given more than once"
+    )
+    parser.add_argument(
+        "--bundle-js",
+        action="store_true",
+        help="bundle dev/js/*.js into scripts.js and dev/js/<page>/*.js into "
+        "<page>.js, minified and with source maps, and add their <script> tags "
+        "to ~footer.tpl, instead of copying each script to static/js"
+    )
+    parser.add_argument(
+        "--optimize-images",
+        action="store_true",
+        help="losslessly recompress the PNGs (and, with jpegtran installed, "
+        "JPEGs) in res/img. Optimized images are cached in the user cache "
+        "directory"
+    )
+    parser.add_argument(
+        "--webp",
+        action="store_true",
+        help="write a .webp variant of each image in res/img (implies "
+        "--optimize-images)"
+    )
+    parser.add_argument(
+        "--image-widths",
+        type=int,
+        nargs="+",
+        default=[],
+        metavar="WIDTH",
+        help="write downscaled copies (e.g. photo-480w.jpg) of each image in "
+        "res/img wider than each width, for srcset attributes (implies "
+        "--optimize-images)"
+    )
+    parser.add_argument(
+        "--no-image-cache",
+        action="store_true",
+        help="always optimize images, rather than reusing those cached in the "
+        "user cache directory by any previous build"
+    )
+    parser.add_argument(
+        "--favicon-in-memory",
+        action="store_true",
+        help="render the favicon .svg once and downscale every other size in "
+        "memory, instead of launching inkscape and imagemagick for each size"
+    )
+    parser.add_argument(
+        "--no-favicon-cache",
+        action="store_true",
+        help="always render the favicon resources, rather than reusing those "
+        "cached in the user cache directory by any previous build"
+    )
+    parser.add_argument(
+        "-z", "--precompress",
+        action="store_true",
+        help="write gzip (and brotli, if installed) compressed copies of static "
+        "resources, which the app serves to clients that accept them"
+    )
+    parser.add_argument(
+        "--static-table",
+        action="store_true",
+        help="serve static files from a single route backed by a lookup table, "
+        "instead of generating a route for every file"
+    )
+    parser.add_argument(
+        "-f", "--fingerprint",
+        action="store_true",
+        help="reference static resources by urls containing a hash of their "
+        "content (e.g. /styles.1a2b3c4d5e.css), which the app serves with a "
+        "far-future, immutable Cache-Control header"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        metavar="FILE",
+        help="record how long each stage of the build, and each file within "
+        "it, takes and write them to FILE as a Chrome trace (for "
+        "chrome://tracing or ui.perfetto.dev), then print the slowest"
+    )
+    parser.add_argument(
+        "-w", "--watch",
+        action="store_true",
+        help="after building, watch dev/sass, dev/views, dev/js and res for "
+        "changes and rebuild only the affected stylesheets, views and resources"
+    )
+    args = parser.parse_args(args)
     if args.path is None:
         args.path = os.getcwd()
         # if args.deploy:
@@ -49,40 +175,264 @@ def parse_args():
         #     args.path = gettempdir()
     return args
 
-def main():
-    options = parse_args()
+
+################################################################################
+##### Site Builder #############################################################
+################################################################################
+
+WATCHED_FOLDERS = [ 'dev/sass', 'dev/views', 'dev/js', 'res' ]
+
+class SiteBuilder:
+
+    def __init__(self, options):
+        # NOTE: a fresh manifest is still written so the next build can reuse it
+        self.manifest = BuildManifest('.', 'www', reuse=options.reuse)
+        # NOTE: without --fingerprint, urls left fingerprinted in stylesheets
+        #       by a previous build are still restored
+        self.url_rewriter = FingerprintGenerator('www/static',
+            enabled=options.fingerprint)
+        self.fingerprints = self.url_rewriter if options.fingerprint else None
+        self.image_generator = None
+        if options.optimize_images or options.webp or options.image_widths:
+            self.image_generator = ImageGenerator('res/img', 'www/static/img',
+                self.manifest, jobs=options.jobs, webp=options.webp,
+                widths=options.image_widths, cache=not options.no_image_cache)
+        self.routes_generator = RouteGenerator('.', 'www', self.manifest,
+            static_table=options.static_table, fingerprints=self.fingerprints,
+            copy_images=self.image_generator is None)
+        self.styles_generator = StylesheetGenerator('dev/sass', 'www/static',
+            deploy=options.deploy, safelist=options.safelist, jobs=options.jobs,
+            incremental=options.reuse, explain=options.explain,
+            fingerprints=self.fingerprints, auto_critical=options.auto_critical)
+        self.favicon_generator = FaviconGenerator('res/favicon.svg', 'www/static',
+            self.manifest, jobs=options.jobs, in_memory=options.favicon_in_memory,
+            cache=not options.no_favicon_cache, fingerprints=self.fingerprints)
+        self.head_generator = HeadGenerator('www', self.favicon_generator,
+            self.fingerprints)
+        self.scripts_generator = None
+        if options.bundle_js:
+            self.scripts_generator = JavascriptGenerator('dev/js', 'www/static',
+                self.fingerprints)
+        self.compression_generator = None
+        if options.precompress:
+            self.compression_generator = CompressionGenerator('www/static',
+                self.manifest, jobs=options.jobs)
+        self.assets_generator = AssetManifestGenerator('www')
+        self.view_generator = ViewGenerator('www')
+        self.package_generator = None
+        if options.deploy:
+            self.package_generator = PackageGenerator('www', 'www.zip',
+                jobs=options.jobs, source_dirs=[ 'dev', 'res' ])
+        self.src_path = lambda *p: normpath(abspath(join(*p)))
+
+    def _get_timestamp(self):
+        # NOTE: deployed files are dated as the archive dates them
+        if self.package_generator:
+            return self.package_generator.get_timestamp()
+        return None
+
+    def _rewrite_stylesheet_urls(self):
+        # NOTE: before the stylesheets are inlined or fingerprinted themselves
+        self.url_rewriter.rewrite_stylesheets(
+            self.styles_generator.dest_path(),
+            self.styles_generator.critical_path()
+        )
+
+    def _process_views(self):
+        # NOTE: views are copied fresh, then have css and head elements added
+        self.routes_generator.copy_views()
+        self.styles_generator.inline_critical_css()
+        self.styles_generator.load_deferred_styles()
+        if self.scripts_generator:
+            self.scripts_generator.load_scripts()
+        self.head_generator.set_head()
+
+    def build(self):
+        # resources and views
+        # NOTE: this must happen first because static must be copied first, TODO: I hate this
+        with span('copy resources'):
+            self.routes_generator.copy_resources()
+        if self.image_generator:
+            with span('optimize images'):
+                self.image_generator.generate()
+        with span('scripts'):
+            if self.scripts_generator:
+                self.scripts_generator.generate()
+            else:
+                self.routes_generator.copy_scripts()
+        with span('copy views'):
+            self.routes_generator.copy_views()
+
+        # stylesheets
+        with span('compile stylesheets'):
+            self.styles_generator.generate()
+        if self.styles_generator.deploy:
+            with span('optimize stylesheets'):
+                self.styles_generator.optimize()
+        with span('rewrite stylesheet urls'):
+            self._rewrite_stylesheet_urls()
+        with span('inline critical css'):
+            self.styles_generator.inline_critical_css()
+        with span('load deferred styles'):
+            self.styles_generator.load_deferred_styles()
+
+        # script tags
+        if self.scripts_generator:
+            with span('load scripts'):
+                self.scripts_generator.load_scripts()
+
+        # favicons
+        with span('favicons'):
+            self.favicon_generator.generate_resources()
+
+        # head elements
+        with span('set head'):
+            self.head_generator.set_head()
+
+        # NOTE: after every stage that writes into the views
+        if self.styles_generator.deploy:
+            with span('minify views'):
+                self.view_generator.minify_views()
+
+        # validate the finished views, and precompile them for the app
+        with span('compile views'):
+            self.view_generator.compile_views()
+
+        # precompressed resources
+        if self.compression_generator:
+            with span('precompress'):
+                self.compression_generator.compress()
+
+        # sizes, etags and modification times, loaded by the app at startup
+        with span('asset manifest'):
+            self.assets_generator.generate(self._get_timestamp())
+
+        # TODO: remove head from favicons before generating app.py
+        # TODO: parse out critical CSS before generating app.py
+        with span('populate app file'):
+            self.routes_generator.populate_app_file()
+
+        # remove the outputs of deleted sources and record this build
+        with span('save manifest'):
+            self.manifest.prune()
+            self.manifest.save()
+
+        # the archive moved to the deployment server
+        if self.package_generator:
+            with span('package'):
+                self.package_generator.package()
+
+    def rebuild(self, paths):
+        with span('rebuild', files=len(paths)):
+            self._rebuild(paths)
+
+    def _rebuild(self, paths):
+        # re-run only the stages affected by the changed files
+        start = time.perf_counter()
+        in_folder = lambda fp, f: fp.startswith(self.src_path(f) + os.sep)
+        route_files = self.routes_generator.get_route_files()
+        rebuild_styles, rebuild_favicon, all_views, views = False, False, False, []
+        rebuild_scripts = False
+        for fp in sorted(paths):
+            if in_folder(fp, 'dev/sass'):
+                rebuild_styles = True
+            elif in_folder(fp, 'dev/js') and self.scripts_generator:
+                rebuild_scripts = True
+            elif in_folder(fp, 'dev/views'):
+                views.append(fp)
+                # partials are included in every view
+                all_views |= os.path.basename(fp).startswith('~')
+            elif fp == self.src_path('res', 'favicon.svg'):
+                rebuild_favicon = True
+            elif not (self.routes_generator.copy_resource(fp) or
+                      self.routes_generator.copy_script(fp) or
+                      self.image_generator and self.image_generator.update_image(fp)):
+                continue
+            print('Changed', relpath(fp))
+        if rebuild_scripts:
+            # NOTE: the script tags for the bundles are written into the views
+            bundles = sorted(self.scripts_generator.get_bundles())
+            self.scripts_generator.generate()
+            all_views |= bundles != sorted(self.scripts_generator.get_bundles())
+        # NOTE: deploy stylesheets are pruned against every view and script
+        rebuild_styles |= self.styles_generator.deploy and bool(paths)
+        if rebuild_styles:
+            # NOTE: critical css is inlined into, and the list of stylesheets
+            #       written into, the views
+            stylesheets = sorted(os.listdir(self.styles_generator.dest_path()))
+            compiled = self.styles_generator.generate()
+            if self.styles_generator.deploy:
+                self.styles_generator.optimize()
+            all_views |= any(self.styles_generator.is_critical(dest)
+                             for _, dest in compiled)
+            all_views |= stylesheets != sorted(os.listdir(self.styles_generator.dest_path()))
+        if rebuild_favicon:
+            self.favicon_generator.generate_resources()
+            all_views = True
+        if self.fingerprints and any(not in_folder(fp, 'dev/views') for fp in paths):
+            # any changed resource changes the urls written into the views
+            self._rewrite_stylesheet_urls()
+            all_views = True
+        # NOTE: extracted critical css depends on every view and stylesheet
+        all_views |= self.styles_generator.auto_critical and bool(rebuild_styles or views)
+        if all_views:
+            self._process_views()
+        else:
+            for fp in views:
+                self.routes_generator.copy_view(fp)
+            self.styles_generator.inline_critical_css([
+                os.path.splitext(relpath(fp, self.src_path('dev', 'views')))[0]
+                for fp in views
+            ])
+        if self.styles_generator.deploy:
+            self.view_generator.minify_views()
+        self.view_generator.compile_views()
+        if self.compression_generator:
+            self.compression_generator.compress()
+        self.assets_generator.generate(self._get_timestamp())
+        if self.fingerprints or route_files != self.routes_generator.get_route_files():
+            self.routes_generator.populate_app_file()
+        self.manifest.save()
+        if self.package_generator:
+            self.package_generator.package()
+        print('Rebuilt in {:.0f}ms'.format((time.perf_counter() - start) * 1000))
+
+    def watch(self):
+        # NOTE: anything changed after the initial build is rebuilt incrementally
+        self.styles_generator.incremental = True
+        print('Watching', ', '.join(WATCHED_FOLDERS), '(Ctrl-C to stop)')
+        Watcher(WATCHED_FOLDERS, self.rebuild).run()
+
+
+def main(args=None):
+    options = parse_args(args)
     print(options.path)
+    if options.trace: # relative to where the builder was run
+        options.trace = abspath(options.trace)
     # NOTE: don't change the working directory so that you can use the the templates in this package
     os.chdir(options.path)
+    if options.reuse:
+        os.makedirs('www', exist_ok=True)
+    else:
+        try:
+            os.makedirs('www', exist_ok=False)
+        except OSError as e:
+            shutil.rmtree('www')
+            os.makedirs('www')
+
+    if options.trace:
+        tracing.enable()
+    site_builder = SiteBuilder(options)
     try:
-        os.makedirs('www', exist_ok=False)
-    except OSError as e:
-        shutil.rmtree('www')
-        os.makedirs('www')
-
-    # resources and views
-    # NOTE: this must happen first because static must be copied first, TODO: I hate this
-    routes_generator = RouteGenerator('.', 'www')
-    routes_generator.copy_resources()
-    routes_generator.copy_views()
-
-    # stylesheets
-    styles_generator = StylesheetGenerator('dev/sass', 'www/static')
-    styles_generator.generate()
-    styles_generator.inline_critical_css()
-    styles_generator.load_deferred_styles()
-
-    # favicons
-    favicon_generator = FaviconGenerator('res/favicon.svg', 'www/static')
-    favicon_generator.generate_resources()
-
-    # head elements
-    head_generator = HeadGenerator('www', favicon_generator)
-    head_generator.set_head()
-
-    # TODO: remove head from favicons before generating app.py
-    # TODO: parse out critical CSS before generating app.py
-    routes_generator.populate_app_file()
+        with span('build'):
+            site_builder.build()
+        if options.watch:
+            site_builder.watch()
+    finally:
+        # NOTE: a watch is traced until it's stopped, rebuilds and all
+        if options.trace:
+            tracing.write_trace(options.trace)
+            tracing.print_summary()
 
 
 if __name__ == '__main__':
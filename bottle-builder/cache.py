@@ -0,0 +1,73 @@
+"""
+    bottle-builder.cache
+    --------------------
+
+    The cache module provides a content-addressed file store kept in the user's
+    cache directory, so that expensive build outputs can be shared between
+    builds and between projects.  Callers derive a key from everything that
+    affects an output (typically the content hash of its source plus the
+    version of the tool that produced it) and the cache never needs to be
+    invalidated, only cleared.
+
+    The cache directory can be set with the BOTTLE_BUILDER_CACHE environment
+    variable, and otherwise follows the platform's conventions.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'ContentCache', 'get_cache_dir', 'hash_key' ]
+
+import os
+import os.path
+from os.path import isfile, expanduser, join, dirname
+import hashlib
+import shutil
+import tempfile
+
+
+##### Helpers ##################################################################
+
+def get_cache_dir():
+    if os.environ.get('BOTTLE_BUILDER_CACHE'):
+        return os.environ['BOTTLE_BUILDER_CACHE']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', expanduser(join('~', '.cache')))
+    return join(base, 'bottle-builder')
+
+def hash_key(*parts):
+    return hashlib.sha1(':'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+##### Content Cache Class ######################################################
+
+class ContentCache:
+
+    def __init__(self, namespace, cache_dir=None):
+        self.root = join(cache_dir or get_cache_dir(), namespace)
+        self.cache_path = lambda k: join(self.root, k[:2], k)
+
+    def has(self, key):
+        return isfile(self.cache_path(key))
+
+    def fetch(self, key, dest_fp):
+        try:
+            shutil.copyfile(self.cache_path(key), dest_fp)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, src_fp):
+        path = self.cache_path(key)
+        os.makedirs(dirname(path), exist_ok=True)
+        # NOTE: copy then rename, so concurrent builds never see partial files
+        fd, tmp = tempfile.mkstemp(dir=dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp_f, open(src_fp, 'rb') as src_f:
+                shutil.copyfileobj(src_f, tmp_f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
@@ -0,0 +1,103 @@
+"""
+    bottle-builder.compression
+    --------------------------
+
+    The compression module precompresses static resources at build time, so
+    the server never has to compress the same bytes on every request.  A .gz
+    (and, when brotli is installed, a .br) sibling is written next to every
+    compressible resource, and is discarded again if it doesn't save enough to
+    be worth serving.  The generated app picks the best variant the client
+    accepts.
+
+    Optional Requirements:
+    * brotli
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'CompressionGenerator', 'ENCODINGS' ]
+
+import os
+import os.path
+from os.path import isfile, abspath, normpath, join, splitext
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+
+from tracing import span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+##### Constants ################################################################
+
+# NOTE: fonts other than .woff/.woff2, which are already compressed
+COMPRESSIBLE_EXTENSIONS = [ '.css', '.js', '.map', '.json', '.svg', '.html',
+                            '.txt', '.xml', '.ico', '.ttf', '.otf', '.eot',
+                            '.webmanifest' ]
+
+# (content-coding, file extension) in order of preference
+ENCODINGS = [ ('br', '.br'), ('gzip', '.gz') ]
+
+# variants that save less than this fraction of the original are discarded
+MIN_SAVINGS = 0.05
+
+
+##### Helpers ##################################################################
+
+def _is_compressible(filepath):
+    return splitext(filepath)[-1].lower() in COMPRESSIBLE_EXTENSIONS
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # NOTE: mtime is fixed so identical inputs produce identical outputs
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+##### Compression Generator Class ##############################################
+
+class CompressionGenerator:
+
+    def __init__(self, dest_dir, manifest=None, jobs=None):
+        self.dest_dir = abspath(dest_dir) # "www/static"
+        self.manifest = manifest # BuildManifest, skips unchanged resources
+        self.jobs = jobs or os.cpu_count() or 1
+        self.encodings = [ e for e in ENCODINGS if e[0] != 'br' or brotli ]
+
+    def _get_resources(self):
+        for root, dirs, files in os.walk(self.dest_dir):
+            for filename in files:
+                fp = normpath(join(root, filename))
+                if _is_compressible(fp):
+                    yield fp
+
+    def _compress_resource(self, fp):
+        if self.manifest and self.manifest.is_current(fp):
+            return 0
+        with open(fp, 'rb') as f:
+            data = f.read()
+        outputs, saved = [], 0
+        for encoding, ext in self.encodings:
+            with span(os.path.relpath(fp, self.dest_dir) + ext, 'compress'):
+                compressed = _compress(data, encoding)
+            if len(compressed) > len(data) * (1 - MIN_SAVINGS):
+                if isfile(fp + ext): # stale from a previous build
+                    os.remove(fp + ext)
+                continue
+            with open(fp + ext, 'wb') as f:
+                f.write(compressed)
+            outputs.append(fp + ext)
+            saved = max(saved, len(data) - len(compressed))
+        if self.manifest:
+            self.manifest.record(fp, *outputs)
+        return saved
+
+    def compress(self):
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            saved = sum(executor.map(self._compress_resource, self._get_resources()))
+        if saved:
+            print('Precompressed variants save up to {:.1f}KB'.format(saved / 1024))
@@ -0,0 +1,401 @@
+"""
+    bottle-builder.css
+    ------------------
+
+    The css module parses compiled stylesheets into rules and at-rules, writes
+    them back out (expanded or minified), and matches selectors against the
+    elements, classes and ids found in a page's markup (see the markup module).
+    For deployment it also prunes rules nothing on the site can match, and
+    merges duplicate rules where doing so can't change the cascade.
+
+    Matching is deliberately conservative: a selector is kept if every
+    compound selector in it names only elements, classes and ids that appear
+    somewhere on the page.  Combinators, attribute selectors and pseudo
+    classes aren't evaluated, so a selector that can't match is sometimes
+    kept, but one that can match is never dropped.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'Rule', 'AtRule', 'parse_stylesheet', 'serialize', 'minify',
+            'split_selectors', 'selector_matches', 'extract_rules',
+            'prune_rules', 'merge_rules', 'count_selectors' ]
+
+import re
+
+
+##### Constants ################################################################
+
+# at-rules whose blocks hold rules, rather than declarations
+GROUPING_AT_RULES = [ 'media', 'supports', 'document', '-moz-document',
+                      'layer', 'container' ]
+
+# at-rules kept only if a kept rule refers to the name they define
+REFERENCED_AT_RULES = {
+    'font-face': re.compile(r'font-family\s*:\s*([^;]+)', re.I),
+    'keyframes': None, '-webkit-keyframes': None, '-moz-keyframes': None,
+}
+
+### Patterns
+
+# strings are matched so that comment markers inside of them are left alone
+COMMENT_PATTERN = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+AT_RULE_PATTERN = re.compile(r'@([\w-]+)\s*(.*)$', re.S)
+COMBINATOR_PATTERN = re.compile(r'(?<!\\)[\s>+~]+')
+SIMPLE_PATTERN = re.compile(r'([#.]?)((?:\\.|[\w-])+)|(\*)')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+IDENTIFIER_PATTERN = re.compile(r'[\w-]+')
+PSEUDO_PATTERN = re.compile(r'(?<!\\)::?([\w-]+)')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# pseudo classes and elements every browser understands; a selector list with
+# any other (e.g. ::-moz-placeholder) is dropped whole by browsers that don't,
+# so rules with those aren't merged with any other
+MERGEABLE_PSEUDOS = [
+    'active', 'after', 'before', 'checked', 'disabled', 'empty', 'enabled',
+    'first-child', 'first-letter', 'first-line', 'first-of-type', 'focus',
+    'hover', 'lang', 'last-child', 'last-of-type', 'link', 'not', 'nth-child',
+    'nth-last-child', 'nth-last-of-type', 'nth-of-type', 'only-child',
+    'only-of-type', 'root', 'target', 'visited',
+]
+
+# characters that never need whitespace around them
+SELECTOR_PUNCTUATION = ',>+~'
+DECLARATION_PUNCTUATION = ':;,{}'
+
+
+##### Nodes ####################################################################
+
+class Rule:
+
+    def __init__(self, selectors, body):
+        self.selectors = selectors # [ "a:hover", ".nav > li" ]
+        self.body = body # declarations, unparsed
+
+    def copy(self, selectors=None):
+        return Rule(self.selectors if selectors is None else selectors, self.body)
+
+class AtRule:
+
+    def __init__(self, name, prelude, body=None, rules=None):
+        self.name = name # "media", without the @
+        self.prelude = prelude # "screen and (min-width: 40em)"
+        self.body = body # unparsed block contents, e.g. of a @font-face
+        self.rules = rules # parsed block contents, for grouping at-rules
+
+    def copy(self, rules=None):
+        return AtRule(self.name, self.prelude, self.body,
+                      self.rules if rules is None else rules)
+
+
+##### Parsing ##################################################################
+
+def _scan(css, i, stops):
+    # the index of the first stop character outside of strings and brackets
+    depth, quote = 0, None
+    while i < len(css):
+        c = css[i]
+        if quote:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif depth == 0 and c in stops:
+            return i
+        elif c in '"\'':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth = max(depth - 1, 0)
+        i += 1
+    return len(css)
+
+def _match_brace(css, i): # i is the index of an opening brace
+    depth = 0
+    while i < len(css):
+        i = _scan(css, i, '{}')
+        if i == len(css):
+            return i
+        depth += 1 if css[i] == '{' else -1
+        if depth == 0:
+            return i
+        i += 1
+    return i
+
+def _parse(css):
+    nodes, i = [], 0
+    while i < len(css):
+        end = _scan(css, i, '{;}')
+        prelude = css[i:end].strip()
+        if end == len(css) or css[end] in ';}':
+            # a statement at-rule, e.g. @import or @charset
+            match = AT_RULE_PATTERN.match(prelude)
+            if match:
+                nodes.append(AtRule(match.group(1).lower(), match.group(2).strip()))
+            i = end + 1
+            continue
+        close = _match_brace(css, end)
+        body = css[end + 1:close]
+        match = AT_RULE_PATTERN.match(prelude)
+        if not match:
+            nodes.append(Rule(split_selectors(prelude), body.strip()))
+        elif match.group(1).lower() in GROUPING_AT_RULES:
+            nodes.append(AtRule(match.group(1).lower(), match.group(2).strip(),
+                                rules=_parse(body)))
+        else:
+            nodes.append(AtRule(match.group(1).lower(), match.group(2).strip(),
+                                body=body.strip()))
+        i = close + 1
+    return nodes
+
+def parse_stylesheet(css):
+    return _parse(COMMENT_PATTERN.sub(lambda m: m.group(1) or '', css))
+
+def split_selectors(prelude): # ".a, .b:not(.c, .d)" -> [ ".a", ".b:not(.c, .d)" ]
+    selectors, i = [], 0
+    while i < len(prelude):
+        end = _scan(prelude, i, ',')
+        selector = ' '.join(prelude[i:end].split())
+        if selector:
+            selectors.append(selector)
+        i = end + 1
+    return selectors
+
+
+##### Serializing ##############################################################
+
+def _at_rule(node): # "@media screen", or "@font-face" without a prelude
+    return '@' + node.name + (' ' + node.prelude if node.prelude else '')
+
+def _indent(text, indent):
+    return '\n'.join(indent + line.strip() for line in text.splitlines() if line.strip())
+
+def serialize(nodes, indent=''):
+    out = []
+    for node in nodes:
+        if isinstance(node, Rule):
+            out.append('{}{} {{\n{}\n{}}}'.format(indent,
+                (',\n' + indent).join(node.selectors),
+                _indent(node.body, indent + '  '), indent))
+        elif node.rules is not None:
+            out.append('{}{} {{\n{}\n{}}}'.format(indent, _at_rule(node),
+                serialize(node.rules, indent + '  '), indent))
+        elif node.body is not None:
+            out.append('{}{} {{\n{}\n{}}}'.format(indent, _at_rule(node),
+                _indent(node.body, indent + '  '), indent))
+        else:
+            out.append('{}{};'.format(indent, _at_rule(node)))
+    return '\n'.join(out) + ('\n' if out and not indent else '')
+
+
+def _compress(text, punctuation, nested=True):
+    # collapses whitespace outside of strings, dropping it entirely next to
+    # punctuation (only outside of brackets, unless nested)
+    out, i, depth = [], 0, 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            end = i + 1
+            while end < len(text) and text[end] != c:
+                end += 2 if text[end] == '\\' else 1
+            out.append(text[i:end + 1])
+            i = end + 1
+            continue
+        if c.isspace():
+            end = i
+            while end < len(text) and text[end].isspace():
+                end += 1
+            after = text[end:end + 1]
+            before = out[-1][-1:] if out else ''
+            if before and after and not ((nested or depth == 0) and
+                    (before in punctuation or after in punctuation)):
+                out.append(' ')
+            i = end
+            continue
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth = max(depth - 1, 0)
+        out.append(c)
+        i += 1
+    return ''.join(out)
+
+def _drop_semicolons(body):
+    # ";}" -> "}", outside of strings and brackets (e.g. url() or data uris)
+    out, i = [], 0
+    while i < len(body):
+        end = _scan(body, i, ';')
+        out.append(body[i:end])
+        if end < len(body) and body[end + 1:end + 2] != '}':
+            out.append(';')
+        i = end + 1
+    return ''.join(out)
+
+def _minify_body(body):
+    body = _compress(body, DECLARATION_PUNCTUATION).strip()
+    while body.endswith(';'):
+        body = body[:-1]
+    return _drop_semicolons(body)
+
+def minify(nodes):
+    out = []
+    for node in nodes:
+        if isinstance(node, Rule):
+            out.append('{}{{{}}}'.format(
+                ','.join(_compress(s, SELECTOR_PUNCTUATION, nested=False)
+                         for s in node.selectors),
+                _minify_body(node.body)))
+        elif node.rules is not None:
+            out.append('{}{{{}}}'.format(_compress(_at_rule(node), ''),
+                                         minify(node.rules)))
+        elif node.body is not None:
+            out.append('{}{{{}}}'.format(_compress(_at_rule(node), ''),
+                                         _minify_body(node.body)))
+        else:
+            out.append('{};'.format(_compress(_at_rule(node), '')))
+    return ''.join(out)
+
+
+##### Selector Matching ########################################################
+
+def _strip_pseudo(selector):
+    # removes pseudo classes and elements (with their arguments) and attribute
+    # selectors, none of which are evaluated
+    out, i = [], 0
+    while i < len(selector):
+        c = selector[i]
+        if c == '\\':
+            out.append(selector[i:i + 2])
+            i += 2
+        elif c == '[':
+            i = _scan(selector, i + 1, ']') + 1
+        elif c == ':':
+            i += 1
+            while i < len(selector) and (selector[i] == ':' or
+                  IDENTIFIER_PATTERN.match(selector[i])):
+                i += 1
+            if i < len(selector) and selector[i] == '(':
+                i = _scan(selector, i + 1, ')') + 1
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+def selector_matches(selector, markup):
+    for compound in COMBINATOR_PATTERN.split(_strip_pseudo(selector)):
+        for simple in SIMPLE_PATTERN.finditer(compound):
+            prefix, name, universal = simple.groups()
+            if universal:
+                continue
+            name = ESCAPE_PATTERN.sub(r'\1', name)
+            if prefix == '.' and not markup.has_class(name):
+                return False
+            if prefix == '#' and not markup.has_id(name):
+                return False
+            if not prefix and not markup.has_element(name):
+                return False
+    return True
+
+
+##### Rule Extraction ##########################################################
+
+def _references(node, bodies):
+    if node.name == 'font-face':
+        match = REFERENCED_AT_RULES['font-face'].search(node.body or '')
+        names = [ n.strip(' \'"') for n in match.group(1).split(',') ] if match else []
+    else:
+        names = [ node.prelude.strip(' \'"') ]
+    return any(name and name in bodies for name in names)
+
+def _extract(nodes, matches):
+    kept, rest = [], []
+    for node in nodes:
+        if isinstance(node, Rule):
+            selectors = [ s for s in node.selectors if matches(s) ]
+            if selectors:
+                kept.append(node.copy(selectors))
+            if len(selectors) < len(node.selectors):
+                rest.append(node.copy([ s for s in node.selectors if s not in selectors ]))
+        elif node.rules is not None:
+            k, r = _extract(node.rules, matches)
+            if k:
+                kept.append(node.copy(k))
+            if r:
+                rest.append(node.copy(r))
+        elif node.name in REFERENCED_AT_RULES:
+            rest.append(node) # decided once the rules that refer to it are known
+        elif node.body is None:
+            kept.append(node) # e.g. @import, which has to stay first
+        else:
+            rest.append(node)
+    return kept, rest
+
+def _bodies(nodes):
+    return ' '.join(n.body if isinstance(n, Rule) else _bodies(n.rules or [])
+                    for n in nodes)
+
+def extract_rules(nodes, matches): # returns (matching nodes, the rest)
+    # NOTE: keeps @font-face and @keyframes used by the matching rules
+    kept, rest = _extract(nodes, matches)
+    bodies = _bodies(kept)
+    referenced = [ n for n in rest if isinstance(n, AtRule) and
+                   n.name in REFERENCED_AT_RULES and _references(n, bodies) ]
+    # NOTE: after any @charset and @import, which have to come first
+    leading = 0
+    while leading < len(kept) and isinstance(kept[leading], AtRule) and \
+          kept[leading].body is None and kept[leading].rules is None:
+        leading += 1
+    kept[leading:leading] = referenced
+    return kept, [ n for n in rest if n not in referenced ]
+
+
+##### Optimization #############################################################
+
+def prune_rules(nodes, matches):
+    # NOTE: unlike extract_rules, at-rules that can't be matched are kept
+    kept, rest = extract_rules(nodes, matches)
+    return kept + [ n for n in rest if isinstance(n, AtRule) and
+                    n.rules is None and n.name not in REFERENCED_AT_RULES ]
+
+def _key(rule):
+    return (tuple(rule.selectors), _minify_body(rule.body))
+
+def _is_mergeable(rule):
+    # whether every browser understands all of the rule's selectors
+    return all(name.lower() in MERGEABLE_PSEUDOS for selector in rule.selectors
+               for name in PSEUDO_PATTERN.findall(selector))
+
+def merge_rules(nodes):
+    # an earlier copy of an identical rule can be dropped, the later one wins
+    # anyway; and neighbouring rules with the same selectors or the same
+    # declarations can be combined
+    nodes = [ n.copy(merge_rules(n.rules)) if isinstance(n, AtRule) and
+              n.rules is not None else n for n in nodes ]
+    later, unique = set(), []
+    for node in reversed(nodes):
+        if isinstance(node, Rule):
+            if _key(node) in later:
+                continue
+            later.add(_key(node))
+        unique.append(node)
+    merged = []
+    for node in reversed(unique):
+        previous = merged[-1] if merged else None
+        if isinstance(node, Rule) and isinstance(previous, Rule):
+            if previous.selectors == node.selectors:
+                merged[-1] = Rule(node.selectors, '{};{}'.format(
+                    _minify_body(previous.body), _minify_body(node.body)))
+                continue
+            if _minify_body(previous.body) == _minify_body(node.body) and \
+               _is_mergeable(previous) and _is_mergeable(node):
+                merged[-1] = previous.copy(previous.selectors +
+                    [ s for s in node.selectors if s not in previous.selectors ])
+                continue
+        merged.append(node)
+    return merged
+
+def count_selectors(nodes):
+    return sum(len(n.selectors) if isinstance(n, Rule) else
+               count_selectors(n.rules or []) for n in nodes)
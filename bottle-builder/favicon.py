@@ -10,6 +10,18 @@
     * inkscape
     * imagemagick
 
+    The in-memory pipeline renders the .svg once, at the largest size, and
+    downscales every other size from that render.  It writes the .ico directly
+    and only launches `inkscape` once, or not at all if cairosvg is installed.
+
+    In-Memory Requirements:
+    * pillow
+    * cairosvg (optional)
+
+    Generated resources are cached in the user's cache directory (see the cache
+    module), keyed on the content of the .svg and the version of the renderer,
+    so rebuilding any project with an unchanged favicon renders nothing.
+
     :copyright: (c) 2017 by Nick Balboni.
     :license: MIT.
 """
@@ -18,9 +30,25 @@ __all__ = [ 'FaviconGenerator' ]
 
 import os
 from os.path import isfile, isdir, abspath, normpath, join
+from shutil import rmtree, which
+from concurrent.futures import ThreadPoolExecutor, wait
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from io import BytesIO
 
 from overrides import sCall
+from cache import ContentCache, hash_key
+from manifest import hash_file
+from tracing import span
+
+try: # only required for the in-memory pipeline
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try: # renders the .svg without launching `inkscape`
+    import cairosvg
+except ImportError:
+    cairosvg = None
 
 
 ##### Constants ################################################################
@@ -31,6 +59,9 @@ android_tpl  = lambda r: "touch-icon-{0}x{0}.png".format(r)
 apple_tpl    = lambda r: "apple-touch-icon-{0}x{0}.png".format(r)
 precomp_tpl  = lambda r: "apple-touch-icon-{0}x{0}-precomposed.png".format(r)
 
+# NOTE: bump to invalidate cached resources when the rendering itself changes
+PIPELINE_VERSION = 1
+
 ### Resolution Lists
 ico_res     = [ "16", "24", "32", "48", "64", "128", "256" ]
 favicon_res = [ "16", "32", "96", "160", "196", "300" ]
@@ -38,15 +69,53 @@ android_res = [ "192" ]
 apple_res   = [ "57", "76", "120", "152", "180" ] # add to head backwards
 
 
+##### Helpers ##################################################################
+
+def _unique(items): # removes duplicates, preserving order
+    seen = set()
+    return [ x for x in items if not (x in seen or seen.add(x)) ]
+
+def _get_renders(): # (resolution, filename template) of every png to keep
+    return (
+        [ (res, favicon_tpl) for res in favicon_res ] +
+        [ (res, android_tpl) for res in android_res ] +
+        [ (res, apple_tpl) for res in apple_res ]
+    )
+
+def _get_outputs(): # filenames of every generated resource
+    return [ file_tpl(res) for res, file_tpl in _get_renders() ] + ['favicon.ico']
+
+def _tool_version(name):
+    # NOTE: identifies an install without launching it, `--version` is slow
+    path = which(name)
+    if path is None:
+        return name
+    stat = os.stat(path)
+    return '{}@{}:{}:{}'.format(name, path, stat.st_size, int(stat.st_mtime))
+
+def _downscale(image, res):
+    # NOTE: resample premultiplied so transparent edges don't bleed dark
+    size = (int(res), int(res))
+    if image.size == size:
+        return image
+    return image.convert('RGBa').resize(size, Image.LANCZOS).convert('RGBA')
+
+
 ##### Favicon Generator Class ##################################################
 
 class FaviconGenerator: # TODO: routes and precomposed
 
-    def __init__(self, template_fp, result_fp):
+    def __init__(self, template_fp, result_fp, manifest=None, jobs=None,
+                 in_memory=False, cache=True, fingerprints=None):
         # NOTE: abspath required for `inkscape` and `convert` commands
         self.template_fp = abspath(template_fp)
         self.result_fp = abspath(join(result_fp, 'favicon'))
         self.result_path = lambda p: normpath(join(self.result_fp, p)) # normpath for windows users TODO: preferably get rid of this
+        self.manifest = manifest # BuildManifest, skips an unchanged template
+        self.jobs = jobs or os.cpu_count() or 1 # concurrent `inkscape` calls
+        self.in_memory = in_memory # render once and downscale with pillow
+        self.cache = ContentCache('favicons') if cache else None
+        self.url = fingerprints.url if fingerprints else lambda url: url
 
     def _generate_pngs(self, res, file_tpl):
         path = self.result_path(file_tpl(res))
@@ -54,27 +123,107 @@ class FaviconGenerator: # TODO: routes and precomposed
             return
         if not isfile(self.template_fp): #TODO: make this more pythonic (try/except)
             raise FileNotFoundError
-        sCall('inkscape', '-z', '-e', path, '-w', res, '-h', res, self.template_fp)
+        with span(file_tpl(res), 'inkscape'):
+            sCall('inkscape', '-z', '-e', path, '-w', res, '-h', res, self.template_fp)
 
     def _generate_ico(self):
         args = [ favicon_tpl(res) for res in ico_res ]
         args.append('favicon.ico')
-        sCall('convert', *[ self.result_path(p) for p in args ])
+        with span('favicon.ico', 'convert'):
+            sCall('convert', *[ self.result_path(p) for p in args ])
 
-    def generate_resources(self):
-        os.makedirs(self.result_fp) # throws OSError (FileExistsError)
-        for res in ico_res + favicon_res:
-            self._generate_pngs(res, favicon_tpl)
-        for res in android_res:
-            self._generate_pngs(res, android_tpl)
-        for res in apple_res:
-            self._generate_pngs(res, apple_tpl)
-        self._generate_ico()
+    def _render_with_inkscape(self):
+        renders = (
+            [ (res, favicon_tpl) for res in _unique(ico_res + favicon_res) ] +
+            [ (res, android_tpl) for res in android_res ] +
+            [ (res, apple_tpl) for res in apple_res ]
+        )
+        # NOTE: every size is independent, only the .ico waits on its inputs
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pngs = { r: executor.submit(self._generate_pngs, *r) for r in renders }
+            ico_pngs = [ pngs[(res, favicon_tpl)] for res in ico_res ]
+            wait(ico_pngs)
+            for future in ico_pngs:
+                future.result() # raise any errors before assembling the .ico
+            ico = executor.submit(self._generate_ico)
+            for future in list(pngs.values()) + [ ico ]:
+                future.result()
         # clean up unnecessary files
         for res in ico_res:
             if res not in favicon_res:
                 os.remove(self.result_path(favicon_tpl(res)))
 
+    def _render_master(self, res, file_tpl):
+        if not isfile(self.template_fp):
+            raise FileNotFoundError(self.template_fp)
+        if cairosvg is not None:
+            with span(file_tpl(res), 'cairosvg'):
+                png = cairosvg.svg2png(url=self.template_fp,
+                    output_width=int(res), output_height=int(res))
+            return Image.open(BytesIO(png)).convert('RGBA')
+        # a single `inkscape` launch, rendering straight to a kept png
+        self._generate_pngs(res, file_tpl)
+        with open(self.result_path(file_tpl(res)), 'rb') as f:
+            return Image.open(BytesIO(f.read())).convert('RGBA')
+
+    def _render_in_memory(self):
+        if Image is None:
+            raise ImportError('pillow is required to render favicons in memory')
+        renders = _get_renders()
+        largest = max(renders, key=lambda r: int(r[0]))
+        master = self._render_master(*largest)
+        for res, file_tpl in renders:
+            path = self.result_path(file_tpl(res))
+            if isfile(path): # the master render when made by `inkscape`
+                continue
+            with span(file_tpl(res), 'downscale'):
+                _downscale(master, res).save(path, optimize=True)
+        frames = [ _downscale(master, res) for res in ico_res ]
+        frames.sort(key=lambda f: f.size[0], reverse=True)
+        frames[0].save(self.result_path('favicon.ico'), format='ICO',
+            sizes=[ f.size for f in frames ], append_images=frames[1:])
+
+    def _get_renderer_version(self):
+        if not self.in_memory:
+            return [ _tool_version('inkscape'), _tool_version('convert') ]
+        if cairosvg is not None:
+            return [ 'pillow-' + Image.__version__, 'cairosvg-' + cairosvg.__version__ ]
+        return [ 'pillow-' + Image.__version__, _tool_version('inkscape') ]
+
+    def _get_cache_keys(self):
+        if not isfile(self.template_fp):
+            raise FileNotFoundError(self.template_fp)
+        template_hash = hash_file(self.template_fp)
+        renderer = self._get_renderer_version()
+        return { f: hash_key(PIPELINE_VERSION, template_hash, f, *renderer)
+                 for f in _get_outputs() }
+
+    def _fetch_cached(self, keys):
+        if not all(self.cache.has(key) for key in keys.values()):
+            return False
+        return all(self.cache.fetch(key, self.result_path(f))
+                   for f, key in keys.items())
+
+    def generate_resources(self):
+        if self.manifest and self.manifest.is_current(self.template_fp):
+            return
+        if isdir(self.result_fp): # stale resources from a previous build
+            rmtree(self.result_fp)
+        os.makedirs(self.result_fp)
+        keys = self._get_cache_keys() if self.cache else {}
+        if not keys or not self._fetch_cached(keys):
+            if self.in_memory:
+                self._render_in_memory()
+            else:
+                self._render_with_inkscape()
+            for f, key in keys.items():
+                if isfile(self.result_path(f)):
+                    self.cache.store(key, self.result_path(f))
+        if self.manifest:
+            self.manifest.record(self.template_fp, *[
+                self.result_path(f) for f in sorted(os.listdir(self.result_fp))
+            ])
+
     def _get_head_element(self, attrs):
         return "".join([
             '    <link', *[ ' {}="{}"'.format(*attr) for attr in attrs ], '>'
@@ -94,7 +243,7 @@ class FaviconGenerator: # TODO: routes and precomposed
             fav_head.append([
                 ('rel', 'icon'),
                 ('sizes', '{0}x{0}'.format(res)),
-                ('href', '/{}'.format(filename))
+                ('href', self.url('/{}'.format(filename)))
             ])
         apple_res_copy = list(apple_res) # copy the list
         apple_res_copy.reverse() # reverse it # .sort().reverse() ?
@@ -107,7 +256,7 @@ class FaviconGenerator: # TODO: routes and precomposed
             fav_head.append([
                 ('rel', 'apple-touch-icon'),
                 ('sizes', '{0}x{0}'.format(res)),
-                ('href', '/{}'.format(filename))
+                ('href', self.url('/{}'.format(filename)))
             ])
         favicon_res_copy = list(favicon_res) # copy the list
         favicon_res_copy.reverse() # reverse it # .sort().reverse() ?
@@ -121,7 +270,7 @@ class FaviconGenerator: # TODO: routes and precomposed
                 ('rel', 'icon'),
                 ('type', 'image/png'),
                 ('sizes', '{0}x{0}'.format(res)),
-                ('href', '/{}'.format(filename))
+                ('href', self.url('/{}'.format(filename)))
             ])
         return '\n'.join([ self._get_head_element(attrs) for attrs in fav_head ])
 
@@ -154,11 +303,29 @@ def parse_args():
         default='.',
         help='the path to put the resulting resources. (default ".")'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='the number of sizes to render concurrently. (default core count)'
+    )
+    parser.add_argument(
+        '-m', '--in-memory',
+        action='store_true',
+        help='render the .svg once and downscale the other sizes in memory'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='always render, neither reading from nor writing to the user cache'
+    )
     return parser.parse_args()
 
 def main():
     options = parse_args()
-    generator = FaviconGenerator(options.template_filepath, options.result_path)
+    generator = FaviconGenerator(options.template_filepath, options.result_path,
+        jobs=options.jobs, in_memory=options.in_memory,
+        cache=not options.no_cache)
     generator.generate()
 
 
@@ -0,0 +1,119 @@
+"""
+    bottle-builder.fingerprint
+    --------------------------
+
+    The fingerprint module provides content-hashed urls for static resources,
+    e.g. `/styles.css` becomes `/styles.1a2b3c4d5e.css`.  Since the url changes
+    whenever the content does, fingerprinted routes can be cached by clients
+    indefinitely.  Resources keep their names on disk, and remain available at
+    their plain urls (without the long cache lifetime) for references the
+    builder doesn't generate.
+
+    Every reference the builder generates (the <head> elements, the deferred
+    stylesheets in the footer, the routes and the `url()`s in stylesheets) is
+    rewritten to the fingerprinted url.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'FingerprintGenerator', 'fingerprint_path' ]
+
+import os
+import os.path
+from os.path import isfile, abspath, normpath, join
+import posixpath
+import re
+
+from manifest import hash_file
+
+
+##### Constants ################################################################
+
+HASH_LENGTH = 10
+
+# NOTE: in reverse order of app.py, where later routes replace earlier ones
+STATIC_FOLDERS = [ 'js', 'css', 'font', 'img', 'favicon', '' ]
+
+### Patterns
+
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+?)\1\s*\)')
+FINGERPRINT_PATTERN = re.compile(r'^(.*)\.[0-9a-f]{%d}(\.[^./]*)?$' % HASH_LENGTH)
+EXTERNAL_PATTERN = re.compile(r'^(?:[a-z]+:|//|#)', re.I)
+
+
+##### Helpers ##################################################################
+
+def fingerprint_path(path, digest): # "img/logo.png" -> "img/logo.<hash>.png"
+    folder, filename = posixpath.split(path)
+    name, ext = posixpath.splitext(filename)
+    return posixpath.join(folder, '{}.{}{}'.format(name, digest, ext))
+
+
+##### Fingerprint Generator Class ##############################################
+
+class FingerprintGenerator:
+
+    def __init__(self, dest_dir, enabled=True):
+        self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www/static
+        self.enabled = enabled # if not, urls are only restored to their plain form
+        self.digests = {} # filepath -> (mtime, size, digest)
+
+    def _get_digest(self, fp):
+        stat = os.stat(fp)
+        cached = self.digests.get(fp)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hash_file(fp)[:HASH_LENGTH]
+        self.digests[fp] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _get_file(self, path): # the file a route path is served from
+        for folder in STATIC_FOLDERS:
+            if not folder and '/' in path: # only top level files in static
+                continue
+            fp = self.dest_path(folder, *path.split('/'))
+            if isfile(fp):
+                return fp
+        return None
+
+    def get_route(self, path, fp):
+        # the fingerprinted route for a file served at route `path`
+        return fingerprint_path(path, self._get_digest(fp))
+
+    def url(self, url):
+        # "/styles.css" -> "/styles.<hash>.css", or unchanged if not a resource
+        fp = self._get_file(url.lstrip('/'))
+        if fp is None or not self.enabled:
+            return url
+        return '/' + self.get_route(url.lstrip('/'), fp)
+
+    def _rewrite_url(self, match):
+        quote, url = match.groups()
+        if EXTERNAL_PATTERN.match(url):
+            return match.group(0)
+        original, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        path = posixpath.normpath(posixpath.join('/', original))
+        # NOTE: urls fingerprinted by a previous build are refreshed
+        previous = FINGERPRINT_PATTERN.match(path)
+        if self._get_file(path.lstrip('/')) is None and previous:
+            path = previous.group(1) + (previous.group(2) or '')
+        fingerprinted = self.url(path)
+        if fingerprinted == posixpath.normpath(posixpath.join('/', original)):
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, fingerprinted, suffix)
+
+    def rewrite_stylesheet(self, fp):
+        with open(fp, 'r') as f:
+            css = f.read()
+        rewritten = CSS_URL_PATTERN.sub(self._rewrite_url, css)
+        if rewritten != css:
+            with open(fp, 'w') as f:
+                f.write(rewritten)
+
+    def rewrite_stylesheets(self, *folders):
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                for filename in files:
+                    if os.path.splitext(filename)[-1].lower() == '.css':
+                        self.rewrite_stylesheet(join(root, filename))
@@ -66,9 +66,10 @@ def _is_css(filepath): # NOTE: accepts an absolute path
 
 class HeadGenerator:
 
-    def __init__(self, dest_dir, favicon_generator):
+    def __init__(self, dest_dir, favicon_generator, fingerprints=None):
         self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www
         self.favicon_generator = favicon_generator
+        self.url = fingerprints.url if fingerprints else lambda url: url
 
     def _get_favicon_head(self):
         return self.favicon_generator.get_head_elements()
@@ -77,7 +78,8 @@ class HeadGenerator:
         if isfile(self.dest_path('static', 'favicon', 'favicon-300x300.png')):
             return OPENGRAPH_HEAD.replace(
                 '<meta property="open_graph_image">',
-                OPENGRAPH_IMAGE_HEAD
+                OPENGRAPH_IMAGE_HEAD.replace('/favicon-300x300.png',
+                                             self.url('/favicon-300x300.png'))
             )
         return OPENGRAPH_HEAD
 
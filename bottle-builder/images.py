@@ -0,0 +1,303 @@
+"""
+    bottle-builder.images
+    ---------------------
+
+    The images module optimizes the images in res/img as they are copied to
+    static/img.  PNGs are recompressed losslessly with pillow and JPEGs with
+    `jpegtran` (when installed), keeping their color profile and EXIF data,
+    and the smaller of the original and the optimized image is kept.
+
+    Optionally, a .webp variant is written next to every image (photo.jpg.webp
+    for photo.jpg), and downscaled copies are written for each of a list of
+    widths narrower than the image (photo-480w.jpg, and photo-480w.jpg.webp),
+    for use in `srcset` attributes.  Variants that aren't smaller than the
+    image they were made from are discarded.  Variants are rotated as the
+    image's EXIF orientation says, and keep its color profile.
+
+    Images are optimized in a pool of processes.  The results are cached in the
+    user's cache directory (see the cache module), keyed on the content of the
+    image and the settings it was optimized with, so an unchanged image is
+    never optimized twice, by any build of any project.
+
+    Requirements:
+    * pillow
+
+    Optional Requirements:
+    * jpegtran (JPEGs are copied as they are without it)
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'ImageGenerator', 'OPTIMIZED_EXTENSIONS' ]
+
+import os
+import os.path
+from os.path import isfile, isdir, abspath, normpath, join, relpath, splitext, dirname
+from concurrent.futures import ProcessPoolExecutor
+from shutil import which, copyfile
+import subprocess
+import tempfile
+import json
+
+from cache import ContentCache, hash_key
+from manifest import hash_file
+from tracing import submit
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+##### Constants ################################################################
+
+# NOTE: bump to invalidate cached images when the optimization itself changes
+PIPELINE_VERSION = 3
+
+OPTIMIZED_EXTENSIONS = [ '.png', '.jpg', '.jpeg' ]
+
+# for the lossy encodings: webp variants of JPEGs and downscaled JPEGs
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+IGNORED_FILES = [ '.DS_Store', 'Thumbs.db', 'desktop.ini' ]
+
+# modes whose color profile still applies once converted to RGB(A)
+RGB_MODES = [ '1', 'P', 'PA', 'RGB', 'RGBA', 'RGBX', 'RGBa' ]
+
+
+##### Helpers ##################################################################
+
+def _tool_version(name):
+    # NOTE: identifies an install without launching it, `--version` is slow
+    path = which(name)
+    if path is None:
+        return name
+    stat = os.stat(path)
+    return '{}@{}:{}:{}'.format(name, path, stat.st_size, int(stat.st_mtime))
+
+def _keep_smaller(candidate, original):
+    # discards the candidate unless it's smaller than the original
+    if os.path.getsize(candidate) < os.path.getsize(original):
+        return True
+    os.remove(candidate)
+    return False
+
+def _optimize_png(src_fp, dest_fp):
+    # NOTE: pillow only writes the EXIF data (and orientation) it's given
+    with Image.open(src_fp) as image:
+        image.load()
+        image.save(dest_fp, format='PNG', optimize=True,
+            icc_profile=image.info.get('icc_profile'),
+            exif=image.info.get('exif'))
+
+def _optimize_jpeg(src_fp, dest_fp):
+    # NOTE: jpegtran rewrites the huffman tables without decoding the image,
+    #       the EXIF orientation and the color profile must survive it
+    subprocess.run([ 'jpegtran', '-copy', 'all', '-optimize', '-progressive',
+        '-outfile', dest_fp, src_fp ], check=True)
+
+def _save_variant(image, dest_fp, jpeg, icc_profile):
+    if dest_fp.endswith('.webp'):
+        # NOTE: only the variants of photos are lossy
+        if jpeg:
+            image.save(dest_fp, format='WEBP', quality=WEBP_QUALITY, method=6,
+                icc_profile=icc_profile)
+        else:
+            image.save(dest_fp, format='WEBP', lossless=True, method=6,
+                icc_profile=icc_profile)
+    elif jpeg:
+        image.save(dest_fp, format='JPEG', quality=JPEG_QUALITY,
+            optimize=True, progressive=True, icc_profile=icc_profile)
+    else:
+        image.save(dest_fp, format='PNG', optimize=True, icc_profile=icc_profile)
+
+def _optimize_image(src_fp, dest_fp, webp, widths):
+    # runs in a worker process, returns the filepaths of every output
+    name, ext = splitext(dest_fp)
+    jpeg = ext.lower() != '.png'
+    tmp_fp = dest_fp + '.tmp'
+    try:
+        if jpeg and which('jpegtran') is None:
+            copyfile(src_fp, tmp_fp)
+        elif jpeg:
+            _optimize_jpeg(src_fp, tmp_fp)
+        else:
+            _optimize_png(src_fp, tmp_fp)
+        if not _keep_smaller(tmp_fp, src_fp):
+            copyfile(src_fp, tmp_fp)
+        os.replace(tmp_fp, dest_fp)
+    finally:
+        if isfile(tmp_fp):
+            os.remove(tmp_fp)
+    outputs = [ dest_fp ]
+    # NOTE: variants are made from the source, whatever optimizing kept of it
+    with Image.open(src_fp) as image:
+        image.load()
+        icc_profile = image.info.get('icc_profile')
+        # NOTE: the variants carry no EXIF data, so they're rotated upright
+        image = ImageOps.exif_transpose(image)
+        mode = image.mode
+        if jpeg and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif not jpeg and image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA') # palette images can't be resampled
+        if image.mode != mode and mode not in RGB_MODES:
+            icc_profile = None # e.g. a CMYK profile, for an RGB image
+        # (image, filepath, filepath of the image it must be smaller than)
+        variants = []
+        if webp:
+            variants.append((image, dest_fp + '.webp', dest_fp))
+        for width in sorted(set(widths)):
+            if width >= image.width:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            resized_fp = '{}-{}w{}'.format(name, width, ext)
+            variants.append((resized, resized_fp, dest_fp))
+            if webp:
+                variants.append((resized, resized_fp + '.webp', resized_fp))
+        for variant, fp, original in variants:
+            # NOTE: a discarded downscaled copy discards its webp variant too
+            if isfile(original):
+                _save_variant(variant, fp, jpeg, icc_profile)
+                if _keep_smaller(fp, original):
+                    outputs.append(fp)
+    return outputs
+
+
+##### Image Generator Class ####################################################
+
+class ImageGenerator:
+
+    def __init__(self, src_dir, dest_dir, manifest=None, jobs=None, webp=False,
+                 widths=(), cache=True):
+        self.src_path = lambda *p: normpath(abspath(join(src_dir, *p))) # res/img
+        self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www/static/img
+        self.manifest = manifest # BuildManifest, skips unchanged images
+        self.jobs = jobs or os.cpu_count() or 1
+        self.webp = webp
+        self.widths = sorted(set(widths))
+        self.cache = ContentCache('images') if cache else None
+
+    def _get_images(self):
+        for root, dirs, files in os.walk(self.src_path()):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.startswith('~') or filename in IGNORED_FILES:
+                    continue
+                yield join(root, filename)
+
+    def _get_dest(self, src_fp):
+        return self.dest_path(relpath(src_fp, self.src_path()))
+
+    def _get_cache_key(self, src_fp):
+        tools = [ 'pillow-' + Image.__version__, _tool_version('jpegtran') ]
+        return hash_key(PIPELINE_VERSION, hash_file(src_fp),
+            splitext(src_fp)[-1], self.webp, *self.widths, *tools)
+
+    def _fetch_cached(self, key, dest_fp):
+        # NOTE: the cached index lists the outputs by the suffix they add to
+        #       the image's name, so identical images share their entry
+        try:
+            with open(self.cache.cache_path(key), 'r') as f:
+                suffixes = json.load(f)
+        except (OSError, ValueError):
+            return None
+        stem = splitext(dest_fp)[0]
+        outputs = [ stem + suffix for suffix in suffixes ]
+        if all(self.cache.fetch(hash_key(key, suffix), fp)
+               for suffix, fp in zip(suffixes, outputs)):
+            return outputs
+        return None
+
+    def _store_cached(self, key, dest_fp, outputs):
+        suffixes = [ fp[len(splitext(dest_fp)[0]):] for fp in outputs ]
+        for suffix, fp in zip(suffixes, outputs):
+            self.cache.store(hash_key(key, suffix), fp)
+        # NOTE: the index is stored last, a partial entry is never fetched
+        fd, index = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(suffixes, f)
+            self.cache.store(key, index)
+        finally:
+            os.remove(index)
+
+    def _remove_stale(self, src_fp, outputs):
+        # variants of a previous build that weren't generated this time
+        if self.manifest:
+            for fp in self.manifest.outputs(src_fp):
+                if fp not in outputs and isfile(fp):
+                    os.remove(fp)
+
+    def _record(self, src_fp, outputs):
+        self._remove_stale(src_fp, outputs)
+        if self.manifest:
+            self.manifest.record(src_fp, *outputs)
+
+    def _optimize(self, images):
+        # returns (bytes before, bytes after, images fetched from the cache)
+        before, after, cached, pending = 0, 0, 0, []
+        for src_fp in images:
+            dest_fp = self._get_dest(src_fp)
+            os.makedirs(dirname(dest_fp), exist_ok=True)
+            if splitext(src_fp)[-1].lower() not in OPTIMIZED_EXTENSIONS:
+                copyfile(src_fp, dest_fp)
+                self._record(src_fp, [ dest_fp ])
+                continue
+            key = self._get_cache_key(src_fp) if self.cache else None
+            outputs = self._fetch_cached(key, dest_fp) if key else None
+            if outputs is None:
+                pending.append((src_fp, dest_fp, key))
+                continue
+            self._record(src_fp, outputs)
+            before += os.path.getsize(src_fp)
+            after += os.path.getsize(dest_fp)
+            cached += 1
+        if pending:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [ (src_fp, dest_fp, key, submit(executor,
+                    relpath(src_fp, self.src_path('..')), 'image', _optimize_image,
+                    src_fp, dest_fp, self.webp, self.widths))
+                    for src_fp, dest_fp, key in pending ]
+                for src_fp, dest_fp, key, future in futures:
+                    outputs = future.result()
+                    if key:
+                        self._store_cached(key, dest_fp, outputs)
+                    self._record(src_fp, outputs)
+                    before += os.path.getsize(src_fp)
+                    after += os.path.getsize(dest_fp)
+        return before, after, cached
+
+    def generate(self):
+        if Image is None:
+            raise ImportError('pillow is required to optimize images')
+        if not isdir(self.src_path()):
+            print('Folder', relpath(self.src_path()), 'not found')
+            return
+        images = [ fp for fp in self._get_images()
+                   if not (self.manifest and self.manifest.is_current(fp)) ]
+        before, after, cached = self._optimize(images)
+        if before:
+            print('Optimized {} image(s): {} -> {} bytes ({} saved, {} cached)'.format(
+                len(images), before, after, before - after, cached))
+
+    def update_image(self, src_fp): # returns False if src_fp isn't an image
+        src_fp = normpath(abspath(src_fp))
+        if not src_fp.startswith(self.src_path() + os.sep):
+            return False
+        filename = os.path.basename(src_fp)
+        if filename.startswith('~') or filename in IGNORED_FILES:
+            return False
+        if isfile(src_fp):
+            self._optimize([ src_fp ])
+        else:
+            # NOTE: removes the image and every variant made from it
+            self._remove_stale(src_fp, [])
+            if isfile(self._get_dest(src_fp)):
+                os.remove(self._get_dest(src_fp))
+            if self.manifest:
+                self.manifest.remove(src_fp)
+        return True
@@ -0,0 +1,398 @@
+"""
+    bottle-builder.javascript
+    -------------------------
+
+    The javascript module bundles and minifies the scripts in `dev/js`, in
+    place of copying each of them to `static/js` on its own:
+
+        dev/js/*.js          ->  static/js/scripts.js   (loaded by every page)
+        dev/js/<page>/*.js   ->  static/js/<page>.js    (loaded by <page> only)
+
+    Scripts are concatenated in filename order, so prefix them (01-, 02-) when
+    the order matters.  Each bundle is minified by a small tokenizer written in
+    python (no node toolchain is needed), and a version 3 source map with the
+    original sources embedded is written next to it.  The <script> tags for
+    the bundles are added to the ~footer.tpl view.
+
+    The minifier only removes comments and whitespace, it never renames or
+    rewrites code.  Line breaks are kept wherever automatic semicolon
+    insertion could depend on them.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'JavascriptGenerator', 'minify_js', 'SHARED_BUNDLE' ]
+
+import os
+import os.path
+from os.path import isfile, isdir, abspath, normpath, join, relpath, splitext
+import json
+import re
+
+from tracing import span
+
+
+##### Constants ################################################################
+
+SHARED_BUNDLE = 'scripts'
+
+JS_EXTENSIONS = [ '.js' ]
+
+BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+# a `/` after one of these starts a regular expression, not a division
+REGEX_KEYWORDS = [ 'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete',
+                   'void', 'throw', 'case', 'do', 'else', 'yield', 'await' ]
+
+# and so does a `/` after the `)` closing the head of one of these
+CONTROL_KEYWORDS = [ 'if', 'while', 'for', 'with' ]
+
+# a line break between tokens ending and starting with these is kept, as
+# automatic semicolon insertion may depend on it
+ASI_BEFORE = ')]}"\'`+-/'
+ASI_AFTER = '{[(+-!~"\'`/'
+
+# joining tokens that form one of these would change their meaning
+UNSAFE_PAIRS = [ '++', '--', '//', '/*', '<!', '->' ]
+
+### Patterns
+
+WORD_PATTERN = re.compile(r'(?:[\w$]|\\u[0-9a-fA-F]{4}|[^\x00-\x7f])+')
+NUMBER_PATTERN = re.compile(r'^\d+$')
+
+### Templates
+
+FOOTER_SCRIPTS_BLOCK = """\
+    % footer_scripts = {0}
+    % for src in footer_scripts.get(get('template'), {1}):
+    <script src="{{{{src}}}}"></script>
+    % end
+"""
+
+SOURCE_MAP_COMMENT = '\n//# sourceMappingURL={}\n'
+
+
+##### Helpers ##################################################################
+
+def _is_word_char(c):
+    return c.isalnum() or c in '$_\\' or ord(c) > 127
+
+def _scan_string(src, i): # i is the index of the opening quote
+    quote, i = src[i], i + 1
+    while i < len(src) and src[i] != quote:
+        i += 2 if src[i] == '\\' else 1
+    return i + 1
+
+def _scan_template(src, i): # i is the index of the opening backtick
+    # NOTE: substitutions may nest strings, templates and braces of their own
+    i, depth = i + 1, 0
+    while i < len(src):
+        c = src[i]
+        if c == '\\':
+            i += 2
+            continue
+        if depth == 0:
+            if c == '`':
+                return i + 1
+            if src.startswith('${', i):
+                depth, i = 1, i + 2
+                continue
+        elif c in '"\'':
+            i = _scan_string(src, i)
+            continue
+        elif c == '`':
+            i = _scan_template(src, i)
+            continue
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        i += 1
+    return i
+
+def _scan_regex(src, i): # i is the index of the opening slash
+    i, in_class = i + 1, False
+    while i < len(src) and src[i] != '\n':
+        c = src[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(src) and _is_word_char(src[i]): # flags
+                i += 1
+            return i
+        i += 1
+    return i
+
+def _regex_allowed(previous, closes_control):
+    # closes_control: previous is the `)` of an `if (...)`, `while (...)`, ...
+    if previous is None or closes_control:
+        return True
+    if _is_word_char(previous[-1]):
+        return previous in REGEX_KEYWORDS
+    return previous[-1] not in ')]}'
+
+def _tokenize(src):
+    # yields (token, offset), with comments and whitespace as None tokens that
+    # record whether they contained a line break
+    i, previous, closes_control = 0, None, False
+    parens = [] # for each open paren, whether it opened a control statement's head
+    while i < len(src):
+        c = src[i]
+        start = i
+        if c.isspace():
+            while i < len(src) and src[i].isspace():
+                i += 1
+            yield (None, '\n' in src[start:i]), start
+            continue
+        if src.startswith('//', i):
+            i = src.find('\n', i)
+            i = len(src) if i < 0 else i
+            yield (None, False), start
+            continue
+        if src.startswith('/*', i):
+            end = src.find('*/', i + 2)
+            i = len(src) if end < 0 else end + 2
+            if src.startswith('/*!', start): # license comments are kept
+                yield src[start:i], start
+                previous, closes_control = src[start:i], False
+                continue
+            yield (None, '\n' in src[start:i]), start
+            continue
+        if c in '"\'':
+            i = _scan_string(src, i)
+        elif c == '`':
+            i = _scan_template(src, i)
+        elif c == '/' and _regex_allowed(previous, closes_control):
+            i = _scan_regex(src, i)
+        elif WORD_PATTERN.match(src, i):
+            i = WORD_PATTERN.match(src, i).end()
+        else:
+            i += 1
+        token = src[start:i]
+        if token == '(':
+            parens.append(previous in CONTROL_KEYWORDS)
+        closes_control = token == ')' and bool(parens) and parens.pop()
+        previous = token
+        yield previous, start
+
+def _separator(previous, token, newline):
+    # what has to remain of the whitespace (or comments) between two tokens
+    if previous is None:
+        return ''
+    if newline and (previous[-1] in ASI_BEFORE or _is_word_char(previous[-1])) \
+               and (token[0] in ASI_AFTER or _is_word_char(token[0])):
+        return '\n'
+    if _is_word_char(previous[-1]) and _is_word_char(token[0]):
+        return ' '
+    if previous[-1] + token[0] in UNSAFE_PAIRS:
+        return ' '
+    if NUMBER_PATTERN.match(previous) and token[0] == '.':
+        return ' ' # `1 .toString()`
+    return ''
+
+def _vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    digits = ''
+    while True:
+        digit, value = value & 31, value >> 5
+        digits += BASE64_DIGITS[digit | (32 if value else 0)]
+        if not value:
+            return digits
+
+
+##### Source Map Class #########################################################
+
+class SourceMap:
+
+    def __init__(self):
+        self.sources, self.contents = [], []
+        self.lines = [ [] ] # generated line -> [ (column, source, line, column) ]
+
+    def add_source(self, name, content):
+        self.sources.append(name)
+        self.contents.append(content)
+        return len(self.sources) - 1
+
+    def add(self, column, source, line, source_column):
+        self.lines[-1].append((column, source, line, source_column))
+
+    def newline(self):
+        self.lines.append([])
+
+    def to_json(self, filename):
+        # NOTE: fields are relative to the previous segment, see the v3 spec
+        previous = [ 0, 0, 0 ] # source, line, column
+        lines = []
+        for segments in self.lines:
+            column, encoded = 0, []
+            for segment in segments:
+                values = [ segment[0] - column ] + [
+                    v - p for v, p in zip(segment[1:], previous) ]
+                column, previous = segment[0], list(segment[1:])
+                encoded.append(''.join(_vlq(v) for v in values))
+            lines.append(','.join(encoded))
+        return json.dumps({
+            'version': 3,
+            'file': filename,
+            'sources': self.sources,
+            'sourcesContent': self.contents,
+            'names': [],
+            'mappings': ';'.join(lines),
+        })
+
+
+##### Minification #############################################################
+
+def _line_starts(src):
+    starts = [ 0 ]
+    for match in re.finditer('\n', src):
+        starts.append(match.end())
+    return starts
+
+def _bisect(starts, offset): # the line an offset is on
+    low, high = 0, len(starts) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if starts[middle] <= offset:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _advance(column, text): # the column after writing text
+    if '\n' in text:
+        return len(text) - text.rindex('\n') - 1
+    return column + len(text)
+
+def minify_js(src, source_map=None, source=None, out=None):
+    # appends the minified tokens of src to out, and maps each of them back to
+    # their line and column in src
+    out = [] if out is None else out
+    column = 0
+    for part in out:
+        column = _advance(column, part)
+    starts = _line_starts(src)
+    previous, whitespace = None, None # whitespace: None, or if it had a newline
+    for token, offset in _tokenize(src):
+        if isinstance(token, tuple):
+            whitespace = bool(whitespace) or token[1]
+            continue
+        if whitespace is not None:
+            separator = _separator(previous, token, whitespace)
+            out.append(separator)
+            column = _advance(column, separator)
+            if source_map and separator == '\n':
+                source_map.newline()
+        if source_map:
+            line = _bisect(starts, offset)
+            source_map.add(column, source, line, offset - starts[line])
+            for _ in range(token.count('\n')): # e.g. in template literals
+                source_map.newline()
+        out.append(token)
+        column = _advance(column, token)
+        previous, whitespace = token, None
+    return out
+
+
+##### Javascript Generator Class ###############################################
+
+class JavascriptGenerator:
+
+    def __init__(self, src_dir, dest_dir, fingerprints=None):
+        self.src_path = lambda *p: normpath(abspath(join(src_dir, *p))) # "dev/js"
+        self.dest_path = lambda *p: normpath(abspath(join(dest_dir, 'js', *p)))
+        self.views_path = lambda *p: normpath(abspath(join(dest_dir, '..', 'views', *p)))
+        self.url = fingerprints.url if fingerprints else lambda url: url
+
+    def _get_scripts(self, path, recursive=True):
+        scripts = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            scripts += [ join(root, f) for f in sorted(files)
+                         if splitext(f)[-1].lower() in JS_EXTENSIONS
+                         and not f.startswith('~') ]
+            if not recursive:
+                break
+        return scripts
+
+    def get_bundles(self): # bundle name -> [ script filepaths ]
+        if not isdir(self.src_path()):
+            return {}
+        bundles = {}
+        shared = self._get_scripts(self.src_path(), recursive=False)
+        if shared:
+            bundles[SHARED_BUNDLE] = shared
+        for page in sorted(os.listdir(self.src_path())):
+            if isdir(self.src_path(page)):
+                scripts = self._get_scripts(self.src_path(page))
+                if scripts:
+                    bundles[page] = scripts
+        return bundles
+
+    def _bundle(self, name, scripts):
+        source_map, out = SourceMap(), []
+        for i, fp in enumerate(scripts):
+            with open(fp, 'r') as f:
+                src = f.read()
+            if i:
+                out.append(';\n') # guards against a missing trailing semicolon
+                source_map.newline()
+            source = source_map.add_source(
+                relpath(fp, self.src_path('..', '..')).replace('\\', '/'), src)
+            minify_js(src, source_map, source, out)
+        out.append(SOURCE_MAP_COMMENT.format(name + '.js.map'))
+        return ''.join(out), source_map.to_json(name + '.js')
+
+    def _write(self, fp, contents):
+        try: # leave an unchanged file alone, so it isn't seen as modified
+            with open(fp, 'r') as f:
+                if f.read() == contents:
+                    return False
+        except FileNotFoundError:
+            pass
+        with open(fp, 'w') as f:
+            f.write(contents)
+        return True
+
+    def generate(self): # returns the names of the bundles that changed
+        os.makedirs(self.dest_path(), exist_ok=True)
+        bundles, changed, outputs = self.get_bundles(), [], set()
+        for name, scripts in bundles.items():
+            with span(name + '.js', 'javascript'):
+                code, source_map = self._bundle(name, scripts)
+            outputs.update([ name + '.js', name + '.js.map' ])
+            if self._write(self.dest_path(name + '.js'), code) | \
+               self._write(self.dest_path(name + '.js.map'), source_map):
+                changed.append(name)
+        # NOTE: static/js holds nothing but the bundles
+        for root, dirs, files in os.walk(self.dest_path(), topdown=False):
+            for filename in files:
+                fp = join(root, filename)
+                if relpath(fp, self.dest_path()).replace('\\', '/') not in outputs:
+                    os.remove(fp)
+            if root != self.dest_path() and not os.listdir(root):
+                os.rmdir(root)
+        return changed
+
+    def _get_footer_scripts(self):
+        bundles = self.get_bundles()
+        default = []
+        if bundles.pop(SHARED_BUNDLE, None):
+            default.append(self.url('/{}.js'.format(SHARED_BUNDLE)))
+        pages = { page: default + [ self.url('/{}.js'.format(page)) ]
+                  for page in bundles }
+        return FOOTER_SCRIPTS_BLOCK.format(pages, default)
+
+    def load_scripts(self):
+        try:
+            with open(self.views_path('~footer.tpl'), 'a') as f:
+                f.write(self._get_footer_scripts())
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,144 @@
+"""
+    bottle-builder.manifest
+    -----------------------
+
+    The manifest module keeps a persistent record of the source files consumed
+    by a build and the output files each of them produced.  On subsequent builds
+    the record is used to skip sources that have not changed, and to remove the
+    outputs of sources that no longer exist.
+
+    Each entry maps a source path (relative to the project root) to its size,
+    modification time and content hash, along with the paths (relative to the
+    build directory) of the outputs generated from it.  Sizes and modification
+    times are compared first, the content hash is only computed when they
+    differ.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'BuildManifest', 'hash_file', 'BUILD_DIR' ]
+
+import os
+import os.path
+from os.path import isfile, isdir, abspath, normpath, join, relpath, dirname
+import hashlib
+import json
+
+
+##### Constants ################################################################
+
+BUILD_DIR = '.build'
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+CHUNK_SIZE = 1 << 16
+
+
+##### Helpers ##################################################################
+
+def hash_file(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _remove_empty_dirs(path, stop):
+    # walk up from path removing directories until one is not empty
+    while normpath(path) != normpath(stop) and isdir(path):
+        if os.listdir(path):
+            return
+        os.rmdir(path)
+        path = dirname(path)
+
+
+##### Build Manifest Class #####################################################
+
+class BuildManifest:
+
+    def __init__(self, src_dir, dest_dir, reuse=True):
+        self.src_dir = abspath(src_dir) # root
+        self.dest_dir = abspath(dest_dir) # www
+        self.fp = join(self.dest_dir, BUILD_DIR, MANIFEST_FILE)
+        self.entries = {}
+        self.seen = set()
+        if reuse:
+            self.load()
+
+    def _src_key(self, src_fp):
+        return relpath(abspath(src_fp), self.src_dir).replace('\\', '/')
+
+    def _dest_key(self, dest_fp):
+        return relpath(abspath(dest_fp), self.dest_dir).replace('\\', '/')
+
+    def _dest_fp(self, key):
+        return normpath(join(self.dest_dir, key))
+
+    def load(self):
+        try:
+            with open(self.fp, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print('Ignoring unreadable build manifest', e)
+            return
+        if manifest.get('version') != MANIFEST_VERSION:
+            return
+        self.entries = manifest.get('entries', {})
+
+    def save(self):
+        os.makedirs(dirname(self.fp), exist_ok=True)
+        with open(self.fp, 'w') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'entries': self.entries,
+            }, f, indent=1, sort_keys=True)
+
+    def is_current(self, src_fp):
+        # NOTE: marks the source as seen either way, so it survives `prune`
+        key = self._src_key(src_fp)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None or not isfile(src_fp):
+            return False
+        if not all(isfile(self._dest_fp(o)) for o in entry['outputs']):
+            return False
+        stat = os.stat(src_fp)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime == entry['mtime']:
+            return True
+        # touched but possibly unchanged, fall back to the content hash
+        if hash_file(src_fp) != entry['hash']:
+            return False
+        entry['mtime'] = stat.st_mtime
+        return True
+
+    def record(self, src_fp, *dest_fps):
+        key = self._src_key(src_fp)
+        stat = os.stat(src_fp)
+        self.seen.add(key)
+        self.entries[key] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': hash_file(src_fp),
+            'outputs': [ self._dest_key(fp) for fp in dest_fps ],
+        }
+
+    def remove(self, src_fp):
+        self.entries.pop(self._src_key(src_fp), None)
+
+    def outputs(self, src_fp):
+        entry = self.entries.get(self._src_key(src_fp), {})
+        return [ self._dest_fp(o) for o in entry.get('outputs', []) ]
+
+    def prune(self):
+        # remove the outputs of every source that wasn't seen during this build
+        for key in [ k for k in self.entries if k not in self.seen ]:
+            for output in self.entries.pop(key)['outputs']:
+                fp = self._dest_fp(output)
+                if isfile(fp):
+                    os.remove(fp)
+                    _remove_empty_dirs(dirname(fp), self.dest_dir)
@@ -0,0 +1,276 @@
+"""
+    bottle-builder.markup
+    ---------------------
+
+    The markup module reads views the way the app renders them, with the
+    partials they include (~head.tpl, ~footer.tpl, ...) expanded in place, and
+    collects the element names, classes and ids that appear in them.  The
+    stylesheets module matches these against the compiled stylesheets to find
+    the rules a page actually uses.
+
+    Template code (`{{ }}` expressions, `%` lines and `<% %>` blocks) can't be
+    evaluated at build time, so every word in a string literal of it is
+    counted, as in scripts: `class="nav {{ 'active' if current else '' }}"`
+    uses both `nav` and `active`.
+
+    A view can mark the end of its above-the-fold content with the comment
+    `<!-- fold -->`, markup after it is ignored when looking for critical css.
+
+    Scripts can add classes and ids at runtime, so every word in a string
+    literal of a script (inline ones included) is counted as well, and any
+    name matching one of the safelist's patterns (e.g. `is-*`) is always
+    considered present.
+
+    Deploy builds minify each view's html with `minify_view`, which leaves the
+    view's template code (`%` lines, `<% %>` blocks and `{{ }}` expressions),
+    escaped code lines (`%%`, `\\%`), lines ending in bottle's `\\\\` line break
+    suppression, and the content of <pre>, <textarea>, <script> and <style>
+    elements as is.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [
+    'Markup', 'read_view', 'scan_markup', 'scan_script', 'minify_view',
+    'FOLD_MARKER', 'VIEW_EXTENSIONS'
+]
+
+from os.path import isfile, join, normpath
+from fnmatch import fnmatchcase
+import re
+
+
+##### Constants ################################################################
+
+FOLD_MARKER = '<!-- fold -->'
+
+VIEW_EXTENSIONS = [ '.tpl', '.html', '.thtml', '.stpl' ]
+
+# nested includes deeper than this are assumed to be recursive
+MAX_INCLUDE_DEPTH = 16
+
+# elements whose content is whitespace sensitive, or isn't html at all
+RAW_ELEMENTS = [ 'pre', 'textarea', 'script', 'style' ]
+
+# whitespace next to these tags is never rendered
+BLOCK_ELEMENTS = set([
+    'html', 'head', 'body', 'title', 'meta', 'link', 'base', 'script', 'style',
+    'noscript', 'template', 'div', 'p', 'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'nav', 'header', 'footer', 'main', 'section', 'article', 'aside', 'h1',
+    'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'br', 'pre', 'blockquote', 'figure',
+    'figcaption', 'table', 'caption', 'colgroup', 'col', 'thead', 'tbody',
+    'tfoot', 'tr', 'td', 'th', 'form', 'fieldset', 'legend', 'option',
+    'optgroup', 'address', 'details', 'summary', 'dialog'
+])
+
+### Patterns
+
+INCLUDE_PATTERN = re.compile(
+    r'^[ \t]*%[ \t]*(?:include|rebase)\(\s*[\'"]([^\'"]+)[\'"][^\n]*$', re.M)
+EXPRESSION_PATTERN = re.compile(r'\{\{.*?\}\}', re.S)
+# template code and inline scripts, whose string literals may hold names
+CODE_PATTERN = re.compile(
+    r'\{\{.*?\}\}|<%.*?%>|^[ \t]*%(?!%)[^\n]*|<script\b[^>]*>.*?</script\s*>',
+    re.S | re.M | re.I)
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.S)
+TAG_PATTERN = re.compile(r'<([a-zA-Z][\w:-]*)((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>')
+ATTRIBUTE_PATTERN = re.compile(
+    r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+SCRIPT_STRING_PATTERN = re.compile(
+    r'"((?:\\.|[^"\\\n])*)"|\'((?:\\.|[^\'\\\n])*)\'|`((?:\\.|[^`\\])*)`')
+WORD_PATTERN = re.compile(r'[\w:-]+')
+CODE_LINE_PATTERN = re.compile(r'^[ \t]*%(?!%)')
+ESCAPED_LINE_PATTERN = re.compile(r'^[ \t]*(?:%%|\\%|\\<%)')
+BLOCK_START_PATTERN = re.compile(r'^[ \t]*<%')
+HTML_TOKEN_PATTERN = re.compile(
+    r'(?P<expression>\{\{.*?\}\})'
+    r'|(?P<comment><!--.*?-->)'
+    r'|(?P<tag></?([a-zA-Z][\w:-]*)(?:"[^"]*"|\'[^\']*\'|\{\{.*?\}\}|[^\'">])*>)'
+    r'|(?P<space>\s+)'
+    r'|(?P<text>[^<{\s]+|[<{])', re.S)
+TAG_WHITESPACE_PATTERN = re.compile(
+    r'"[^"]*"|\'[^\']*\'|\{\{.*?\}\}|(\s+)', re.S)
+
+
+##### Markup Class #############################################################
+
+class Markup:
+
+    def __init__(self, elements=(), classes=(), ids=(), safelist=()):
+        self.elements = set(elements) # lowercase tag names
+        self.classes = set(classes)
+        self.ids = set(ids)
+        self.safelist = list(safelist) # patterns of names always present
+
+    def update(self, other):
+        self.elements |= other.elements
+        self.classes |= other.classes
+        self.ids |= other.ids
+        self.safelist += other.safelist
+        return self
+
+    def _safelisted(self, name):
+        return any(fnmatchcase(name, pattern) for pattern in self.safelist)
+
+    def has_element(self, name):
+        return name.lower() in self.elements or self._safelisted(name.lower())
+
+    def has_class(self, name):
+        return name in self.classes or self._safelisted(name)
+
+    def has_id(self, name):
+        return name in self.ids or self._safelisted(name)
+
+
+##### Helpers ##################################################################
+
+def _find_view(name, views_dir):
+    fp = normpath(join(views_dir, name))
+    for candidate in [ fp ] + [ fp + ext for ext in VIEW_EXTENSIONS ]:
+        if isfile(candidate):
+            return candidate
+    return None
+
+def _expand(fp, views_dir, depth=0):
+    with open(fp, 'r') as f:
+        source = f.read()
+    if depth >= MAX_INCLUDE_DEPTH:
+        return source
+    def include(match):
+        # NOTE: bottle looks names up relative to the views folder
+        included = _find_view(match.group(1), views_dir)
+        if included is None:
+            return match.group(0)
+        return _expand(included, views_dir, depth + 1)
+    return INCLUDE_PATTERN.sub(include, source)
+
+def _minify_tag(tag):
+    # NOTE: quoted attribute values and expressions are left as they are
+    def whitespace(match):
+        if not match.group(1):
+            return match.group(0)
+        # none is needed before the end of the tag
+        return '' if tag.startswith(('>', '/>'), match.end()) else ' '
+    return TAG_WHITESPACE_PATTERN.sub(whitespace, tag)
+
+def _is_block_tag(token):
+    return token is not None and token.lastgroup == 'tag' and \
+           token.group(4).lower() in BLOCK_ELEMENTS
+
+class _HtmlMinifier:
+
+    def __init__(self):
+        self.raw = None # the raw element the text is inside of, if any
+
+    def _minify_raw(self, text, pos, out):
+        # copy the raw element's content up to its closing tag
+        end = re.compile(r'</{}\s*>'.format(self.raw), re.I).search(text, pos)
+        if end is None:
+            out.append(text[pos:])
+            return len(text)
+        out.append(text[pos:end.start()])
+        self.raw = None
+        return end.start()
+
+    def minify(self, text):
+        out, pos, previous, space = [], 0, None, False
+        while pos < len(text):
+            if self.raw:
+                pos = self._minify_raw(text, pos, out)
+                previous, space = None, False
+                continue
+            token = HTML_TOKEN_PATTERN.match(text, pos)
+            pos = token.end()
+            kind = token.lastgroup
+            if kind == 'space':
+                space = True
+                continue
+            if kind == 'comment':
+                if token.group(0).startswith('<!--[if') or \
+                   token.group(0).startswith('<!--<![endif]'):
+                    out.append(token.group(0)) # conditional comments
+                continue
+            # NOTE: whitespace is kept as a single space, unless next to a
+            #       block level element, where it's never rendered
+            if space and out and not (_is_block_tag(previous) or _is_block_tag(token)):
+                out.append(' ')
+            space = False
+            if kind == 'tag':
+                out.append(_minify_tag(token.group(0)))
+                name = token.group(4).lower()
+                if name in RAW_ELEMENTS and not token.group(0).startswith('</'):
+                    self.raw = name
+            else:
+                out.append(token.group(0))
+            previous = token
+        return ''.join(out)
+
+
+##### Markup ###################################################################
+
+def read_view(fp, views_dir, fold=False):
+    # the view's markup with its includes expanded, up to the fold if asked
+    markup = _expand(fp, views_dir)
+    if fold and FOLD_MARKER in markup:
+        markup = markup[:markup.index(FOLD_MARKER)]
+    return markup
+
+def scan_markup(markup):
+    markup = COMMENT_PATTERN.sub('', markup)
+    found = Markup()
+    for tag in TAG_PATTERN.finditer(markup):
+        found.elements.add(tag.group(1).lower())
+        for attribute in ATTRIBUTE_PATTERN.finditer(tag.group(2)):
+            name = attribute.group(1).lower()
+            value = next(v for v in attribute.groups()[1:] if v is not None)
+            words = EXPRESSION_PATTERN.sub(' ', value).split()
+            if name == 'class':
+                found.classes.update(words)
+            elif name == 'id':
+                found.ids.update(words)
+    for code in CODE_PATTERN.finditer(markup):
+        found.update(scan_script(code.group(0)))
+    return found
+
+def scan_script(source):
+    # any word in a string literal could be a class, id or element name
+    words = set()
+    for match in SCRIPT_STRING_PATTERN.finditer(source):
+        string = next(s for s in match.groups() if s is not None)
+        words.update(WORD_PATTERN.findall(string))
+    return Markup(elements=[ w.lower() for w in words ], classes=words, ids=words)
+
+def minify_view(source):
+    # strip comments and collapse whitespace, leaving template code untouched
+    minifier, lines, text, block = _HtmlMinifier(), [], [], False
+    def flush():
+        # NOTE: a line break is kept before each line of code, where bottle
+        #       renders it as one
+        html = minifier.minify('\n'.join(text))
+        # NOTE: a kept line ending in `\\` mustn't end up right before code,
+        #       where bottle would suppress its line break
+        if html or (text and lines and lines[-1].rstrip('\r').endswith('\\\\')):
+            lines.append(html)
+        text.clear()
+    for line in source.split('\n'):
+        if block:
+            lines.append(line)
+            block = '%>' not in line
+        elif BLOCK_START_PATTERN.match(line):
+            flush()
+            lines.append(line)
+            block = '%>' not in line
+        elif CODE_LINE_PATTERN.match(line):
+            flush()
+            lines.append(line.lstrip())
+        elif ESCAPED_LINE_PATTERN.match(line) or line.rstrip('\r').endswith('\\\\'):
+            # NOTE: escaped code (`%%`, `\%`) only reads as text at the start
+            #       of a line, and a trailing `\\` only suppresses the line
+            #       break that follows it, so neither is joined to anything
+            flush()
+            lines.append(line)
+        else:
+            text.append(line)
+    flush()
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,203 @@
+"""
+    bottle-builder.package
+    ----------------------
+
+    The package module archives the built site (www/) into www.zip for moving
+    it to the deployment server.  Files are deflated concurrently and written
+    in sorted order, with fixed permissions and one timestamp, so identical
+    sites always produce byte-identical archives, which caches, rsync and
+    artifact stores can then skip.  Files that are already compressed (images,
+    woff fonts and the precompressed .gz/.br variants) are stored as they are.
+
+    The timestamp is SOURCE_DATE_EPOCH when it's set, and otherwise the newest
+    modification time of the project's sources, so it only changes when they
+    do, never with the time of the build.  It's recorded in UTC, in the zip's
+    own (two second) fields and in an extended timestamp field, which unzip
+    restores.  The site's files are stamped with it as they're archived, and
+    deploy builds record it in the asset manifest (assets.json) as well, so
+    the manifest, the Last-Modified headers served from it and the extracted
+    site all agree.
+
+    The build's own records (www/.build) are left out of the archive.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'PackageGenerator', 'STORED_EXTENSIONS', 'source_date_epoch' ]
+
+import os
+import os.path
+from os.path import abspath, normpath, join, relpath, basename, dirname, splitext
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import time
+import zlib
+
+from manifest import BUILD_DIR
+from tracing import submit
+
+
+##### Constants ################################################################
+
+# already compressed, deflating them again only costs time
+STORED_EXTENSIONS = [ '.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff',
+                      '.woff2', '.gz', '.br', '.zip', '.mp3', '.mp4', '.webm' ]
+
+COMPRESS_LEVEL = 9
+
+# NOTE: 1980-01-01 00:00 UTC, the earliest date a zip file can record
+DOS_EPOCH = 315532800
+
+# written into the sources by the build itself, e.g. by the stylesheets module
+GENERATED_SOURCES = [ '_all.scss' ]
+
+FILE_ATTRIBUTES = 0o100644 << 16 # a regular file, rw-r--r--
+
+# files compressed ahead of being written, per worker
+QUEUE_DEPTH = 4
+
+### Zip Records
+ZIP_STORED, ZIP_DEFLATED = 0, 8
+ZIP_VERSION = 20 # 2.0, deflate
+ZIP_UTF8 = 1 << 11 # names are utf-8
+ZIP_UNIX = 3 << 8
+ZIP_LIMIT = 0xFFFFFFFF # sizes and offsets, without zip64 extensions
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<4sHHHHIIH')
+EXTENDED_TIMESTAMP = struct.Struct('<HHBI') # the "UT" extra field, mtime only
+EXTENDED_TIMESTAMP_ID = 0x5455
+
+
+##### Helpers ##################################################################
+
+def source_date_epoch(src_dirs):
+    # the timestamp of the archive, see the module's docstring
+    if os.environ.get('SOURCE_DATE_EPOCH'):
+        return max(int(os.environ['SOURCE_DATE_EPOCH']), DOS_EPOCH)
+    newest = DOS_EPOCH
+    for src_dir in src_dirs:
+        for root, dirs, files in os.walk(src_dir):
+            dirs[:] = [ d for d in dirs if not d.startswith('.') ]
+            for filename in files:
+                if filename.startswith('.') or filename in GENERATED_SOURCES:
+                    continue
+                newest = max(newest, int(os.stat(join(root, filename)).st_mtime))
+    return newest
+
+def _dos_datetime(timestamp): # (date, time) fields
+    # NOTE: in UTC, never the local time zone of the build, the extended
+    #       timestamp field is what unzip restores
+    t = time.gmtime(timestamp)
+    return ((t[0] - 1980) << 9) | (t[1] << 5) | t[2], \
+           (t[3] << 11) | (t[4] << 5) | (t[5] // 2)
+
+def _extra_field(timestamp):
+    return EXTENDED_TIMESTAMP.pack(EXTENDED_TIMESTAMP_ID, 5, 1,
+                                   min(timestamp, ZIP_LIMIT))
+
+def _compress(fp):
+    # returns (method, crc, size, data), run in a worker thread
+    with open(fp, 'rb') as f:
+        data = f.read()
+    crc = zlib.crc32(data)
+    if splitext(fp)[-1].lower() not in STORED_EXTENSIONS:
+        # NOTE: zlib releases the GIL, so threads deflate in parallel
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            return ZIP_DEFLATED, crc, len(data), deflated
+    return ZIP_STORED, crc, len(data), data
+
+
+##### Package Generator Class ##################################################
+
+class PackageGenerator:
+
+    def __init__(self, src_dir, dest_fp, jobs=None, source_dirs=()):
+        self.src_dir = normpath(abspath(src_dir)) # "www"
+        self.dest_fp = normpath(abspath(dest_fp)) # "www.zip"
+        self.jobs = jobs or os.cpu_count() or 1
+        self.source_dirs = source_dirs # "dev", "res", for the timestamp
+
+    def _get_files(self):
+        # NOTE: sorted, so the order of entries never depends on the filesystem
+        for root, dirs, files in os.walk(self.src_dir):
+            dirs[:] = sorted(d for d in dirs if not (
+                root == self.src_dir and d == BUILD_DIR))
+            for filename in sorted(files):
+                fp = join(root, filename)
+                if fp != self.dest_fp:
+                    yield fp
+
+    def _get_arcname(self, fp):
+        # e.g. "www/static/css/styles.css"
+        return relpath(fp, dirname(self.src_dir)).replace(os.sep, '/')
+
+    def _compress_all(self, files):
+        # yields (filepath, compressed) in order, keeping only a few in memory
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = []
+            for fp in files:
+                pending.append((fp, submit(executor, self._get_arcname(fp),
+                    'package', _compress, fp)))
+                if len(pending) >= self.jobs * QUEUE_DEPTH:
+                    fp, future = pending.pop(0)
+                    yield fp, future.result()
+            for fp, future in pending:
+                yield fp, future.result()
+
+    def _write(self, f, timestamp):
+        # returns (files, bytes read, bytes written)
+        central, offset, size = [], 0, 0
+        dos_date, dos_time = _dos_datetime(timestamp)
+        extra = _extra_field(timestamp)
+        for fp, (method, crc, file_size, data) in \
+                self._compress_all(self._get_files()):
+            name = self._get_arcname(fp).encode('utf8')
+            if max(offset, file_size) >= ZIP_LIMIT:
+                raise ValueError('site is too large to package: ' + fp)
+            f.write(LOCAL_HEADER.pack(b'PK\x03\x04', ZIP_VERSION, ZIP_UTF8,
+                method, dos_time, dos_date, crc, len(data), file_size,
+                len(name), len(extra)))
+            f.write(name)
+            f.write(extra)
+            f.write(data)
+            central.append(CENTRAL_HEADER.pack(b'PK\x01\x02',
+                ZIP_UNIX | ZIP_VERSION, ZIP_VERSION, ZIP_UTF8, method, dos_time,
+                dos_date, crc, len(data), file_size, len(name), len(extra), 0,
+                0, 0, FILE_ATTRIBUTES, offset) + name + extra)
+            offset += LOCAL_HEADER.size + len(name) + len(extra) + len(data)
+            size += file_size
+        if len(central) >= 0xFFFF or offset >= ZIP_LIMIT:
+            raise ValueError('site has too many files to package')
+        directory = b''.join(central)
+        f.write(directory)
+        f.write(END_RECORD.pack(b'PK\x05\x06', 0, 0, len(central),
+            len(central), len(directory), offset, 0))
+        return len(central), size, offset + len(directory) + END_RECORD.size
+
+    def get_timestamp(self):
+        return source_date_epoch(self.source_dirs)
+
+    def package(self):
+        start = time.perf_counter()
+        timestamp = self.get_timestamp()
+        # NOTE: the site on disk is dated as the extracted one will be
+        for fp in self._get_files():
+            os.utime(fp, (timestamp, timestamp))
+        # NOTE: written aside and moved into place, never left half written
+        tmp_fp = self.dest_fp + '.tmp'
+        try:
+            with open(tmp_fp, 'wb') as f:
+                files, size, packaged = self._write(f, timestamp)
+            os.replace(tmp_fp, self.dest_fp)
+        finally:
+            if os.path.isfile(tmp_fp):
+                os.remove(tmp_fp)
+        seconds = time.perf_counter() - start
+        print('Packaged {} file(s) into {}: {:.1f}KB -> {:.1f}KB in {:.2f}s '
+              '({:.1f}MB/s)'.format(files, basename(self.dest_fp), size / 1024,
+              packaged / 1024, seconds, size / (1 << 20) / max(seconds, 1e-6)))
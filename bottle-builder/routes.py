@@ -17,16 +17,27 @@ from os.path import normpath, abspath, join, relpath
 import shutil
 
 from overrides import Template
+from compression import ENCODINGS
+from tracing import span
 
 
 ##### Constants ################################################################
 
 IGNORED_FILES = [ '.DS_Store' ]
 
+# NOTE: precompressed siblings are served by their original's route
+COMPRESSED_EXTENSIONS = [ ext for _, ext in ENCODINGS ]
+
+TEMPLATES_DIR = join(os.path.dirname(abspath(__file__)), 'templates')
+
+# copied next to app.py, which imports them
+RUNTIME_MODULES = [ 'serving.py', 'templating.py', 'prefork.py' ]
+
 ### Route Templates
 
 MAIN_ROUTE_TEMPLATE = Template("""\
 @route('/${path}')
+@cached_view('${template}')
 def ${method_name}():
     return template('${template}', request=request, template='${template_name}')
 """ )
@@ -34,75 +45,189 @@ def ${method_name}():
 STATIC_ROUTE_TEMPLATE = Template("""\
 @get('/${path}')
 def load_resource():
-    return static_file('${file}', root='${root}')
+    return serve_static('${file}', root='${root}')
+""" )
+
+# NOTE: the url changes with the content, so it can be cached indefinitely
+FINGERPRINTED_ROUTE_TEMPLATE = Template("""\
+@get('/${path}')
+def load_resource():
+    return serve_static('${file}', root='${root}', immutable=True)
+""" )
+
+# NOTE: a lookup table, in place of a route per file, checked by a hook before
+#       any route is, rather than by a catch-all route, so any other request
+#       is routed as usual (to ANY routes, or with a 405 for a POST-only one)
+STATIC_TABLE_TEMPLATE = Template("""\
+STATIC_FILES = { # path: (file, root, immutable)
+${entries}
+}
+
+@hook('before_request')
+def load_resource():
+    if request.method not in ('GET', 'HEAD'):
+        return
+    entry = STATIC_FILES.get(request.path[1:])
+    if entry is not None:
+        filename, root, immutable = entry
+        raise serve_static(filename, root=root, immutable=immutable)
 """ )
 
+STATIC_TABLE_ENTRY = "    {!r}: ({!r}, {!r}, {!r}),"
+
 
 ##### Route Generator Class ####################################################
 
 class RouteGenerator:
 
-    def __init__(self, src_dir, dest_dir):
+    def __init__(self, src_dir, dest_dir, manifest=None, static_table=False,
+                 fingerprints=None, copy_images=True):
         self.src_path = lambda *p: normpath(abspath(join(src_dir, *p))) # root
         self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www
+        self.manifest = manifest # BuildManifest, skips unchanged resources
+        self.static_table = static_table # one route, backed by a lookup table
+        self.fingerprints = fingerprints # FingerprintGenerator, adds hashed routes
+        self.copy_images = copy_images # False when res/img is optimized instead
+
+    def _get_resource_folders(self):
+        # (source, destination) NOTE: static must be copied first
+        folders = [
+            (self.src_path('res', 'static'), self.dest_path('static')),
+            (self.src_path('res', 'img'), self.dest_path('static', 'img')),
+            (self.src_path('res', 'font'), self.dest_path('static', 'font')),
+        ]
+        if not self.copy_images:
+            folders.remove(folders[1])
+        return folders
+
+    def _copy_file(self, src_fp, dest_fp):
+        if self.manifest and self.manifest.is_current(src_fp):
+            return
+        with span(relpath(src_fp, self.src_path()), 'copy'):
+            shutil.copy(src_fp, dest_fp)
+        if self.manifest:
+            self.manifest.record(src_fp, dest_fp)
 
-    def _copy_resource(self, src_folder, dest_folder):
-        src = self.src_path('res', src_folder)
+    def _copy_resource(self, src, dest):
         if not os.path.isdir(src):
-            print('Folder res/'+ src_folder, 'not found')
+            print('Folder', relpath(src, self.src_path()), 'not found')
             return
-        dest = self.dest_path('static', dest_folder)
-        os.mkdir(dest)
+        os.makedirs(dest, exist_ok=True)
         for root, dirs, files in os.walk(src):
             path = relpath(root, src)
             for dirname in dirs:
-                print(dirname)
-                os.mkdir(join(dest, path, dirname))
+                os.makedirs(join(dest, path, dirname), exist_ok=True)
             for filename in files:
                 if filename.startswith('~'):
                     continue
                 if filename in IGNORED_FILES:
                     continue
-                shutil.copy(
+                self._copy_file(
                     join(root, filename),
-                    join(dest, path, filename)
+                    normpath(join(dest, path, filename))
                 )
 
+    def _update_file(self, src_fp, folders):
+        # copy a single changed file, or remove the copy of a deleted one
+        src_fp = normpath(abspath(src_fp))
+        for src, dest in folders:
+            if not src_fp.startswith(src + os.sep):
+                continue
+            dest_fp = join(dest, relpath(src_fp, src))
+            filename = os.path.basename(src_fp)
+            if filename.startswith('~') or filename in IGNORED_FILES:
+                return False
+            if os.path.isfile(src_fp):
+                os.makedirs(os.path.dirname(dest_fp), exist_ok=True)
+                self._copy_file(src_fp, dest_fp)
+            elif os.path.isfile(dest_fp):
+                os.remove(dest_fp)
+                if self.manifest:
+                    self.manifest.remove(src_fp)
+            return True
+        return False
+
     def copy_resources(self):
         # NOTE: copy resources over and then generate the routes
-        # NOTE: static must be copied first
-        self._copy_resource('static', '')
-        self._copy_resource('img', 'img')
-        self._copy_resource('font', 'font')
+        for src, dest in self._get_resource_folders():
+            self._copy_resource(src, dest)
+
+    def copy_resource(self, src_fp): # returns False if src_fp isn't a resource
+        return self._update_file(src_fp, self._get_resource_folders())
+
+    def copy_scripts(self):
+        self._copy_resource(self.src_path('dev', 'js'), self.dest_path('static', 'js'))
+
+    def copy_script(self, src_fp):
+        return self._update_file(src_fp, [
+            (self.src_path('dev', 'js'), self.dest_path('static', 'js'))
+        ])
 
     def copy_views(self):
+        # NOTE: views are always copied fresh, later stages modify them in place
+        if os.path.isdir(self.dest_path('views')):
+            shutil.rmtree(self.dest_path('views'))
         shutil.copytree(
             self.src_path('dev', 'views'),
             self.dest_path('views')
         )
 
+    def copy_view(self, src_fp):
+        src_fp = normpath(abspath(src_fp))
+        dest_fp = self.dest_path('views', relpath(src_fp, self.src_path('dev', 'views')))
+        if os.path.isfile(src_fp):
+            os.makedirs(os.path.dirname(dest_fp), exist_ok=True)
+            shutil.copy(src_fp, dest_fp)
+        elif os.path.isfile(dest_fp):
+            os.remove(dest_fp)
+
+    def get_route_files(self): # every file a route is generated for
+        return sorted(
+            [ join('views', r) for r in self._get_routes('views') ] +
+            [ join('static', r) for r in self._get_routes('static') ]
+        )
+
     def _get_routes(self, folder):
-        for root, _, files in os.walk(self.dest_path(folder)):
-            for filename in files:
+        for root, dirs, files in os.walk(self.dest_path(folder)):
+            dirs.sort()
+            for filename in sorted(files):
                 if filename.startswith('~'):
                     # don't create routes for ~ prefixed files
                     continue
+                name, ext = os.path.splitext(filename)
+                if ext in COMPRESSED_EXTENSIONS and name in files:
+                    continue
                 yield normpath(join(
                     relpath(root, self.dest_path(folder)),
                     filename
                 )).replace('\\', '/')
 
-    def _get_static_routes(self, folder):
-        ret_routes = []
-        for route in self._get_routes(folder):
-            ret_routes.append((
-                STATIC_ROUTE_TEMPLATE,
+    def _get_static_route(self, route, folder):
+        routes = [(
+            STATIC_ROUTE_TEMPLATE,
+            {
+                'path': route,
+                'file': route,
+                'root': folder,
+            }
+        )]
+        if self.fingerprints:
+            # the same file, also served at its content-hashed url
+            fp = self.dest_path(folder, *route.split('/'))
+            routes.append((
+                FINGERPRINTED_ROUTE_TEMPLATE,
                 {
-                    'path': route,
+                    'path': self.fingerprints.get_route(route, fp),
                     'file': route,
                     'root': folder,
                 }
             ))
+        return routes
+
+    def _get_static_routes(self, folder):
+        ret_routes = []
+        for route in self._get_routes(folder):
+            ret_routes.extend(self._get_static_route(route, folder))
         return ret_routes
 
     def get_main_routes(self):
@@ -141,17 +266,10 @@ class RouteGenerator:
     def get_static_routes(self):
         # TODO: support for custom static folders
         routes = []
-        for filename in os.listdir(self.dest_path('static')):
-            if not os.path.isfile(filename):
+        for filename in sorted(os.listdir(self.dest_path('static'))):
+            if not os.path.isfile(self.dest_path('static', filename)):
                 continue
-            routes.append((
-                STATIC_ROUTE_TEMPLATE,
-                {
-                    'path': filename,
-                    'file': filename,
-                    'root': 'static',
-                }
-            ))
+            routes.extend(self._get_static_route(filename, 'static'))
         return routes
 
     def get_favicon_routes(self):
@@ -169,17 +287,52 @@ class RouteGenerator:
     def get_js_routes(self):
         return self._get_static_routes('static/js')
 
+    def _get_all_static_routes(self):
+        # NOTE: ordered as in app.py, where later routes replace earlier ones
+        return {
+            'static_routes': self.get_static_routes(),
+            'favicon_routes': self.get_favicon_routes(),
+            'image_routes': self.get_image_routes(),
+            'font_routes': self.get_font_routes(),
+            'css_routes': self.get_css_routes(),
+            'js_routes': self.get_js_routes(),
+        }
+
+    def _get_static_table(self):
+        routes = self._get_all_static_routes()
+        entries = {}
+        for section in routes.values():
+            for template, route in section:
+                entries[route['path']] = (route,
+                    template is FINGERPRINTED_ROUTE_TEMPLATE)
+        routes = { section: '' for section in routes }
+        routes['static_routes'] = [(
+            STATIC_TABLE_TEMPLATE,
+            {
+                'entries': '\n'.join([
+                    STATIC_TABLE_ENTRY.format(r['path'], r['file'], r['root'],
+                                              immutable)
+                    for r, immutable in entries.values()
+                ]),
+            }
+        )]
+        return routes
+
     def populate_app_file(self):
+        # NOTE: the app imports its static file handling from serving.py, its
+        #       template warming from templating.py and its multi-process
+        #       server from prefork.py
+        for module in RUNTIME_MODULES:
+            shutil.copy(join(TEMPLATES_DIR, module), self.dest_path(module))
+        if self.static_table:
+            static_routes = self._get_static_table()
+        else:
+            static_routes = self._get_all_static_routes()
         # Read template file into a string
-        with open('./templates/app.py') as app_tpl:
+        with open(join(TEMPLATES_DIR, 'app.py')) as app_tpl:
             Template.populate(Template(app_tpl.read()), self.dest_path('app.py'),
                 doc_string="",
                 main_routes=self.get_main_routes(),
                 api_routes=self.get_api_routes(),
-                static_routes=self.get_static_routes(),
-                favicon_routes=self.get_favicon_routes(),
-                image_routes=self.get_image_routes(),
-                font_routes=self.get_font_routes(),
-                css_routes=self.get_css_routes(),
-                js_routes=self.get_js_routes()
+                **static_routes
             )
@@ -8,6 +8,16 @@
     for specific pages.  And defers non-render-blocking CSS to be loaded further
     on down the chain.
 
+    Incremental builds keep a graph of each entry point's `@import`, `@use` and
+    `@forward` dependencies between builds, and only recompile the entry points
+    whose transitive inputs (including the generated _all.scss) have changed.
+
+    With `auto_critical`, the css inlined into each view is instead extracted
+    from all of the compiled stylesheets: only the rules matching the elements,
+    classes and ids in the view's markup (up to its `<!-- fold -->`, includes
+    and all) are inlined.  The rest of the critical stylesheets is deferred
+    along with the non-critical ones.
+
     Requirements:
     * libsass
 
@@ -15,17 +25,43 @@
     :license: MIT.
 """
 
-__all__ = [ 'StylesheetGenerator' ]
+__all__ = [ 'StylesheetGenerator', 'StylesheetCompileError' ]
 
 import sass
 import os
 import os.path
-from os.path import isfile, isdir, abspath, normpath, join, relpath
+from os.path import isfile, isdir, abspath, normpath, join, relpath, dirname
 from shutil import rmtree
+from concurrent.futures import ProcessPoolExecutor, Future
+import json
+import re
+
+from manifest import BUILD_DIR, hash_file
+from css import parse_stylesheet, serialize, minify, selector_matches, \
+                extract_rules, prune_rules, merge_rules, count_selectors
+from markup import Markup, read_view, scan_markup, scan_script, VIEW_EXTENSIONS
+from tracing import span, submit
 
 
 ##### Constants ################################################################
 
+SASS_EXTENSIONS = [ '.scss', '.sass', '.css' ]
+
+GRAPH_FILE = 'sass-graph.json'
+GRAPH_VERSION = 2
+
+# in static/css, the critical rules each view doesn't inline (auto_critical)
+DEFERRED_CRITICAL_DIR = 'critical'
+
+### Patterns
+
+# strings are matched so that comment markers inside of them are left alone
+COMMENT_PATTERN = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/|//[^\n]*', re.S)
+IMPORT_PATTERN = re.compile(r'@(?:import|use|forward)\s+([^;]+?)\s*(?:;|$)', re.M)
+IMPORT_PATH_PATTERN = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+IMPORT_MODIFIER_PATTERN = re.compile(r'\s+(?:as|with|show|hide)\b')
+
 ### Templates
 
 EMBEDED_CSS_BLOCK = """\
@@ -34,15 +70,12 @@ embeded_css = \"""{}\"""
 %>
 """
 
-STYLE_SHEET_HEAD_EL = """\
-<link rel="stylesheet" type="text/css" href="/{0}">
-"""
-
+# NOTE: {0} maps each page to its stylesheets, {1} are those of any other page
 DEFERRED_STYLES_FOOTER_BLOCK = """\
     <noscript id="deferred-styles">
-        {0}
-        % if defined('template') and template in {1}:
-        <link rel="stylesheet" type="text/css" href="/{{{{template}}}}.css">
+        % deferred_stylesheets = {0}
+        % for href in deferred_stylesheets.get(get('template'), {1}):
+        <link rel="stylesheet" type="text/css" href="{{{{href}}}}">
         % end
     </noscript>
     <script>
@@ -97,8 +130,158 @@ def _generate_all(path, include_partials=True):
     imports = _get_imports(path, 'modules')
     if include_partials:
         imports += _get_imports(path, 'partials')
+    contents = '\n'.join(imports)
+    try: # leave an unchanged file alone, so it isn't seen as modified
+        with open(join(path, '_all.scss'), 'r') as f:
+            if f.read() == contents:
+                return
+    except FileNotFoundError:
+        pass
     with open(join(path, '_all.scss'), 'w') as f:
-        f.write('\n'.join(imports))
+        f.write(contents)
+
+def _parse_imports(filepath):
+    with open(filepath, 'r') as f:
+        source = COMMENT_PATTERN.sub(lambda m: m.group(1) or '', f.read())
+    imports = []
+    for statement in IMPORT_PATTERN.finditer(source):
+        paths = IMPORT_MODIFIER_PATTERN.split(statement.group(1), 1)[0]
+        for match in IMPORT_PATH_PATTERN.finditer(paths):
+            imports.append(match.group(1) or match.group(2))
+    return imports
+
+def _resolve_import(name, base_dir):
+    # NOTE: follows sass' lookup order, partials and index files included
+    if name.startswith('sass:') or '://' in name or name.startswith('url('):
+        return None
+    path = normpath(join(base_dir, name))
+    folder, base = os.path.split(path)
+    if os.path.splitext(base)[-1].lower() in SASS_EXTENSIONS:
+        candidates = [ path, join(folder, '_' + base) ]
+    else:
+        candidates = [ join(folder, prefix + base + ext)
+                       for ext in SASS_EXTENSIONS for prefix in [ '', '_' ] ]
+        candidates += [ join(path, prefix + 'index' + ext)
+                        for ext in SASS_EXTENSIONS for prefix in [ '', '_' ] ]
+    for candidate in candidates:
+        if isfile(candidate):
+            return candidate
+    return None
+
+def _compile(src_fp, output_style):
+    # NOTE: module level so that it can be sent to worker processes
+    return sass.compile(filename=src_fp, output_style=output_style)
+
+def _compile_traced(name, src_fp, output_style):
+    with span(name, 'sass'):
+        return _compile(src_fp, output_style)
+
+def _run_inline(fn, *args): # a future for work done on the calling thread
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+##### Exceptions ###############################################################
+
+class StylesheetCompileError(Exception):
+
+    def __init__(self, errors): # [ (source filepath, exception) ]
+        self.errors = errors
+        super().__init__('\n'.join(
+            [ '{} stylesheet(s) failed to compile'.format(len(errors)) ] +
+            [ '{}:\n{}'.format(fp, e) for fp, e in errors ]
+        ))
+
+##### Dependency Graph Class ###################################################
+
+class SassDependencyGraph:
+
+    def __init__(self, src_dir, graph_fp, root_dir):
+        self.src_dir = abspath(src_dir) # "dev/sass"
+        self.root_dir = abspath(root_dir) # outputs are recorded relative to it
+        self.fp = graph_fp
+        self.src_key = lambda p: relpath(p, self.src_dir).replace('\\', '/')
+        self.entries = {} # entry point -> output, style and hashed inputs
+        self.imports = {} # parsed during this build only
+        self.hashes = {}  # hashed during this build only
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.fp, 'r') as f:
+                graph = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if graph.get('version') == GRAPH_VERSION:
+            self.entries = graph.get('entries', {})
+
+    def save(self):
+        os.makedirs(dirname(self.fp), exist_ok=True)
+        with open(self.fp, 'w') as f:
+            json.dump({
+                'version': GRAPH_VERSION,
+                'entries': self.entries,
+            }, f, indent=1, sort_keys=True)
+
+    def _get_imports(self, filepath):
+        if filepath not in self.imports:
+            resolved = [ _resolve_import(name, dirname(filepath))
+                         for name in _parse_imports(filepath) ]
+            self.imports[filepath] = [ r for r in resolved if r is not None ]
+        return self.imports[filepath]
+
+    def _hash(self, filepath):
+        if filepath not in self.hashes:
+            self.hashes[filepath] = hash_file(filepath)
+        return self.hashes[filepath]
+
+    def get_inputs(self, src_fp): # every file an entry point depends on
+        inputs, stack = set(), [ src_fp ]
+        while stack:
+            filepath = stack.pop()
+            if filepath in inputs:
+                continue
+            inputs.add(filepath)
+            stack.extend(self._get_imports(filepath))
+        return { self.src_key(fp): self._hash(fp) for fp in inputs }
+
+    def get_changes(self, src_fp, dest_fp, output_style):
+        # returns the reasons for rebuilding an entry point, if any
+        entry = self.entries.get(self.src_key(src_fp))
+        if entry is None:
+            return [ 'new entry point' ]
+        if not isfile(dest_fp):
+            return [ 'output missing' ]
+        if entry['style'] != output_style:
+            return [ 'output style changed to ' + output_style ]
+        inputs = self.get_inputs(src_fp)
+        changes = [ 'changed ' + fp for fp in sorted(inputs)
+                    if fp in entry['inputs'] and entry['inputs'][fp] != inputs[fp] ]
+        changes += [ 'added ' + fp for fp in sorted(inputs)
+                     if fp not in entry['inputs'] ]
+        changes += [ 'removed ' + fp for fp in sorted(entry['inputs'])
+                     if fp not in inputs ]
+        return changes
+
+    def record(self, src_fp, dest_fp, output_style):
+        self.entries[self.src_key(src_fp)] = {
+            'output': relpath(abspath(dest_fp), self.root_dir).replace('\\', '/'),
+            'style': output_style,
+            'inputs': self.get_inputs(src_fp),
+        }
+
+    def remove_missing(self, entry_points):
+        # forget deleted entry points, and remove the css they produced
+        current = set(self.src_key(src_fp) for src_fp, _ in entry_points)
+        for key in [ k for k in self.entries if k not in current ]:
+            output = normpath(join(self.root_dir, self.entries.pop(key)['output']))
+            if isfile(output):
+                os.remove(output)
+
 
 ##### Stylesheet Generator Class ###############################################
 
@@ -106,11 +289,24 @@ class StylesheetGenerator:
 
     # assuming correct src structure
     # TODO: make the necessary directories? or at least gracefully handle if they dont exist
-    def __init__(self, src_dir, dest_dir, deploy=False):
+    def __init__(self, src_dir, dest_dir, deploy=False, jobs=None,
+                 incremental=False, explain=False, fingerprints=None,
+                 auto_critical=False, safelist=()):
         self.src_dir = abspath(src_dir) # "dev/sass"
         self.dest_dir = abspath(join(dest_dir, 'css'))
         self.dest_path = lambda *p: normpath(join(self.dest_dir, *p))
+        self.build_path = lambda *p: normpath(join(self.dest_dir, '..', '..', BUILD_DIR, *p))
+        # NOTE: critical css is kept out of static so it's never routed
+        self.critical_path = lambda *p: self.build_path('critical', *p)
         self.deploy = deploy
+        self.jobs = jobs or os.cpu_count() or 1 # concurrent compilations
+        self.incremental = incremental # only recompile changed entry points
+        self.explain = explain # print why each entry point was recompiled
+        self.url = fingerprints.url if fingerprints else lambda url: url
+        self.auto_critical = auto_critical # extract critical css from markup
+        self.safelist = safelist # patterns of class and id names never pruned
+        self.views_path = lambda *p: self.dest_path('..', '..', 'views', *p)
+        self.parsed = {} # filepath -> (mtime, size, parsed stylesheet)
 
     ### HELPERS
     def _remove_artifacts(self):
@@ -125,38 +321,73 @@ class StylesheetGenerator:
                 if f in files_to_remove:
                     os.remove(join(root, f))
 
-    def _generate_sass(self, src_fp, dest_fp):
-        # TODO: watch.py (make this a global watch (views and js too))
-        # TODO: make watch.py a part of this project and not a file that just gets dropped in
+    def _compile_sass(self, entry_points): # [ (source, destination) ]
         output_style = "compressed" if self.deploy else "expanded"
-        compiled_output = sass.compile(filename=src_fp, output_style=output_style)
-        with open(dest_fp, 'w') as f:
-            f.write(compiled_output)
-
-    def _generate_non_critical(self):
-        src_path = join(self.src_dir, 'non-critical')
-        _generate_all(src_path)
+        if self.jobs == 1 or len(entry_points) < 2:
+            self._write_results(entry_points, [
+                _run_inline(_compile_traced, relpath(src_fp), src_fp, output_style)
+                for src_fp, _ in entry_points
+            ])
+            return
+        # NOTE: libsass holds the GIL, so compile on processes not threads
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            self._write_results(entry_points, [
+                submit(executor, relpath(src_fp), 'sass', _compile, src_fp, output_style)
+                for src_fp, _ in entry_points
+            ])
+
+    def _write_results(self, entry_points, futures):
+        # NOTE: written in submission order, errors are collected and raised
+        #       together once every entry point has been attempted
+        errors = []
+        for (src_fp, dest_fp), future in zip(entry_points, futures):
+            try:
+                compiled_output = future.result()
+            except sass.CompileError as e:
+                errors.append((src_fp, e))
+                continue
+            with open(dest_fp, 'w') as f:
+                f.write(compiled_output)
+        if errors:
+            raise StylesheetCompileError(errors)
+
+    def _get_sass_files(self, src_path, dest_path):
         # TODO: ignore .DS_Store files throughout this? (not relevent cause of _is_sass)
-        for sass_file in os.listdir(src_path):
-            # TODO: make _is_sass a helper function outside of this class
-            # TODO: maybe a helper that lists the sass files in the directory,
-            #       I think that's all I use this for anyway
+        entry_points = []
+        for sass_file in sorted(os.listdir(src_path)):
             fp = join(src_path, sass_file)
             if _is_sass(fp, accept_partials=False):
                 dest_file = os.path.splitext(sass_file)[0] + '.css' # TODO: min if deploy
-                self._generate_sass(fp, self.dest_path(dest_file))
+                entry_points.append((fp, dest_path(dest_file)))
+        return entry_points
+
+    def _get_non_critical(self):
+        src_path = join(self.src_dir, 'non-critical')
+        _generate_all(src_path)
+        return self._get_sass_files(src_path, self.dest_path)
+
+    def is_critical(self, dest_fp):
+        return normpath(dest_fp).startswith(self.critical_path() + os.sep)
 
-    def _generate_critical(self):
+    def _get_critical(self):
         _generate_all(self.src_dir, include_partials=False)
-        for sass_file in os.listdir(self.src_dir):
-            fp = join(self.src_dir, sass_file)
-            if _is_sass(fp, accept_partials=False):
-                dest_file = os.path.splitext(sass_file)[0] + '.css' # TODO: min if deploy
-                self._generate_sass(fp, self.dest_path('critical', dest_file))
+        return self._get_sass_files(self.src_dir, self.critical_path)
+
+    def _get_stale(self, graph, entry_points, output_style):
+        stale = []
+        for src_fp, dest_fp in entry_points:
+            changes = graph.get_changes(src_fp, dest_fp, output_style)
+            if not changes:
+                continue
+            stale.append((src_fp, dest_fp))
+            if self.explain:
+                print('Compiling', relpath(src_fp, self.src_dir) + ':',
+                    ', '.join(changes))
+        return stale
 
     def _get_general_critical_css(self):
         try:
-            with open(self.dest_path('critical', 'styles.css'), 'r') as f:
+            with open(self.critical_path('styles.css'), 'r') as f:
                 return f.read()
         except FileNotFoundError:
             pass
@@ -166,7 +397,7 @@ class StylesheetGenerator:
 
     def _get_critical_css(self, page):
         try:
-            with open(self.dest_path('critical', page + '.css'), 'r') as f:
+            with open(self.critical_path(page + '.css'), 'r') as f:
                 return f.read()
         except FileNotFoundError:
             pass
@@ -205,27 +436,94 @@ class StylesheetGenerator:
         except Exception as e:
             print('Error opening file', e)
 
+    def _parse_css(self, fp):
+        # NOTE: the same stylesheets are read for every view
+        if not isfile(fp):
+            return []
+        stat = os.stat(fp)
+        cached = self.parsed.get(fp)
+        if not cached or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open(fp, 'r') as f:
+                cached = (stat.st_mtime_ns, stat.st_size, parse_stylesheet(f.read()))
+            self.parsed[fp] = cached
+        return cached[2]
+
+    def _extract_critical_css(self, page):
+        markup = scan_markup(read_view(self.views_path(page + '.tpl'),
+                                       self.views_path(), fold=True))
+        matches = lambda selector: selector_matches(selector, markup)
+        # the hand written critical css, and then the rest in cascade order
+        critical, deferred = extract_rules(
+            self._parse_css(self.critical_path('styles.css')) +
+            self._parse_css(self.critical_path(page + '.css')),
+            matches
+        )
+        for sheet in [ 'styles.css', page + '.css' ]:
+            critical += extract_rules(self._parse_css(self.dest_path(sheet)), matches)[0]
+        write = minify if self.deploy else serialize
+        self._write_deferred_critical(page, write(deferred))
+        return write(critical)
+
+    def _write_deferred_critical(self, page, css):
+        fp = self.dest_path(DEFERRED_CRITICAL_DIR, page + '.css')
+        if not css:
+            if isfile(fp):
+                os.remove(fp)
+            return
+        os.makedirs(dirname(fp), exist_ok=True)
+        try: # leave an unchanged file alone, so it isn't seen as modified
+            with open(fp, 'r') as f:
+                if f.read() == css:
+                    return
+        except FileNotFoundError:
+            pass
+        with open(fp, 'w') as f:
+            f.write(css)
+
+    def _remove_deferred_critical(self, views):
+        # remove the deferred critical css of views that no longer exist
+        path = self.dest_path(DEFERRED_CRITICAL_DIR)
+        if not isdir(path):
+            return
+        for sheet in os.listdir(path):
+            if not self.auto_critical or os.path.splitext(sheet)[0] not in views:
+                os.remove(join(path, sheet))
+        if not os.listdir(path):
+            os.rmdir(path)
+
     def _get_deferred_styles(self):
-        styles_block = ''
         # TODO: inline critical before you get stylesheets
-        stylesheets = []
-        for sheet in os.listdir(self.dest_path()):
+        stylesheets = {}
+        for sheet in sorted(os.listdir(self.dest_path())):
             if _is_css(self.dest_path(sheet)):
-                stylesheets.append(os.path.splitext(sheet)[0])
-        if 'styles' in stylesheets:
-            stylesheets.remove('styles')
-            styles_block = STYLE_SHEET_HEAD_EL.format('styles.css')
-        return DEFERRED_STYLES_FOOTER_BLOCK.format(styles_block, stylesheets)
-
-    def inline_critical_css(self):
+                stylesheets[os.path.splitext(sheet)[0]] = self.url('/' + sheet)
+        default = [ stylesheets.pop('styles') ] if 'styles' in stylesheets else []
+        pages = { page: default + [ url ] for page, url in stylesheets.items() }
+        # NOTE: deferred critical css goes first, as it would have been inlined
+        deferred_critical = self.dest_path(DEFERRED_CRITICAL_DIR)
+        if isdir(deferred_critical):
+            for sheet in sorted(os.listdir(deferred_critical)):
+                page = os.path.splitext(sheet)[0]
+                url = self.url('/{}/{}'.format(DEFERRED_CRITICAL_DIR, sheet))
+                pages[page] = [ url ] + pages.get(page, default)
+        return DEFERRED_STYLES_FOOTER_BLOCK.format(pages, default)
+
+    def inline_critical_css(self, views=None):
         # take generated critical css, and the view file and inline in
         # TODO: raise exception if a css file exists with no view
         # NOTE: this is a combination of general and page specific
         general_inline_css = self._get_general_critical_css()
+        if views is None:
+            self._remove_deferred_critical(self._get_views())
         for view in self._get_views():
-            embeded_css = general_inline_css + self._get_critical_css(view)
-            self._inline_css(view, embeded_css)
-        rmtree(self.dest_path('critical'))
+            if views is not None and view not in views:
+                continue
+            with span(view, 'critical css'):
+                if self.auto_critical:
+                    embeded_css = self._extract_critical_css(view)
+                else:
+                    embeded_css = general_inline_css + self._get_critical_css(view)
+                self._inline_css(view, embeded_css)
 
     def load_deferred_styles(self):
         try:
@@ -237,19 +535,82 @@ class StylesheetGenerator:
         except Exception as e:
             print('Error opening file', e)
 
+    def _get_site_markup(self):
+        # every element, class and id used by any view or script
+        found = Markup(safelist=self.safelist)
+        for path, scan, extensions in [
+                (self.views_path(), scan_markup, VIEW_EXTENSIONS),
+                (self.dest_path('..', 'js'), scan_script, [ '.js' ]) ]:
+            for root, dirs, files in os.walk(path):
+                for filename in files:
+                    if os.path.splitext(filename)[-1].lower() in extensions:
+                        with open(join(root, filename), 'r') as f:
+                            found.update(scan(f.read()))
+        return found
+
+    def _get_compiled_stylesheets(self):
+        for path in [ self.dest_dir, self.critical_path() ]:
+            for root, dirs, files in os.walk(path):
+                for filename in sorted(files):
+                    if os.path.splitext(filename)[-1].lower() == '.css':
+                        yield join(root, filename)
+
+    def optimize(self):
+        # NOTE: must run before the stylesheets are inlined or deferred
+        markup = self._get_site_markup()
+        matches = lambda selector: selector_matches(selector, markup)
+        for fp in self._get_compiled_stylesheets():
+            name = relpath(fp, self.build_path('..'))
+            with span(name, 'optimize css'):
+                with open(fp, 'r') as f:
+                    original = f.read()
+                nodes = parse_stylesheet(original)
+                pruned = prune_rules(nodes, matches)
+                optimized = minify(merge_rules(pruned))
+                with open(fp, 'w') as f:
+                    f.write(optimized)
+                before, after = len(original.encode()), len(optimized.encode())
+                print('Optimized {}: {} -> {} bytes ({} saved), {} unused '
+                      'selector(s) removed'.format(name,
+                      before, after, before - after,
+                      count_selectors(nodes) - count_selectors(pruned)))
+
     ### MAIN
     def generate(self):
         # TODO: think about source maps
-        try: # create destination path
-            os.makedirs(self.dest_dir, exist_ok=False)
-        except OSError as e:
-            rmtree(self.dest_dir)
-            os.makedirs(self.dest_dir)
+        # NOTE: deploy builds are never incremental, optimized stylesheets
+        #       depend on every view and script rather than on their sources
+        if not self.incremental or self.deploy:
+            for path in [ self.dest_dir, self.critical_path() ]:
+                if isdir(path):
+                    rmtree(path)
+        os.makedirs(self.dest_dir, exist_ok=True)
+        os.makedirs(self.critical_path(), exist_ok=True)
 
         # critical
-        os.makedirs(self.dest_path('critical'))
-        self._generate_critical()
+        entry_points = self._get_critical()
 
         # non-critical
         if isdir(join(self.src_dir, 'non-critical')):
-            self._generate_non_critical()
+            entry_points += self._get_non_critical()
+
+        # NOTE: the graph is recorded either way, so the next build can use it
+        output_style = "compressed" if self.deploy else "expanded"
+        graph = SassDependencyGraph(self.src_dir, self.build_path(GRAPH_FILE),
+                                    self.build_path('..', '..'))
+        graph.remove_missing(entry_points)
+        stale = entry_points
+        if self.incremental and not self.deploy:
+            stale = self._get_stale(graph, entry_points, output_style)
+        failed = set()
+        try:
+            self._compile_sass(stale)
+            return stale
+        except StylesheetCompileError as e:
+            failed = set(fp for fp, _ in e.errors)
+            raise
+        finally:
+            for src_fp, dest_fp in stale:
+                if src_fp not in failed:
+                    graph.record(src_fp, dest_fp, output_style)
+            graph.save()
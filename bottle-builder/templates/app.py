@@ -2,9 +2,14 @@
 """
 ${doc_string}
 """
-from bottle import run, route, get, post, error
+from bottle import run, route, get, post, error, hook
 from bottle import static_file, template, request
 from bottle import HTTPError
+from serving import serve_static
+from templating import warm_templates, cached_view
+from prefork import PreforkServer, server_options
+import serving
+import templating
 
 $ph{Command Line Interface}
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
@@ -30,6 +35,54 @@ parser.add_argument('-p', '--port',
     default="8080",
     help='port to run server on'
 )
+parser.add_argument('-s', '--server',
+    type=str,
+    default=None,
+    help='the server backend to run on: prefork, or any that bottle supports '
+    '(e.g. wsgiref, waitress, cheroot, gunicorn). Defaults to cherrypy when '
+    'deploying and wsgiref otherwise'
+)
+parser.add_argument('-w', '--workers',
+    type=int,
+    default=os.cpu_count(),
+    help='the number of worker processes of the prefork server'
+)
+parser.add_argument('-t', '--threads',
+    type=int,
+    default=None,
+    help='the size of the thread pool (of each worker) of the prefork, '
+    'cherrypy, cheroot and waitress servers. Defaults to the server\'s own'
+)
+parser.add_argument('--backlog',
+    type=int,
+    default=None,
+    help='the size of the listen backlog of the prefork, cherrypy, cheroot '
+    'and waitress servers. Defaults to the server\'s own'
+)
+parser.add_argument('--reuse-port',
+    action='store_true',
+    help='give each prefork worker its own socket, bound with SO_REUSEPORT, '
+    'rather than sharing one'
+)
+parser.add_argument('--static-cache',
+    type=float,
+    default=16,
+    help='megabytes of small static resources to keep in memory, 0 disables it'
+)
+parser.add_argument('--static-cache-file',
+    type=float,
+    default=256,
+    help='kilobytes a static resource may be to be kept in memory'
+)
+parser.add_argument('--no-page-cache',
+    action='store_true',
+    help='render every page, even those of views with a cache directive '
+    '(which are only cached when deploying)'
+)
+parser.add_argument('--template-timings',
+    action='store_true',
+    help='print the time taken to load and compile each view at startup'
+)
 args = parser.parse_args()
 
 # change working directory to script directory
@@ -58,7 +111,28 @@ def error404(error):
     return 'nothing to see here'
 
 $ph{Run Server}
+serving.STATIC_CACHE_SIZE = int(args.static_cache * 1024 * 1024)
+serving.STATIC_CACHE_FILE_SIZE = int(args.static_cache_file * 1024)
+templating.PAGE_CACHE = args.deploy and not args.no_page_cache
+
+# load and compile every view before serving the first request
+timings = warm_templates()
+if args.template_timings:
+    for view, seconds in sorted(timings, key=lambda t: -t[1]):
+        print('{:>8.2f}ms  {}'.format(seconds * 1000, view))
+    print('{:>8.2f}ms  total'.format(sum(s for _, s in timings) * 1000))
+
+server = args.server or ('cherrypy' if args.deploy else 'wsgiref')
+options = server_options(server, args.threads, args.backlog)
+if server == 'prefork':
+    # NOTE: forked after the routes and views above are loaded, which the
+    #       workers then share
+    server = PreforkServer
+    options.update(workers=args.workers, reuse_port=args.reuse_port)
+
 if args.deploy:
-    run(host=args.ip, port=args.port, server='cherrypy') #deployment
+    run(host=args.ip, port=args.port, server=server, **options) #deployment
 else:
-    run(host=args.ip, port=args.port, debug=True, reloader=True) #development
+    serving.RELOAD_ASSETS = True # pick up the asset manifest of each rebuild
+    run(host=args.ip, port=args.port, server=server, debug=True, reloader=True,
+        **options) #development
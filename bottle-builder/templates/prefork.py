@@ -0,0 +1,289 @@
+"""
+Multi-process serving for the generated app.
+
+The app's routes are registered and its views compiled before any worker is
+forked, so every worker shares them with the master, copy-on-write, rather
+than loading its own copy.  Each worker serves requests on a pool of
+threads, from one listening socket shared by all of them (or, with
+reuse_port, from a socket of its own, bound with SO_REUSEPORT so the kernel
+balances connections between the workers).
+
+Files the app responds with (see serving.py) are sent with sendfile, from
+the page cache straight to the socket.
+
+The master restarts workers that die, and handles signals:
+* SIGTERM, SIGINT: stop, after the workers finish the requests they started
+* SIGHUP: restart gracefully, e.g. after deploying a new build; the workers
+  finish their requests, then the master re-executes the app, keeping the
+  shared listening socket open so that no connection is refused meanwhile
+"""
+from bottle import ServerAdapter
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath
+import threading
+import socket
+import signal
+import time
+import sys
+import gc
+import os
+
+__all__ = [ 'PreforkServer', 'server_options' ]
+
+### Constants ##################################################################
+
+DEFAULT_THREADS = 8
+
+DEFAULT_BACKLOG = socket.SOMAXCONN
+
+# seconds workers are given to finish their requests when stopped
+GRACEFUL_TIMEOUT = 30
+
+# seconds between checks of the workers, and of a worker's stop flag
+POLL_INTERVAL = 0.5
+
+# the listening socket, inherited over a graceful restart
+SOCKET_FD_ENV = 'PREFORK_SOCKET_FD'
+
+# NOTE: resolved on import, before the app changes its working directory
+ARGV = [ sys.executable, abspath(sys.argv[0]) ] + sys.argv[1:]
+
+# the thread pool and listen backlog options of other bottle server backends
+SERVER_TUNABLES = {
+    'prefork': ('threads', 'backlog'),
+    'cherrypy': ('numthreads', 'request_queue_size'),
+    'cheroot': ('numthreads', 'request_queue_size'),
+    'waitress': ('threads', 'backlog'),
+}
+
+### Helpers ####################################################################
+
+def server_options(server, threads=None, backlog=None):
+    # bottle.run options for the server's thread pool and backlog, if it has them
+    names = SERVER_TUNABLES.get(server)
+    if names is None:
+        return {}
+    return { name: value for name, value in zip(names, (threads, backlog))
+             if value is not None }
+
+def _bind(host, port, backlog, reuse_port=False):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    # NOTE: workers all wait on a shared socket, the ones that lose the race
+    #       to accept a connection must not block
+    sock.setblocking(False)
+    return sock
+
+class _SendfileHandler(ServerHandler):
+
+    def sendfile(self):
+        filelike = self.result.filelike
+        if not hasattr(os, 'sendfile') or not hasattr(filelike, 'fileno'):
+            return False
+        # NOTE: a serving.FileRange, or a whole file
+        offset = getattr(filelike, 'offset', None)
+        if offset is None:
+            offset = filelike.tell()
+        count = getattr(filelike, 'length', None)
+        if count is None:
+            count = os.fstat(filelike.fileno()).st_size - offset
+        if not self.headers_sent:
+            self.send_headers()
+        connection = self.request_handler.connection
+        while count > 0:
+            sent = os.sendfile(connection.fileno(), filelike.fileno(), offset, count)
+            if sent == 0:
+                break # truncated since it was opened
+            offset += sent
+            count -= sent
+            self.bytes_sent += sent
+        return True
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def address_string(self): # no reverse dns lookups
+        return self.client_address[0]
+
+    def handle(self):
+        # as WSGIRequestHandler.handle, with a handler that can sendfile
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = self.request_version = self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = _SendfileHandler(self.rfile, self.wfile, self.get_stderr(),
+                                   self.get_environ(), multithread=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_request(self, *args, **kwargs):
+        if not self.server.quiet:
+            super().log_request(*args, **kwargs)
+
+### Worker Server ##############################################################
+
+class PooledWSGIServer(WSGIServer):
+    # serves an already listening socket, handling requests on a thread pool
+
+    timeout = POLL_INTERVAL
+
+    def __init__(self, sock, app, threads, quiet=False):
+        super().__init__(sock.getsockname()[:2], _QuietHandler,
+                         bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.server_port = self.server_address[1]
+        self.setup_environ()
+        self.set_app(app)
+        self.quiet = quiet
+        self.stopping = False
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # NOTE: stop accepting while every thread is busy, so that idle
+        #       workers take the waiting connections instead
+        self.slots = threading.BoundedSemaphore(threads)
+
+    def get_request(self):
+        connection, address = self.socket.accept()
+        connection.setblocking(True)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            self.handle_request()
+        self.executor.shutdown(wait=True) # finish the requests already accepted
+
+### Prefork Server #############################################################
+
+class PreforkServer(ServerAdapter):
+    # bottle.run(server=PreforkServer, workers=4, threads=8, backlog=1024)
+
+    def run(self, app):
+        self.app = app
+        self.workers = int(self.options.get('workers') or os.cpu_count() or 1)
+        self.threads = int(self.options.get('threads') or DEFAULT_THREADS)
+        self.backlog = int(self.options.get('backlog') or DEFAULT_BACKLOG)
+        self.reuse_port = self.options.get('reuse_port', False)
+        if self.reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('SO_REUSEPORT is not supported on this platform')
+        self.socket = None if self.reuse_port else self._get_socket()
+        self.pids = {} # worker pid: slot
+        self.signal = None
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._on_signal)
+        # NOTE: keeps the garbage collector from touching, and so copying, the
+        #       objects every worker inherits
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+        if not self.quiet:
+            print('Forking {} worker(s) of {} thread(s) (pid {})'.format(
+                self.workers, self.threads, os.getpid()))
+        try:
+            self._supervise()
+        finally:
+            self._stop_workers()
+        if self.signal == signal.SIGHUP:
+            self._reexecute()
+        if self.socket is not None:
+            self.socket.close()
+
+    def _get_socket(self):
+        fd = os.environ.pop(SOCKET_FD_ENV, None)
+        if fd is None:
+            return _bind(self.host, self.port, self.backlog)
+        sock = socket.socket(fileno=int(fd))
+        sock.setblocking(False)
+        return sock
+
+    def _on_signal(self, sig, frame):
+        self.signal = sig
+
+    def _supervise(self):
+        while self.signal is None:
+            for slot in set(range(self.workers)) - set(self.pids.values()):
+                self._spawn(slot)
+            time.sleep(POLL_INTERVAL)
+            self._reap()
+
+    def _reap(self):
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            if self.pids.pop(pid, None) is not None and self.signal is None:
+                print('Worker {} exited ({}), restarting it'.format(pid, status),
+                      file=sys.stderr)
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = slot
+            return
+        status = 0
+        try:
+            self._work()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            # NOTE: never return into the master's code (bottle.run, atexit)
+            os._exit(status)
+
+    def _work(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # the master stops workers
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        sock = self.socket or _bind(self.host, self.port, self.backlog, True)
+        server = PooledWSGIServer(sock, self.app, self.threads, self.quiet)
+        def stop(sig, frame):
+            server.stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_until_stopped()
+
+    def _stop_workers(self):
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.pids and time.monotonic() < deadline:
+            time.sleep(0.05)
+            self._reap()
+        for pid in self.pids:
+            os.kill(pid, signal.SIGKILL)
+        while self.pids:
+            pid, _ = os.wait()
+            self.pids.pop(pid, None)
+
+    def _reexecute(self):
+        # NOTE: with reuse_port there's no shared socket to pass on, and
+        #       connections queued on a stopped worker's socket are reset
+        if not self.quiet:
+            print('Restarting (pid {})'.format(os.getpid()))
+        env = dict(os.environ)
+        if self.socket is not None:
+            os.set_inheritable(self.socket.fileno(), True)
+            env[SOCKET_FD_ENV] = str(self.socket.fileno())
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execve(ARGV[0], ARGV, env)
@@ -0,0 +1,388 @@
+"""
+Static resource serving for the generated app.
+
+Resources precompressed at build time are served in the best encoding the
+client accepts, with the Content-Encoding and Vary headers set accordingly.
+Resources served at a fingerprinted url are marked as cacheable forever.
+
+Conditional requests for resources in the asset manifest (assets.json,
+written by the builder) are answered from memory, without a stat.  Entries
+that no longer match their file's size and modification time, when the
+manifest is loaded or once the file is opened, are dropped, and the file is
+served with a stat, as bottle's static_file serves it.  In development the
+manifest is reloaded whenever the builder rewrites it.
+
+Small resources in the manifest (and their precompressed variants) are kept
+in memory once served, in a cache bounded by its total size and evicting the
+least recently used first.  A cached resource is read again once its ETag in
+the manifest changes.
+
+Larger resources, and range requests, are answered with the open file (or
+the requested part of it) handed to the server's `wsgi.file_wrapper`, which
+servers that support it (the prefork server, gunicorn, ...) send with
+sendfile, without copying it through python.  Requests for several ranges
+are answered with a multipart/byteranges response, read with os.pread.
+"""
+from bottle import static_file, request, parse_date, parse_range_header
+from bottle import HTTPResponse, HTTPError
+from os.path import isfile, join, dirname, abspath, getmtime
+from collections import OrderedDict
+from email.utils import formatdate
+from binascii import hexlify
+import threading
+import os
+import posixpath
+import mimetypes
+import json
+
+__all__ = [ 'serve_static' ]
+
+### Constants ##################################################################
+
+# (content-coding, file extension) in order of preference
+ENCODINGS = [ ('br', '.br'), ('gzip', '.gz') ]
+
+# NOTE: for fingerprinted urls, which change whenever the content does
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+ASSETS_FILE = join(dirname(abspath(__file__)), 'assets.json')
+
+# NOTE: more (after merging overlapping ones) and the range header is ignored
+MAX_RANGES = 16
+
+# ranges closer than this are merged, rather than sent as separate parts
+RANGE_MERGE_GAP = 80
+
+# bytes read at a time for multipart/byteranges responses
+CHUNK_SIZE = 64 * 1024
+
+### Helpers ####################################################################
+
+def _is_current(representation, stat):
+    # NOTE: whole seconds, as a zip (and Last-Modified) keeps them
+    return representation['size'] == stat.st_size and \
+           int(representation['mtime']) == int(stat.st_mtime)
+
+def _check_assets(assets, app_dir):
+    # drops the entries (and variants) that no longer describe their file,
+    # e.g. edited since the build, which are then served with a stat instead
+    extensions = dict(ENCODINGS)
+    current = {}
+    for path, asset in assets.items():
+        fp = join(app_dir, path)
+        try:
+            if not _is_current(asset, os.stat(fp)):
+                continue
+        except OSError:
+            continue
+        encodings = {}
+        for coding, representation in asset['encodings'].items():
+            try:
+                if _is_current(representation, os.stat(fp + extensions[coding])):
+                    encodings[coding] = representation
+            except (OSError, KeyError):
+                pass
+        current[path] = dict(asset, encodings=encodings)
+    return current
+
+def _load_assets():
+    try:
+        mtime = getmtime(ASSETS_FILE)
+        with open(ASSETS_FILE) as f:
+            return mtime, _check_assets(json.load(f), dirname(ASSETS_FILE))
+    except (OSError, ValueError):
+        return None, {}
+
+# path: { size, mtime, etag, type, encodings: { coding: { size, mtime, etag } } }
+ASSETS_MTIME, ASSETS = _load_assets()
+
+# NOTE: set by the app when not deployed, costs a stat of assets.json per request
+RELOAD_ASSETS = False
+
+# NOTE: set by the app, in bytes, a size of 0 disables the cache
+STATIC_CACHE_SIZE = 16 * 1024 * 1024
+STATIC_CACHE_FILE_SIZE = 256 * 1024
+
+def _get_assets():
+    global ASSETS_MTIME, ASSETS
+    if RELOAD_ASSETS:
+        try:
+            mtime = getmtime(ASSETS_FILE)
+        except OSError:
+            mtime = None
+        if mtime != ASSETS_MTIME:
+            ASSETS_MTIME, ASSETS = _load_assets()
+    return ASSETS
+
+def _accepted_encodings(header):
+    # parses `Accept-Encoding`, e.g. "gzip, deflate;q=0.5, br;q=1.0, *;q=0"
+    qualities = {}
+    for coding in header.split(','):
+        coding, *params = coding.lower().split(';')
+        coding = coding.strip()
+        quality = 1.0
+        # NOTE: q can follow other parameters, e.g. "gzip; foo=1; q=0"
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+    default = qualities.get('*', 0.0)
+    return set(c for c, _ in ENCODINGS if qualities.get(c, default) > 0)
+
+def _get_variants(filename, root):
+    return [ (coding, filename + ext) for coding, ext in ENCODINGS
+             if isfile(join(root, filename + ext)) ]
+
+def _not_modified(representation):
+    # NOTE: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [ e.strip() for e in if_none_match.split(',') ]
+        etags = [ e[2:] if e.startswith('W/') else e for e in etags ]
+        return '*' in etags or representation['etag'] in etags
+    if_modified_since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        since = parse_date(if_modified_since.split(';')[0].strip())
+        # NOTE: the manifest's mtime, as the Last-Modified _get_headers sends
+        return since is not None and since >= int(representation['mtime'])
+    return False
+
+def _get_headers(asset, representation, coding):
+    # as static_file sends them, but from the manifest rather than a stat
+    mimetype = asset['type']
+    if mimetype.startswith('text/') or mimetype == 'application/javascript':
+        mimetype += '; charset=UTF-8'
+    headers = {
+        'Content-Type': mimetype,
+        'Content-Length': str(representation['size']),
+        'Last-Modified': formatdate(representation['mtime'], usegmt=True),
+        'Accept-Ranges': 'bytes',
+    }
+    if coding:
+        headers['Content-Encoding'] = coding
+    return headers
+
+def _get_ranges(representation, size):
+    # [ (start, end) ] requested, [] if none are satisfiable, or None to send
+    # the whole file
+    header = request.environ.get('HTTP_RANGE', '')
+    if not header.strip().lower().startswith('bytes='):
+        return None
+    # NOTE: If-Range asks for the whole file, unless it's unchanged
+    if_range = request.environ.get('HTTP_IF_RANGE', '').strip()
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if if_range != representation['etag']:
+                return None
+        elif parse_date(if_range) != int(representation['mtime']):
+            return None
+    ranges = []
+    for start, end in sorted(parse_range_header(header.strip(), size)):
+        if ranges and start <= ranges[-1][1] + RANGE_MERGE_GAP:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+    return None if len(ranges) > MAX_RANGES else ranges
+
+### File Bodies ################################################################
+
+class FileRange:
+    # the part of an open file a range response sends, for wsgi.file_wrapper
+
+    def __init__(self, f, offset, length):
+        self.file = f
+        self.offset = offset
+        self.length = length
+        self.remaining = length
+        f.seek(offset)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+class MultipartRanges:
+    # a multipart/byteranges body, its parts read as they're sent
+
+    def __init__(self, f, ranges, size, mimetype):
+        self.file = f
+        self.boundary = hexlify(os.urandom(16)).decode('ascii')
+        self.parts = [ ('\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes '
+                        '{}-{}/{}\r\n\r\n'.format(self.boundary, mimetype, start,
+                        end - 1, size).encode('latin1'), start, end)
+                       for start, end in ranges ]
+        self.closing = '\r\n--{}--\r\n'.format(self.boundary).encode('latin1')
+        self.length = len(self.closing) + sum(len(head) + end - start
+                                              for head, start, end in self.parts)
+
+    def __iter__(self):
+        fileno = self.file.fileno()
+        for head, start, end in self.parts:
+            yield head
+            while start < end:
+                data = os.pread(fileno, min(CHUNK_SIZE, end - start), start)
+                if not data:
+                    return # truncated since it was opened
+                start += len(data)
+                yield data
+        yield self.closing
+
+    def close(self):
+        self.file.close()
+
+def _serve_file(path, representation, headers):
+    # headers are those of the whole file, as _get_headers returns them,
+    # returns None when the file no longer matches its manifest entry
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return HTTPError(404, 'File does not exist.')
+    stat = os.fstat(f.fileno())
+    if not _is_current(representation, stat):
+        f.close()
+        return None
+    size = stat.st_size
+    ranges = _get_ranges(representation, size)
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return HTTPResponse(f, **headers)
+    if not ranges:
+        f.close()
+        headers.pop('Content-Length')
+        return HTTPResponse(status=416, **dict(headers,
+                            **{ 'Content-Range': 'bytes */{}'.format(size) }))
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, size)
+        headers['Content-Length'] = str(end - start)
+        return HTTPResponse(FileRange(f, start, end - start), status=206, **headers)
+    body = MultipartRanges(f, ranges, size, headers['Content-Type'])
+    headers['Content-Type'] = 'multipart/byteranges; boundary=' + body.boundary
+    headers['Content-Length'] = str(body.length)
+    return HTTPResponse(body, status=206, **headers)
+
+### Static Cache ###############################################################
+
+class StaticCache:
+
+    def __init__(self):
+        self.entries = OrderedDict() # path: (etag, body, headers)
+        self.size = 0 # bytes of the cached bodies
+        self.lock = threading.Lock() # NOTE: requests are served from threads
+
+    def get(self, path, etag):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != etag:
+                return None
+            self.entries.move_to_end(path)
+            return entry
+
+    def put(self, path, etag, body, headers):
+        with self.lock:
+            replaced = self.entries.pop(path, None)
+            if replaced is not None:
+                self.size -= len(replaced[1])
+            self.entries[path] = entry = (etag, body, headers)
+            self.size += len(body)
+            while self.size > STATIC_CACHE_SIZE:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+            return entry
+
+STATIC_CACHE = StaticCache()
+
+def _serve_cached(variant, root, asset, representation, coding, headers):
+    # returns None when the file can't be served from memory
+    path = join(root, variant)
+    entry = STATIC_CACHE.get(path, representation['etag'])
+    if entry is None:
+        try:
+            with open(path, 'rb') as f:
+                if not _is_current(representation, os.fstat(f.fileno())):
+                    return None # changed since the manifest was written
+                body = f.read()
+        except OSError:
+            return None
+        entry = STATIC_CACHE.put(path, representation['etag'], body,
+                                 _get_headers(asset, representation, coding))
+    _, body, cached_headers = entry
+    return HTTPResponse(body, **dict(cached_headers, **headers))
+
+### Static Files ###############################################################
+
+def _serve_asset(filename, root, asset):
+    # the variants come from the manifest, rather than checking for each file,
+    # returns None when the file no longer matches its manifest entry
+    accepted = set()
+    if asset['encodings']:
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    coding, variant, representation = None, filename, asset
+    for c, ext in ENCODINGS:
+        if c in asset['encodings'] and c in accepted:
+            coding, variant, representation = c, filename + ext, asset['encodings'][c]
+            break
+    headers = { 'ETag': representation['etag'] }
+    if asset['encodings']:
+        headers['Vary'] = 'Accept-Encoding'
+    if _not_modified(representation):
+        return HTTPResponse(status=304, **headers)
+    if representation['size'] <= min(STATIC_CACHE_FILE_SIZE, STATIC_CACHE_SIZE) \
+       and 'HTTP_RANGE' not in request.environ:
+        response = _serve_cached(variant, root, asset, representation, coding,
+                                 headers)
+        if response is not None:
+            return response
+    headers.update(_get_headers(asset, representation, coding))
+    return _serve_file(join(root, variant), representation, headers)
+
+def _serve_stat(filename, root):
+    # for resources without a (current) manifest entry
+    variants = _get_variants(filename, root)
+    if not variants:
+        return static_file(filename, root=root)
+    # NOTE: the type of the original, not of the compressed sibling
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    for coding, variant in variants:
+        if coding in accepted:
+            response = static_file(variant, root=root, mimetype=mimetype)
+            if response.status_code in (200, 206):
+                response.set_header('Content-Encoding', coding)
+            break
+    else:
+        response = static_file(filename, root=root, mimetype=mimetype)
+    response.set_header('Vary', 'Accept-Encoding')
+    return response
+
+def _serve_variant(filename, root):
+    assets = _get_assets()
+    path = posixpath.normpath(posixpath.join(root, filename))
+    asset = assets.get(path)
+    if asset is not None:
+        response = _serve_asset(filename, root, asset)
+        if response is not None:
+            return response
+        # NOTE: changed since loaded, later requests (conditional ones too)
+        # are answered with a stat
+        assets.pop(path, None)
+    return _serve_stat(filename, root)
+
+def serve_static(filename, root, immutable=False):
+    response = _serve_variant(filename, root)
+    if immutable and response.status_code in (200, 206, 304):
+        response.set_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+    return response
@@ -0,0 +1,214 @@
+"""
+Template warming for the generated app.
+
+Every view is loaded and compiled once at startup and stored in bottle's
+template cache, so no request pays for parsing or compiling a template.  The
+python code the builder translated each view to (views.json) is used when the
+view is unchanged since the build.  Included partials (~head.tpl, ...) are
+compiled once and shared by every view, rather than once per including view.
+
+A view can opt in to having its rendered pages cached, with a directive:
+
+    %# cache ttl=300 key=host,query,header:Accept-Language max=64
+
+Pages are then rendered once per key (the request's host by default, and
+any of its query string and headers) and served from memory, with the status
+and headers the view set, for ttl seconds (60 by default), keeping at most
+max of them (128 by default) for the view.
+Only the view routes the builder generates are cached, never the API routes
+of dev/py/routes.py, and only successful responses that set no cookie.
+"""
+from bottle import SimpleTemplate, TEMPLATE_PATH, TEMPLATES, request, response
+from os.path import join, dirname, abspath, relpath, splitext
+from collections import OrderedDict
+from functools import wraps
+import threading
+import hashlib
+import os
+import re
+import json
+import time
+
+__all__ = [ 'warm_templates', 'cached_view' ]
+
+### Constants ##################################################################
+
+APP_DIR = dirname(abspath(__file__))
+
+COMPILED_VIEWS_FILE = join(APP_DIR, 'views.json')
+
+VIEWS_DIR = join(APP_DIR, 'views')
+
+# e.g. "%# cache ttl=300 key=host,query"
+CACHE_DIRECTIVE_PATTERN = re.compile(r'^[ \t]*%[ \t]*#[ \t]*cache\b(.*)$', re.M)
+
+DEFAULT_CACHE_TTL = 60
+
+DEFAULT_CACHE_KEY = ( 'host', )
+
+DEFAULT_CACHE_ENTRIES = 128
+
+### Helpers ####################################################################
+
+def _load_compiled():
+    try:
+        with open(COMPILED_VIEWS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# view path: { size, hash, code }
+COMPILED = {}
+
+# include name: template, shared by every view
+INCLUDES = {}
+
+# view: PageCache, for views with a cache directive
+PAGE_CACHES = {}
+
+# NOTE: set by the app, pages are only cached when deployed
+PAGE_CACHE = False
+
+def _get_views():
+    for root, dirs, files in os.walk(VIEWS_DIR):
+        for filename in files:
+            name, ext = splitext(filename)
+            if ext[1:] in SimpleTemplate.extensions:
+                yield join(root, filename)
+
+def _parse_cache_directive(view, source): # returns a PageCache, or None
+    match = CACHE_DIRECTIVE_PATTERN.search(source)
+    if match is None:
+        return None
+    ttl, key, size = DEFAULT_CACHE_TTL, DEFAULT_CACHE_KEY, DEFAULT_CACHE_ENTRIES
+    try:
+        for option in match.group(1).split():
+            name, _, value = option.partition('=')
+            if name == 'ttl':
+                ttl = float(value)
+            elif name == 'key':
+                key = tuple(k.lower() for k in value.split(',') if k)
+            elif name == 'max':
+                size = int(value)
+            else:
+                raise ValueError(option)
+        for k in key:
+            if k not in ('host', 'query') and not k.startswith('header:'):
+                raise ValueError(k)
+    except ValueError as e:
+        raise ValueError('invalid cache directive in view {}: {}'.format(view, e))
+    return PageCache(ttl, key, size)
+
+def _is_unchanged(fp, compiled): # whether the view is the one compiled
+    if os.path.getsize(fp) != compiled['size']:
+        return False
+    with open(fp, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest() == compiled.get('hash')
+
+### Page Cache #################################################################
+
+class PageCache:
+
+    def __init__(self, ttl, key, size):
+        self.ttl = ttl
+        self.key = key # request attributes pages differ by
+        self.size = size
+        self.entries = OrderedDict() # key: (expires, body, status, headers)
+        self.lock = threading.Lock()
+
+    def get_key(self):
+        parts = []
+        for k in self.key:
+            if k == 'host':
+                parts.append(request.environ.get('HTTP_HOST'))
+            elif k == 'query':
+                parts.append(request.query_string)
+            else:
+                parts.append(request.get_header(k[len('header:'):]))
+        return tuple(parts)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, status, headers):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, body, status, headers)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+def _sets_cookie():
+    # NOTE: bottle keeps cookies apart from the other headers until it sends them
+    return bool(response._cookies) or 'Set-Cookie' in response.headers
+
+def cached_view(view):
+    # decorates the route of a view, caching its pages if the view asks for it
+    def decorator(callback):
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            cache = PAGE_CACHES.get(view) if PAGE_CACHE else None
+            if cache is None or request.method not in ('GET', 'HEAD'):
+                return callback(*args, **kwargs)
+            key = cache.get_key()
+            entry = cache.get(key)
+            if entry is not None:
+                _, body, response.status, headers = entry
+                for name, value in headers:
+                    response.add_header(name, value)
+                return body
+            body = callback(*args, **kwargs)
+            if response.status_code == 200 and isinstance(body, str) and \
+               not _sets_cookie():
+                cache.put(key, body, response.status_line,
+                          list(response.headers.allitems()))
+            return body
+        return wrapper
+    return decorator
+
+### Templates ##################################################################
+
+class WarmTemplate(SimpleTemplate):
+
+    def prepare(self, **options):
+        super().prepare(**options)
+        self.cache = INCLUDES
+
+    @property
+    def code(self): # the precompiled code, if the view hasn't changed since
+        if '_code' not in self.__dict__:
+            compiled = COMPILED.get(relpath(self.filename, APP_DIR).replace('\\', '/'))
+            if compiled and _is_unchanged(self.filename, compiled):
+                self.__dict__['_code'] = compiled['code']
+            else:
+                # NOTE: the function of bottle's cached_property, which would
+                #       otherwise store its result over this property
+                self.__dict__['_code'] = SimpleTemplate.code.func(self)
+        return self.__dict__['_code']
+
+def warm_templates(): # returns [ (view, seconds) ]
+    COMPILED.update(_load_compiled())
+    timings = []
+    for fp in sorted(_get_views()):
+        start = time.perf_counter()
+        view = splitext(relpath(fp, VIEWS_DIR).replace('\\', '/'))[0]
+        tpl = WarmTemplate(name=view, lookup=TEMPLATE_PATH)
+        tpl.co # compile now, rather than on the first request
+        if view.split('/')[-1].startswith('~'):
+            # NOTE: partials are included by name, with or without extension
+            INCLUDES[view] = INCLUDES[relpath(fp, VIEWS_DIR).replace('\\', '/')] = tpl
+        else:
+            TEMPLATES[(id(TEMPLATE_PATH), view)] = tpl
+            with open(fp, encoding='utf-8') as f:
+                cache = _parse_cache_directive(view, f.read())
+            if cache is not None:
+                PAGE_CACHES[view] = cache
+        timings.append((view, time.perf_counter() - start))
+    return timings
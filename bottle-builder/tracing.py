@@ -0,0 +1,184 @@
+"""
+    bottle-builder.tracing
+    ----------------------
+
+    The tracing module records where a build spends its time.  Each stage of a
+    build and each unit of work within it (a copied file, a compiled
+    stylesheet, an `inkscape` launch, ...) is recorded as a span, including the
+    work done on worker threads and processes.  The spans are written as a
+    Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev), and
+    summarized in a table of the slowest stages and items.
+
+    Tracing is off unless `enable` is called, and spans then cost nothing
+    beyond a check of whether it is.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'enable', 'span', 'submit', 'write_trace', 'print_summary' ]
+
+import os
+import sys
+import json
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from time import perf_counter
+
+try: # peak memory isn't reported on windows
+    import resource
+except ImportError:
+    resource = None
+
+
+##### Constants ################################################################
+
+STAGE = 'stage'
+
+# rows in each table of the summary
+SUMMARY_ROWS = 10
+
+
+##### Helpers ##################################################################
+
+def _peak_memory(): # (this process, its largest child) in bytes, or None
+    if resource is None:
+        return None
+    # NOTE: ru_maxrss is in kilobytes, except on macos where it's in bytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def _run_traced(fn, *args):
+    # NOTE: module level so that it can be sent to worker processes, whose
+    #       perf_counter shares the parent's clock
+    start = perf_counter()
+    result = fn(*args)
+    return result, (start, perf_counter(), os.getpid(), threading.get_ident())
+
+
+##### Tracer Class #############################################################
+
+class Tracer:
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.spans = [] # (name, category, start, end, pid, tid, args)
+        self.memory = [] # (time, self, children)
+        self.lock = threading.Lock()
+
+    def add(self, name, category, start, end, pid=None, tid=None, args=None):
+        with self.lock:
+            self.spans.append((name, category, start, end,
+                pid or os.getpid(), tid or threading.get_ident(), args or {}))
+            if category == STAGE:
+                self.memory.append((end,) + (_peak_memory() or (0, 0)))
+
+    def _timestamp(self, t): # microseconds since the tracer was enabled
+        return round((t - self.start) * 1e6, 3)
+
+    def get_events(self):
+        builder_pid = os.getpid()
+        events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': p, 'tid': 0,
+            'args': { 'name': 'bottle-builder' if p == builder_pid else 'worker' }
+        } for p in sorted(set(s[4] for s in self.spans) | { builder_pid })]
+        for name, category, start, end, pid, tid, args in self.spans:
+            events.append({
+                'name': name, 'cat': category, 'ph': 'X',
+                'ts': self._timestamp(start),
+                'dur': round((end - start) * 1e6, 3),
+                'pid': pid, 'tid': tid, 'args': args,
+            })
+        if resource is not None:
+            events += [{
+                'name': 'peak memory (MB)', 'ph': 'C', 'pid': builder_pid, 'tid': 0,
+                'ts': self._timestamp(t),
+                'args': { 'builder': own / (1 << 20), 'children': children / (1 << 20) },
+            } for t, own, children in self.memory]
+        return events
+
+
+_tracer = None
+
+
+##### Tracing ##################################################################
+
+def enable():
+    global _tracer
+    _tracer = Tracer()
+
+@contextmanager
+def span(name, category=STAGE, **args):
+    if _tracer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        _tracer.add(name, category, start, perf_counter(), args=args)
+
+def submit(executor, name, category, fn, *args):
+    # executor.submit(fn, *args), with a span for the call on its worker
+    if _tracer is None:
+        return executor.submit(fn, *args)
+    traced, future = executor.submit(_run_traced, fn, *args), Future()
+    def done(traced):
+        try:
+            result, (start, end, pid, tid) = traced.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        _tracer.add(name, category, start, end, pid, tid)
+        future.set_result(result)
+    traced.add_done_callback(done)
+    return future
+
+def write_trace(fp):
+    if _tracer is None:
+        return
+    memory = _peak_memory()
+    with open(fp, 'w') as f:
+        json.dump({
+            'traceEvents': _tracer.get_events(),
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'command': ' '.join(sys.argv),
+                'peak_memory': memory and { 'builder': memory[0], 'children': memory[1] },
+            },
+        }, f)
+    print('Trace written to', fp)
+
+def _print_table(title, rows): # rows are (seconds, label)
+    if not rows:
+        return
+    print('\n{:>10}  {}'.format('ms', title))
+    for seconds, label in rows[:SUMMARY_ROWS]:
+        print('{:>10.1f}  {}'.format(seconds * 1000, label))
+
+def print_summary():
+    if _tracer is None:
+        return
+    stages, items = [], []
+    for name, category, start, end, *_ in _tracer.spans:
+        if category == STAGE:
+            stages.append((end - start, name))
+        else:
+            items.append((end - start, '{} [{}]'.format(name, category)))
+    # NOTE: items run concurrently overlap, so totals can exceed their stage
+    totals = {}
+    for name, category, start, end, *_ in _tracer.spans:
+        if category != STAGE:
+            count, seconds = totals.get(category, (0, 0))
+            totals[category] = (count + 1, seconds + end - start)
+    _print_table('slowest stages', sorted(stages, reverse=True))
+    _print_table('slowest items', sorted(items, reverse=True))
+    _print_table('total per kind of item', sorted(
+        [ (seconds, '{} x{}'.format(category, count))
+          for category, (count, seconds) in totals.items() ], reverse=True))
+    memory = _peak_memory()
+    if memory:
+        print('\nPeak memory: {:.1f}MB (largest child process {:.1f}MB)'.format(
+            memory[0] / (1 << 20), memory[1] / (1 << 20)))
@@ -0,0 +1,124 @@
+"""
+    bottle-builder.views
+    --------------------
+
+    The views module validates and precompiles the generated site's views.
+    Once the views have been copied and had their stylesheets and <head>
+    elements inserted, each of them (including the ~ prefixed partials they
+    include) is translated to python by bottle's template parser and compiled,
+    so that syntax errors are reported by the build rather than by the first
+    request to the page.
+
+    The translated code is written to views.json, which the generated app
+    loads at startup to compile every view eagerly, instead of parsing each of
+    them on its first request.
+
+    Deploy builds minify the views' html first (see markup.minify_view), so
+    every rendered page is sent without the indentation and comments of its
+    source.
+
+    Optional Requirements:
+    * bottle (views are neither validated nor precompiled without it)
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'ViewGenerator', 'ViewCompileError', 'COMPILED_VIEWS_FILE' ]
+
+import os
+import os.path
+from os.path import abspath, normpath, join, relpath, splitext
+import json
+
+from manifest import hash_file
+from markup import minify_view
+from tracing import span
+
+try:
+    from bottle import StplParser, StplSyntaxError
+except ImportError:
+    StplParser = None
+
+
+##### Constants ################################################################
+
+COMPILED_VIEWS_FILE = 'views.json'
+
+VIEW_EXTENSIONS = [ '.tpl', '.html', '.thtml', '.stpl' ]
+
+
+##### Helpers ##################################################################
+
+def _translate(fp):
+    with open(fp, 'rb') as f:
+        source = f.read().decode('utf8')
+    code = StplParser(source, encoding='utf8').translate()
+    compile(code, fp, 'exec') # raises a SyntaxError for invalid inline python
+    return code
+
+
+##### View Compile Error Class #################################################
+
+class ViewCompileError(Exception):
+
+    def __init__(self, errors): # [ (view filepath, exception) ]
+        self.errors = errors
+        super().__init__('\n'.join(
+            [ '{} view(s) failed to compile'.format(len(errors)) ] +
+            [ '{}:\n{}'.format(fp, e) for fp, e in errors ]
+        ))
+
+
+##### View Generator Class #####################################################
+
+class ViewGenerator:
+
+    def __init__(self, dest_dir):
+        self.dest_path = lambda *p: normpath(abspath(join(dest_dir, *p))) # www
+
+    def _get_views(self):
+        for root, dirs, files in os.walk(self.dest_path('views')):
+            dirs.sort()
+            for filename in sorted(files):
+                if splitext(filename)[-1].lower() in VIEW_EXTENSIONS:
+                    yield join(root, filename)
+
+    def minify_views(self):
+        before, after = 0, 0
+        for fp in self._get_views():
+            with open(fp, 'rb') as f:
+                source = f.read().decode('utf8')
+            with span(relpath(fp, self.dest_path()), 'minify html'):
+                minified = minify_view(source).encode('utf8')
+            if minified != source.encode('utf8'): # views already minified are kept
+                with open(fp, 'wb') as f:
+                    f.write(minified)
+            before, after = before + len(source.encode('utf8')), after + len(minified)
+        print('Minified views: {} -> {} bytes ({} saved)'.format(
+            before, after, before - after))
+
+    def compile_views(self):
+        if StplParser is None:
+            print('bottle not installed, views are not precompiled')
+            return
+        views, errors = {}, []
+        for fp in self._get_views():
+            try:
+                with span(relpath(fp, self.dest_path()), 'view'):
+                    code = _translate(fp)
+            except (StplSyntaxError, SyntaxError, UnicodeError) as e:
+                errors.append((relpath(fp), e))
+                continue
+            # NOTE: the app ignores entries whose view has since been modified,
+            #       by content rather than mtime, which packaging and copying
+            #       the site to the server don't preserve exactly
+            views[relpath(fp, self.dest_path()).replace('\\', '/')] = {
+                'size': os.path.getsize(fp),
+                'hash': hash_file(fp),
+                'code': code,
+            }
+        with open(self.dest_path(COMPILED_VIEWS_FILE), 'w') as f:
+            json.dump(views, f, indent=1, sort_keys=True)
+        if errors:
+            raise ViewCompileError(errors)
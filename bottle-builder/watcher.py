@@ -0,0 +1,173 @@
+"""
+    bottle-builder.watcher
+    ----------------------
+
+    The watcher module watches a set of directories for changes and reports
+    them in batches.  Bursts of events (an editor saving a file several times,
+    a checkout touching hundreds of files) are coalesced, and the callback is
+    only run once the directories have been quiet for the debounce period.
+
+    Native notifications (inotify, FSEvents, ReadDirectoryChangesW) are used
+    when watchdog is installed, otherwise the directories are polled.
+
+    Optional Requirements:
+    * watchdog
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+__all__ = [ 'Watcher' ]
+
+import os
+import os.path
+from os.path import abspath, isdir, join
+from threading import Thread, Condition, Event
+from fnmatch import fnmatch
+import time
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+##### Constants ################################################################
+
+# editor swap files and artifacts the build writes into the watched folders
+IGNORED_PATTERNS = [ '.DS_Store', '*.swp', '*.swx', '*~', '.#*', '4913',
+                     '_all.scss', '.sass-cache' ]
+
+# NOTE: newer watchdog versions also report files being opened and read
+WATCHED_EVENTS = [ 'created', 'deleted', 'modified', 'moved' ]
+
+
+##### Helpers ##################################################################
+
+def _is_ignored(path):
+    return any(fnmatch(part, ptn) for part in path.replace('\\', '/').split('/')
+                                  for ptn in IGNORED_PATTERNS)
+
+def _snapshot(paths):
+    files = {}
+    for path in paths:
+        for root, dirs, filenames in os.walk(path):
+            for filename in filenames:
+                fp = join(root, filename)
+                try:
+                    stat = os.stat(fp)
+                except FileNotFoundError: # removed mid-walk
+                    continue
+                files[fp] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+##### Backends #################################################################
+
+class _EventHandler(FileSystemEventHandler):
+
+    def __init__(self, add):
+        self.add = add
+
+    def on_any_event(self, event):
+        if event.event_type not in WATCHED_EVENTS:
+            return
+        if event.is_directory and event.event_type == 'modified':
+            return # a file in the directory changed, reported on its own
+        self.add(event.src_path)
+        if getattr(event, 'dest_path', None):
+            self.add(event.dest_path)
+
+class _NativeBackend:
+
+    def __init__(self, paths, add):
+        self.observer = Observer()
+        for path in paths:
+            self.observer.schedule(_EventHandler(add), path, recursive=True)
+
+    def start(self):
+        self.observer.start()
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+class _PollingBackend:
+
+    def __init__(self, paths, add, interval=0.25):
+        self.paths = paths
+        self.add = add
+        self.interval = interval
+        self.stopped = Event()
+        self.thread = Thread(target=self._poll, daemon=True)
+
+    def _poll(self):
+        previous = _snapshot(self.paths)
+        while not self.stopped.wait(self.interval):
+            current = _snapshot(self.paths)
+            for fp in set(previous) | set(current):
+                if previous.get(fp) != current.get(fp):
+                    self.add(fp)
+            previous = current
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+##### Watcher Class ############################################################
+
+class Watcher:
+
+    def __init__(self, paths, callback, debounce=0.1):
+        self.paths = [ abspath(p) for p in paths if isdir(p) ]
+        self.callback = callback # called with a set of absolute filepaths
+        self.debounce = debounce # seconds without events before a callback
+        self.pending = set()
+        self.last_event = 0
+        self.condition = Condition()
+
+    def _add(self, path):
+        if _is_ignored(path):
+            return
+        with self.condition:
+            self.pending.add(abspath(path))
+            self.last_event = time.monotonic()
+            self.condition.notify()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            # wait for the burst to settle before handing it over
+            while True:
+                remaining = self.last_event + self.debounce - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.pending = self.pending, set()
+            return batch
+
+    def run(self): # blocks until interrupted
+        if Observer is not None:
+            backend = _NativeBackend(self.paths, self._add)
+        else:
+            print('watchdog not installed, polling for changes')
+            backend = _PollingBackend(self.paths, self._add)
+        backend.start()
+        try:
+            while True:
+                batch = self._next_batch()
+                try:
+                    self.callback(batch)
+                except Exception as e: # keep watching through build errors
+                    print('Error rebuilding', e)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            backend.stop()
@@ -0,0 +1,19 @@
+"""
+    tests.conftest
+    --------------
+
+    Makes the builder's modules, and the runtime modules it copies next to
+    the generated app.py, importable by the tests.
+
+    :copyright: (c) 2017 by Nick Balboni.
+    :license: MIT.
+"""
+
+from os.path import abspath, dirname, join
+from sys import path as sys_path
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+BUILDER_DIR = join(ROOT_DIR, 'bottle-builder')
+
+sys_path.insert(0, join(BUILDER_DIR, 'templates'))
+sys_path.insert(0, BUILDER_DIR)
@@ -0,0 +1,29 @@
+import os
+
+from cache import ContentCache, get_cache_dir, hash_key
+
+
+def test_hash_key():
+    assert hash_key('a', 1, True) == hash_key('a', '1', 'True')
+    assert hash_key('a', 'b') != hash_key('ab') != hash_key('b', 'a')
+    assert len(hash_key()) == 40
+
+
+def test_get_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('BOTTLE_BUILDER_CACHE', str(tmp_path))
+    assert get_cache_dir() == str(tmp_path)
+
+
+def test_store_and_fetch(tmp_path):
+    cache = ContentCache('favicons', cache_dir=str(tmp_path / 'cache'))
+    key = hash_key('favicon', 16)
+    src, dest = tmp_path / 'src.png', tmp_path / 'dest.png'
+    src.write_bytes(b'png')
+    assert not cache.has(key)
+    assert not cache.fetch(key, str(dest)) and not dest.exists()
+    cache.store(key, str(src))
+    src.write_bytes(b'changed') # NOTE: the cache keeps its own copy
+    assert cache.has(key)
+    assert cache.fetch(key, str(dest)) and dest.read_bytes() == b'png'
+    # and nothing but the entry, no temporary files
+    assert os.listdir(str(tmp_path / 'cache' / 'favicons' / key[:2])) == [ key ]
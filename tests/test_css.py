@@ -0,0 +1,115 @@
+import pytest
+
+from css import parse_stylesheet, minify, serialize, split_selectors, \
+                selector_matches, prune_rules, merge_rules, count_selectors
+from markup import Markup
+
+
+def _minify(css):
+    return minify(parse_stylesheet(css))
+
+def _merge(css):
+    return minify(merge_rules(parse_stylesheet(css)))
+
+
+##### Parsing and Serializing ##################################################
+
+def test_split_selectors():
+    assert split_selectors('.a,  .b:not(.c, .d) ,\n a[title="x,y"]') == \
+           [ '.a', '.b:not(.c, .d)', 'a[title="x,y"]' ]
+
+
+def test_parse_nested_at_rules():
+    nodes = parse_stylesheet('@charset "utf-8"; /* a } comment */ '
+                             '@media screen { .a { color: red } } .b { top: 0 }')
+    assert [ getattr(n, 'name', None) for n in nodes ] == [ 'charset', 'media', None ]
+    assert nodes[1].rules[0].selectors == [ '.a' ]
+    assert count_selectors(nodes) == 2
+
+
+def test_serialize_round_trips():
+    css = '@media print {\n  .a,\n  .b {\n    color: red;\n  }\n}\n'
+    assert serialize(parse_stylesheet(css)) == css
+
+
+##### Minifying ################################################################
+
+def test_minify():
+    assert _minify('.nav > li ,  a:hover {\n  color : red ;\n  margin: 0 auto;\n}\n'
+                   '@media (min-width: 40em) { .a { top : 0 } }') == \
+           '.nav>li,a:hover{color:red;margin:0 auto}@media (min-width: 40em){.a{top:0}}'
+
+
+def test_minify_keeps_strings():
+    assert _minify('a::before { content: "  a ;}  b " ; }') == \
+           'a::before{content:"  a ;}  b "}'
+
+
+def test_minify_keeps_semicolons_in_urls():
+    assert _minify('.a { background: url(data:image/svg+xml;utf8,x;}y) ; }') == \
+           '.a{background:url(data:image/svg+xml;utf8,x;}y)}'
+
+
+def test_minify_drops_semicolons_before_nested_blocks_end():
+    assert _minify('@page { margin: 0; @top-left { content: "x"; } }') == \
+           '@page{margin:0;@top-left{content:"x"}}'
+
+
+def test_minify_keeps_descendant_combinators_in_brackets():
+    assert _minify('a:not(.b  .c) { top: 0 }') == 'a:not(.b .c){top:0}'
+
+
+##### Matching and Pruning #####################################################
+
+@pytest.mark.parametrize('selector, matches', [
+    ('p', True), ('.nav > li.item', True), ('#top:hover', True),
+    ('a[href^="x"]::after', True), ('*', True), ('.missing', False),
+    ('p #other', False), ('table', False), ('.a\\:b', True),
+])
+def test_selector_matches(selector, matches):
+    markup = Markup(elements=[ 'p', 'li', 'a' ], classes=[ 'nav', 'item', 'a:b' ],
+                    ids=[ 'top' ])
+    assert selector_matches(selector, markup) == matches
+
+
+def test_prune_rules():
+    markup = Markup(elements=[ 'p' ], classes=[ 'used' ])
+    nodes = parse_stylesheet(
+        '@font-face { font-family: Used; } @font-face { font-family: Unused; }'
+        '.used, .unused { font-family: Used; } .unused { color: red; }'
+        '@media print { .unused { top: 0 } } @page { margin: 0 }')
+    assert minify(prune_rules(nodes, lambda s: selector_matches(s, markup))) == \
+           '@font-face{font-family:Used}.used{font-family:Used}@page{margin:0}'
+
+
+##### Merging ##################################################################
+
+def test_merge_rules_drops_earlier_duplicates():
+    assert _merge('.a { top: 0 } .b { left: 0 } .a { top: 0 }') == \
+           '.b{left:0}.a{top:0}'
+
+
+def test_merge_rules_combines_neighbours():
+    assert _merge('.a { top: 0 } .a { left: 0 } .b { color: red } .c { color: red }') == \
+           '.a{top:0;left:0}.b,.c{color:red}'
+
+
+def test_merge_rules_keeps_order_of_distant_rules():
+    assert _merge('.a { color: red } .b { color: blue } .c { color: red }') == \
+           '.a{color:red}.b{color:blue}.c{color:red}'
+
+
+@pytest.mark.parametrize('first, second', [
+    ('input::-webkit-input-placeholder', 'input::-moz-placeholder'),
+    ('input::placeholder', 'input:-ms-input-placeholder'),
+    ('.a:focus-visible', '.b'),
+    ('.a', '.b:has(.c)'),
+])
+def test_merge_rules_keeps_unsupported_pseudos_apart(first, second):
+    css = '{} {{ color: grey }} {} {{ color: grey }}'.format(first, second)
+    assert _merge(css) == '{}{{color:grey}}{}{{color:grey}}'.format(first, second)
+
+
+def test_merge_rules_combines_known_pseudos():
+    assert _merge('a:hover { color: red } .b::before { color: red }') == \
+           'a:hover,.b::before{color:red}'
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from javascript import minify_js, SourceMap, _vlq
+
+
+def _minify(src):
+    return ''.join(minify_js(src))
+
+
+##### Minifying ################################################################
+
+@pytest.mark.parametrize('src, minified', [
+    ('var a = 1 ;\n\n  var b = a + 2;', 'var a=1;var b=a+2;'),
+    ('// a comment\nf( a,  b ); /* another */ g()', 'f(a,b);g()'),
+    ('/*! license */\nf()', '/*! license */\nf()'),
+    ('return\nx', 'return\nx'), # NOTE: returns undefined
+    ('a\n++b', 'a\n++b'),
+    ('a = b\n(c)', 'a=b\n(c)'),
+    ('a + +b; a - -b; a + ++b', 'a+ +b;a- -b;a+ ++b'),
+    ('1 .toString()', '1 .toString()'),
+    ('if (a < !--b) {}', 'if(a< !--b){}'),
+])
+def test_minify(src, minified):
+    assert _minify(src) == minified
+
+
+@pytest.mark.parametrize('src, minified', [
+    ('s = "a  // b" + \'c /* d */\'', 's="a  // b"+\'c /* d */\''),
+    ('s = "a \\"  b"', 's="a \\"  b"'),
+    ('s = `a  ${ b + `c  ${ "}" }` }  d`', 's=`a  ${ b + `c  ${ "}" }` }  d`'),
+])
+def test_minify_keeps_strings(src, minified):
+    assert _minify(src) == minified
+
+
+@pytest.mark.parametrize('src, minified', [
+    ('x = a / b / c', 'x=a/b/c'),
+    ('x = (a) / 2 / (b)', 'x=(a)/2/(b)'),
+    ('x = a[0] / 2; y = f(a) / 2', 'x=a[0]/2;y=f(a)/2'),
+    ('x = / a  b /g.test(s)', 'x=/ a  b /g.test(s)'),
+    ('return / a  b /.test(s)', 'return/ a  b /.test(s)'),
+    ('x = [ / a  b / ]', 'x=[/ a  b /]'),
+    ('x = /[/  ]/', 'x=/[/  ]/'),
+    # NOTE: after the head of a control statement, a `/` starts a statement
+    ('if (a) / b  c /.test(s) && f()', 'if(a)/ b  c /.test(s)&&f()'),
+    ('while (f(a)) / b  c /g.exec(s)', 'while(f(a))/ b  c /g.exec(s)'),
+    ('for (;;) / a  b /.test(s)', 'for(;;)/ a  b /.test(s)'),
+    ('if (f(a) / 2) x = 1', 'if(f(a)/2)x=1'),
+])
+def test_minify_regular_expressions(src, minified):
+    assert _minify(src) == minified
+
+
+##### Source Maps ##############################################################
+
+def test_vlq():
+    assert [ _vlq(v) for v in (0, 1, -1, 15, 16, -16, 1000) ] == \
+           [ 'A', 'C', 'D', 'e', 'gB', 'hB', 'w+B' ]
+
+
+def test_source_map():
+    source_map = SourceMap()
+    source = source_map.add_source('a.js', 'f( a );\nreturn\n  b')
+    out = minify_js('f( a );\nreturn\n  b', source_map, source)
+    assert ''.join(out) == 'f(a);return\nb'
+    mapping = json.loads(source_map.to_json('bundle.js'))
+    assert mapping['sources'] == [ 'a.js' ]
+    # NOTE: a segment for each token, on the line it was written to
+    lines = mapping['mappings'].split(';')
+    assert [ len(line.split(',')) for line in lines ] == [ 6, 1 ]
+    assert lines[0].startswith('AAAA,CAAC,') and lines[1] == 'AACE'
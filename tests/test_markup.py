@@ -0,0 +1,91 @@
+import pytest
+from bottle import SimpleTemplate
+
+from markup import minify_view, scan_markup
+
+
+def _render(source, **kwargs):
+    return SimpleTemplate(source).render(**kwargs)
+
+
+def _visible(html):
+    return ''.join(html.split())
+
+
+##### Minifying ################################################################
+
+def test_minify_view():
+    assert minify_view(
+        '<div class="a" >\n  <!-- a comment -->\n  <p>Some   <b>bold</b>\n'
+        '    text</p>\n  <!--[if IE]><p>old</p><![endif]-->\n</div>\n') == \
+        '<div class="a"><p>Some <b>bold</b> text</p><!--[if IE]><p>old</p><![endif]--></div>\n'
+
+
+def test_minify_view_keeps_raw_elements():
+    source = '<pre>\n  a   b\n</pre>\n<script>\n  if (a  <b) {}\n</script>\n'
+    assert minify_view(source) == \
+        '<pre>\n  a   b\n</pre><script>\n  if (a  <b) {}\n</script>\n'
+
+
+def test_minify_view_keeps_template_code():
+    source = ('<ul>\n  % for item in items:\n    <li class="{{ item }}" >\n'
+              '      {{ item }}\n    </li>\n  % end\n</ul>\n'
+              '<%\n  x = "  a  "\n%>\n<p>  {{ x }}  </p>\n')
+    minified = minify_view(source)
+    assert minified == ('<ul>\n% for item in items:\n<li class="{{ item }}">{{ item }}</li>\n'
+                        '% end\n</ul>\n<%\n  x = "  a  "\n%>\n<p>{{ x }}</p>\n')
+    assert _render(minified, items=[ 'a', 'b' ]) == \
+        '<ul>\n<li class="a">a</li>\n<li class="b">b</li>\n</ul>\n<p>  a  </p>\n'
+
+
+@pytest.mark.parametrize('source', [
+    '<p>\n  \\% not code\n</p>\n',
+    '<p>\n  a\n  \\<% not a block %>\n  b\n</p>\n',
+    # NOTE: bottle suppresses the line break after a trailing \\ before code
+    '<p>\n  a \\\\\n% if True:\n  b\n% end\n</p>\n',
+    '<p>\n  a \\\\\n  \n% if True:\n  b\n% end\n</p>\n',
+    '<p>\n  a \\\\\n  b \\\\\n  c\n</p>\n',
+])
+def test_minify_view_keeps_escaped_lines(source):
+    minified = minify_view(source)
+    assert _visible(_render(minified)) == _visible(_render(source))
+    for line in source.split('\n'):
+        if '\\' in line:
+            assert line in minified.split('\n')
+
+
+def test_minify_view_keeps_percent_lines():
+    source = '<p>\n  a\n  %% 100\n  b\n</p>\n'
+    assert minify_view(source) == '<p>a\n  %% 100\nb</p>\n'
+
+
+def test_minify_view_keeps_quoted_and_expression_brackets():
+    source = ('<a title="Home > About"  data-x="a />" >\n'
+              '  <span class="{{ v if v else \'a > b\' }}" >{{ \'c > d\' }}</span >\n'
+              '</a>\n<br />\n')
+    minified = minify_view(source)
+    assert minified == ('<a title="Home > About" data-x="a />"> <span class='
+                        '"{{ v if v else \'a > b\' }}">{{ \'c > d\' }}</span> </a><br/>\n')
+    assert _render(minified, v='') == ('<a title="Home > About" data-x="a />"> '
+        '<span class="a &gt; b">c &gt; d</span> </a><br/>\n')
+
+
+##### Scanning #################################################################
+
+def test_scan_markup():
+    found = scan_markup('<div id="top" class="nav  item"><!-- <p class="gone"> -->'
+                        '<a href="#" class=\'link\'>x</a></div>')
+    assert found.elements == { 'div', 'a' }
+    assert found.classes == { 'nav', 'item', 'link' }
+    assert found.ids == { 'top' }
+
+
+@pytest.mark.parametrize('markup, name', [
+    ('<li class="nav {{ \'active\' if cur else \'\' }}">', 'active'),
+    ('<p>{{ "hidden" if off else "" }}</p>', 'hidden'),
+    ('% cls = \'highlight\'\n<p class="{{ cls }}"></p>', 'highlight'),
+    ('<%\n  cls = "is-open"\n%>\n<p class="{{ cls }}"></p>', 'is-open'),
+    ('<script>el.classList.add(\'js-ready\')</script>', 'js-ready'),
+])
+def test_scan_markup_counts_code_strings(markup, name):
+    assert scan_markup(markup).has_class(name)
@@ -0,0 +1,95 @@
+import os
+import time
+import zipfile
+
+import pytest
+
+from package import DOS_EPOCH, PackageGenerator, source_date_epoch
+
+
+MTIME = 1500000001 # NOTE: odd, zip's own fields round it down to 2 seconds
+
+
+@pytest.fixture
+def www(tmp_path):
+    files = {
+        'app.py': b'print("app")\n' * 100,
+        'static/css/styles.css': b'body { margin: 0 }\n' * 100,
+        'static/img/logo.png': b'\x89PNG not really' * 10,
+        '.build/manifest.json': b'{}',
+    }
+    for name, data in files.items():
+        fp = tmp_path / 'www' / name
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_bytes(data)
+        os.utime(str(fp), (MTIME, MTIME))
+    return tmp_path / 'www'
+
+
+def _package(www, dest, jobs=2):
+    PackageGenerator(str(www), str(dest), jobs=jobs).package()
+    return dest.read_bytes()
+
+
+def test_package_contents(www, tmp_path):
+    dest = tmp_path / 'www.zip'
+    _package(www, dest)
+    with zipfile.ZipFile(str(dest)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [ 'www/app.py', 'www/static/css/styles.css',
+                                       'www/static/img/logo.png' ]
+        infos = { i.filename: i for i in archive.infolist() }
+        assert infos['www/app.py'].compress_type == zipfile.ZIP_DEFLATED
+        assert infos['www/static/img/logo.png'].compress_type == zipfile.ZIP_STORED
+        assert archive.read('www/static/css/styles.css') == \
+               (www / 'static/css/styles.css').read_bytes()
+
+
+def test_package_timestamp(www, tmp_path, monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', str(MTIME))
+    dest = tmp_path / 'www.zip'
+    _package(www, dest)
+    with zipfile.ZipFile(str(dest)) as archive:
+        info = archive.getinfo('www/static/css/styles.css')
+    # in UTC, zip's own fields to two seconds, the extended timestamp to one
+    assert info.date_time == time.gmtime(MTIME - 1)[:6]
+    assert info.extra == b'UT\x05\x00\x01' + MTIME.to_bytes(4, 'little')
+    # and the site on disk is dated as the extracted one will be
+    assert os.stat(str(www / 'app.py')).st_mtime == MTIME
+
+
+def test_package_timestamp_from_sources(tmp_path, monkeypatch):
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    sass = tmp_path / 'dev' / 'sass'
+    sass.mkdir(parents=True)
+    for name, mtime in [ ('styles.scss', MTIME), ('_all.scss', MTIME + 100),
+                         ('.styles.scss.swp', MTIME + 100) ]:
+        (sass / name).write_text('')
+        os.utime(str(sass / name), (mtime, mtime))
+    assert source_date_epoch([ str(tmp_path / 'dev') ]) == MTIME
+    assert source_date_epoch([]) == DOS_EPOCH
+
+
+def test_package_is_deterministic(www, tmp_path):
+    first = _package(www, tmp_path / 'first.zip', jobs=1)
+    second = _package(www, tmp_path / 'second.zip', jobs=4)
+    assert first == second
+
+
+def test_package_is_reproducible(www, tmp_path, monkeypatch):
+    # rebuilt, with the same content, later and in another time zone
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', str(MTIME))
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    first = _package(www, tmp_path / 'first.zip')
+    for fp in www.rglob('*'):
+        if fp.is_file():
+            fp.write_bytes(fp.read_bytes())
+    monkeypatch.setenv('TZ', 'Asia/Tokyo')
+    time.tzset()
+    try:
+        second = _package(www, tmp_path / 'second.zip')
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert first == second
@@ -0,0 +1,47 @@
+import io
+
+import bottle
+import pytest
+
+from routes import RouteGenerator
+
+
+@pytest.fixture
+def app(tmp_path):
+    # an app with the static table routes.py generates, next to api routes
+    www = tmp_path / 'www'
+    (www / 'static' / 'css').mkdir(parents=True)
+    (www / 'static' / 'robots.txt').write_text('')
+    (www / 'static' / 'css' / 'styles.css').write_text('')
+    generator = RouteGenerator(str(tmp_path), str(www), static_table=True)
+    template, values = generator._get_static_table()['static_routes'][0]
+    app = bottle.Bottle()
+    app.post('/form')(lambda: 'form')
+    app.route('/api/<name>', method='ANY')(lambda name: 'any ' + name)
+    serve_static = lambda filename, root, immutable: \
+        bottle.HTTPResponse('{}/{}'.format(root, filename))
+    exec(template.safe_substitute(**values), { 'hook': app.hook, 'get': app.get,
+        'request': bottle.request, 'HTTPError': bottle.HTTPError,
+        'serve_static': serve_static })
+    return app
+
+
+def _call(app, method, path):
+    statuses = []
+    body = app({ 'REQUEST_METHOD': method, 'PATH_INFO': path,
+                 'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO() },
+               lambda status, headers, exc_info=None: statuses.append(status))
+    return int(statuses[0].split()[0]), b''.join(body).decode()
+
+
+def test_static_table_serves_files(app):
+    assert _call(app, 'GET', '/robots.txt') == (200, 'static/robots.txt')
+    assert _call(app, 'GET', '/styles.css') == (200, 'static/css/styles.css')
+    assert _call(app, 'HEAD', '/styles.css')[0] == 200
+
+
+def test_static_table_routes_other_requests(app):
+    assert _call(app, 'GET', '/api/about') == (200, 'any about')
+    assert _call(app, 'POST', '/api/styles.css') == (200, 'any styles.css')
+    assert _call(app, 'GET', '/form')[0] == 405
+    assert _call(app, 'GET', '/no/such/file')[0] == 404
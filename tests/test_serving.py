@@ -0,0 +1,270 @@
+import json
+import os
+
+import pytest
+from bottle import request, HTTPResponse
+
+import serving
+
+
+MTIME = 1500000000.5
+
+
+@pytest.fixture
+def www(tmp_path, monkeypatch):
+    # an app dir with a manifest, as the builder writes it
+    monkeypatch.chdir(tmp_path)
+    static = tmp_path / 'static'
+    static.mkdir()
+    assets = {}
+    for name, data in [ ('a.css', b'a' * 100), ('b.js', b'b' * 100) ]:
+        fp = static / name
+        fp.write_bytes(data)
+        (static / (name + '.gz')).write_bytes(data[:10])
+        for path in (fp, static / (name + '.gz')):
+            os.utime(str(path), (MTIME, MTIME))
+        assets['static/' + name] = {
+            'size': 100, 'mtime': MTIME, 'etag': '"{}"'.format(name),
+            'type': 'text/css', 'encodings': { 'gzip': {
+                'size': 10, 'mtime': MTIME, 'etag': '"{}.gz"'.format(name) } } }
+    (tmp_path / 'assets.json').write_text(json.dumps(assets))
+    monkeypatch.setattr(serving, 'ASSETS_FILE', str(tmp_path / 'assets.json'))
+    monkeypatch.setattr(serving, 'STATIC_CACHE', serving.StaticCache())
+    return tmp_path
+
+
+def _request(**environ):
+    request.bind(dict(REQUEST_METHOD='GET', PATH_INFO='/', **environ))
+
+
+def _serve(filename, **environ):
+    _request(**environ)
+    response = serving.serve_static(filename, root='static/')
+    if hasattr(response.body, 'close'):
+        response.body.close()
+    return response
+
+
+##### Asset Manifest ###########################################################
+
+def test_load_assets_skips_changed_files(www, monkeypatch):
+    # same size, edited later
+    os.utime(str(www / 'static' / 'a.css'), (MTIME + 60, MTIME + 60))
+    (www / 'static' / 'b.js.gz').write_bytes(b'b' * 11)
+    os.utime(str(www / 'static' / 'b.js.gz'), (MTIME, MTIME))
+    _, assets = serving._load_assets()
+    assert list(assets) == [ 'static/b.js' ]
+    assert assets['static/b.js']['encodings'] == {}
+
+
+def test_load_assets_compares_whole_seconds(www):
+    # NOTE: as unzipped, from the 2 second dos time and the extended timestamp
+    for name in ('a.css', 'a.css.gz'):
+        os.utime(str(www / 'static' / name), (int(MTIME), int(MTIME)))
+    _, assets = serving._load_assets()
+    assert list(assets['static/a.css']['encodings']) == [ 'gzip' ]
+
+
+@pytest.mark.parametrize('environ, not_modified', [
+    ({}, False),
+    ({ 'HTTP_IF_NONE_MATCH': '"x", W/"a.css"' }, True),
+    ({ 'HTTP_IF_NONE_MATCH': '*' }, True),
+    ({ 'HTTP_IF_NONE_MATCH': '"x"',
+       'HTTP_IF_MODIFIED_SINCE': 'Fri, 14 Jul 2017 02:40:00 GMT' }, False),
+    ({ 'HTTP_IF_MODIFIED_SINCE': 'Fri, 14 Jul 2017 02:40:00 GMT' }, True),
+    ({ 'HTTP_IF_MODIFIED_SINCE': 'Fri, 14 Jul 2017 02:39:59 GMT' }, False),
+    ({ 'HTTP_IF_MODIFIED_SINCE': 'Fri, 14 Jul 2017 02:40:00 GMT; length=100' }, True),
+    ({ 'HTTP_IF_MODIFIED_SINCE': 'yesterday' }, False),
+])
+def test_not_modified(environ, not_modified):
+    _request(**environ)
+    assert serving._not_modified({ 'etag': '"a.css"', 'mtime': MTIME }) == not_modified
+
+
+def test_serve_asset_last_modified_matches_conditional(www, monkeypatch):
+    monkeypatch.setattr(serving, 'ASSETS_MTIME', None)
+    monkeypatch.setattr(serving, 'RELOAD_ASSETS', True)
+    response = _serve('a.css')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"a.css"'
+    last_modified = response.headers['Last-Modified']
+    assert _serve('a.css', HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+
+def test_serve_asset_changed_since_loaded(www, monkeypatch):
+    monkeypatch.setattr(serving, 'ASSETS_MTIME', None)
+    monkeypatch.setattr(serving, 'RELOAD_ASSETS', True)
+    assert _serve('a.css').headers['ETag'] == '"a.css"'
+    monkeypatch.setattr(serving, 'RELOAD_ASSETS', False)
+    serving.STATIC_CACHE.entries.clear()
+    os.utime(str(www / 'static' / 'a.css'), (MTIME + 60, MTIME + 60))
+    response = _serve('a.css')
+    # served with a stat, by static_file, Last-Modified and all
+    assert response.status_code == 200
+    assert response.headers['ETag'] != '"a.css"'
+    last_modified = response.headers['Last-Modified']
+    assert _serve('a.css', HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+    assert _serve('a.css', HTTP_IF_MODIFIED_SINCE=
+                  'Fri, 14 Jul 2017 02:40:00 GMT').status_code == 200
+
+
+##### Content Negotiation ######################################################
+
+@pytest.mark.parametrize('header, accepted', [
+    ('', set()),
+    ('gzip, deflate', { 'gzip' }),
+    ('gzip, deflate, br', { 'br', 'gzip' }),
+    ('GZIP;q=0.5 , BR ; q=1.0', { 'br', 'gzip' }),
+    ('br;q=0, gzip;q=0.001', { 'gzip' }),
+    ('*', { 'br', 'gzip' }),
+    ('*;q=0.1, br;q=0', { 'gzip' }),
+    ('gzip;q=0, *', { 'br' }),
+    ('identity', set()),
+    ('br;q=high', set()),
+    ('gzip; foo=1; q=0, br', { 'br' }),
+    ('gzip;level=1;Q=0.5', { 'gzip' }),
+])
+def test_accepted_encodings(header, accepted):
+    assert serving._accepted_encodings(header) == accepted
+
+
+def test_serve_static_variants(www, monkeypatch):
+    # NOTE: without a manifest, checking for each variant
+    monkeypatch.setattr(serving, 'ASSETS', {})
+    response = _serve('b.js', HTTP_ACCEPT_ENCODING='br, gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Length'] == '10'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    response = _serve('b.js', HTTP_ACCEPT_ENCODING='identity')
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Length'] == '100'
+
+
+##### Static Cache #############################################################
+
+def test_static_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(serving, 'STATIC_CACHE_SIZE', 10)
+    cache = serving.StaticCache()
+    cache.put('a', '"a"', b'aaaa', {})
+    cache.put('b', '"b"', b'bbbb', {})
+    assert cache.get('a', '"a"') is not None
+    cache.put('c', '"c"', b'cccc', {})
+    assert list(cache.entries) == [ 'a', 'c' ]
+    assert cache.size == 8
+
+
+def test_static_cache_replaces_changed_entries(monkeypatch):
+    monkeypatch.setattr(serving, 'STATIC_CACHE_SIZE', 10)
+    cache = serving.StaticCache()
+    cache.put('a', '"1"', b'aaaa', {})
+    assert cache.get('a', '"2"') is None
+    cache.put('a', '"2"', b'aaaaaa', {})
+    assert cache.get('a', '"2"')[1] == b'aaaaaa'
+    assert cache.size == 6
+    cache.put('b', '"b"', b'b' * 11, {}) # NOTE: larger than the whole cache
+    assert list(cache.entries) == [] and cache.size == 0
+
+
+def test_serve_asset_from_cache(www, monkeypatch):
+    monkeypatch.setattr(serving, 'ASSETS_MTIME', None)
+    monkeypatch.setattr(serving, 'RELOAD_ASSETS', True)
+    first = _serve('a.css')
+    assert first.body == b'a' * 100
+    assert list(serving.STATIC_CACHE.entries) == [ 'static/a.css' ]
+    # NOTE: served from memory, even with the file gone
+    os.remove(str(www / 'static' / 'a.css'))
+    second = _serve('a.css')
+    assert second.body is first.body
+    assert second.headers['Content-Type'] == 'text/css; charset=UTF-8'
+    assert second.headers['ETag'] == '"a.css"'
+
+
+def test_serve_asset_large_files_skip_cache(www, monkeypatch):
+    monkeypatch.setattr(serving, 'ASSETS_MTIME', None)
+    monkeypatch.setattr(serving, 'RELOAD_ASSETS', True)
+    monkeypatch.setattr(serving, 'STATIC_CACHE_FILE_SIZE', 99)
+    assert _serve('a.css').status_code == 200
+    assert list(serving.STATIC_CACHE.entries) == []
+
+
+##### Ranges ###################################################################
+
+@pytest.mark.parametrize('environ, ranges', [
+    ({}, None),
+    ({ 'HTTP_RANGE': 'items=0-1' }, None),
+    ({ 'HTTP_RANGE': 'bytes=0-9' }, [ (0, 10) ]),
+    ({ 'HTTP_RANGE': 'bytes=-10' }, [ (990, 1000) ]),
+    ({ 'HTTP_RANGE': 'bytes=900-' }, [ (900, 1000) ]),
+    ({ 'HTTP_RANGE': 'bytes=500-599, 0-9' }, [ (0, 10), (500, 600) ]),
+    # NOTE: overlapping, and close enough to send as one part
+    ({ 'HTTP_RANGE': 'bytes=0-9,5-19,50-59' }, [ (0, 60) ]),
+    ({ 'HTTP_RANGE': 'bytes=1000-1010' }, []),
+    ({ 'HTTP_RANGE': 'bytes=0-9', 'HTTP_IF_RANGE': '"etag"' }, [ (0, 10) ]),
+    ({ 'HTTP_RANGE': 'bytes=0-9', 'HTTP_IF_RANGE': '"other"' }, None),
+    ({ 'HTTP_RANGE': 'bytes=0-9', 'HTTP_IF_RANGE': 'W/"etag"' }, None),
+    ({ 'HTTP_RANGE': 'bytes=0-9',
+       'HTTP_IF_RANGE': 'Fri, 14 Jul 2017 02:40:00 GMT' }, [ (0, 10) ]),
+    ({ 'HTTP_RANGE': 'bytes=0-9',
+       'HTTP_IF_RANGE': 'Fri, 14 Jul 2017 02:40:01 GMT' }, None),
+])
+def test_get_ranges(environ, ranges):
+    _request(**environ)
+    assert serving._get_ranges({ 'etag': '"etag"', 'mtime': MTIME }, 1000) == ranges
+
+
+def test_get_ranges_ignores_too_many():
+    parts = ','.join('{}-{}'.format(i * 100, i * 100) for i in range(17))
+    _request(HTTP_RANGE='bytes=' + parts)
+    assert serving._get_ranges({ 'etag': '"etag"', 'mtime': MTIME }, 10000) is None
+
+
+@pytest.fixture
+def large(tmp_path):
+    fp = tmp_path / 'large.bin'
+    fp.write_bytes(bytes(range(256)) * 4)
+    os.utime(str(fp), (MTIME, MTIME))
+    return str(fp), { 'size': 1024, 'mtime': MTIME, 'etag': '"large"' }
+
+
+def _serve_file(large, **environ):
+    _request(**environ)
+    path, representation = large
+    headers = { 'Content-Type': 'application/octet-stream', 'Content-Length': '1024' }
+    response = serving._serve_file(path, representation, headers)
+    if isinstance(response.body, serving.FileRange):
+        body = response.body.read()
+    elif isinstance(response.body, serving.MultipartRanges):
+        body = b''.join(response.body)
+    else:
+        return response, response.body
+    response.body.close()
+    return response, body
+
+
+def test_serve_file_single_range(large):
+    response, body = _serve_file(large, HTTP_RANGE='bytes=256-259')
+    assert response.status_code == 206
+    assert body == bytes([ 0, 1, 2, 3 ])
+    assert response.headers['Content-Range'] == 'bytes 256-259/1024'
+    assert response.headers['Content-Length'] == '4'
+
+
+def test_serve_file_multiple_ranges(large):
+    response, body = _serve_file(large, HTTP_RANGE='bytes=0-1,-2')
+    assert response.status_code == 206
+    content_type, _, boundary = response.headers['Content-Type'].partition('; boundary=')
+    assert content_type == 'multipart/byteranges'
+    assert int(response.headers['Content-Length']) == len(body)
+    assert body == (
+        '\r\n--{0}\r\nContent-Type: application/octet-stream\r\n'
+        'Content-Range: bytes 0-1/1024\r\n\r\n\x00\x01'
+        '\r\n--{0}\r\nContent-Type: application/octet-stream\r\n'
+        'Content-Range: bytes 1022-1023/1024\r\n\r\n\xfe\xff'
+        '\r\n--{0}--\r\n').format(boundary).encode('latin1')
+
+
+def test_serve_file_unsatisfiable_range(large):
+    response, _ = _serve_file(large, HTTP_RANGE='bytes=2000-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */1024'
+    assert 'Content-Length' not in response.headers
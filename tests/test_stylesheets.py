@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+pytest.importorskip('sass')
+from stylesheets import SassDependencyGraph, StylesheetGenerator
+
+
+@pytest.fixture
+def project(tmp_path):
+    sass = tmp_path / 'dev' / 'sass'
+    (sass / 'partials').mkdir(parents=True)
+    (sass / 'styles.scss').write_text('@import "partials/colors";\nbody { color: $red }\n')
+    (sass / 'partials' / '_colors.scss').write_text('$red: #f00;\n')
+    (tmp_path / 'www' / 'static' / 'css').mkdir(parents=True)
+    (tmp_path / 'www' / 'static' / 'css' / 'styles.css').write_text('body{}')
+    return tmp_path
+
+
+def _graph(project):
+    return SassDependencyGraph(str(project / 'dev' / 'sass'),
+        str(project / 'www' / '.build' / 'sass-graph.json'), str(project))
+
+
+def test_graph_records_paths_relative_to_the_project(project):
+    graph = _graph(project)
+    graph.record(str(project / 'dev' / 'sass' / 'styles.scss'),
+                 str(project / 'www' / 'static' / 'css' / 'styles.css'), 'expanded')
+    graph.save()
+    with open(graph.fp) as f:
+        entry = json.load(f)['entries']['styles.scss']
+    assert entry['output'] == 'www/static/css/styles.css'
+    assert sorted(entry['inputs']) == [ 'partials/_colors.scss', 'styles.scss' ]
+
+
+def test_graph_changes_and_removal(project):
+    src_fp = str(project / 'dev' / 'sass' / 'styles.scss')
+    dest_fp = str(project / 'www' / 'static' / 'css' / 'styles.css')
+    graph = _graph(project)
+    assert graph.get_changes(src_fp, dest_fp, 'expanded') == [ 'new entry point' ]
+    graph.record(src_fp, dest_fp, 'expanded')
+    graph.save()
+    (project / 'dev' / 'sass' / 'partials' / '_colors.scss').write_text('$red: red;\n')
+    graph = _graph(project)
+    assert graph.get_changes(src_fp, dest_fp, 'expanded') == \
+           [ 'changed partials/_colors.scss' ]
+    assert graph.get_changes(src_fp, dest_fp, 'compressed') == \
+           [ 'output style changed to compressed' ]
+    graph.remove_missing([])
+    assert not (project / 'www' / 'static' / 'css' / 'styles.css').exists()
+
+
+@pytest.mark.parametrize('view', [ 'index.tpl', 'about.html', 'news.thtml', 'faq.stpl' ])
+def test_site_markup_scans_every_view(project, view):
+    views = project / 'www' / 'views'
+    views.mkdir()
+    (views / view).write_text('<p class="used"></p>\n')
+    generator = StylesheetGenerator(str(project / 'dev' / 'sass'),
+                                    str(project / 'www' / 'static'))
+    assert generator._get_site_markup().has_class('used')
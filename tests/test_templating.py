@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from bottle import Bottle, template, response, TEMPLATES
+
+import templating
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    views = tmp_path / 'views'
+    views.mkdir()
+    monkeypatch.chdir(tmp_path) # NOTE: bottle looks views up in ./views/
+    monkeypatch.setattr(templating, 'APP_DIR', str(tmp_path))
+    monkeypatch.setattr(templating, 'VIEWS_DIR', str(views))
+    monkeypatch.setattr(templating, 'COMPILED_VIEWS_FILE', str(tmp_path / 'views.json'))
+    monkeypatch.setattr(templating, 'COMPILED', {})
+    monkeypatch.setattr(templating, 'INCLUDES', {})
+    monkeypatch.setattr(templating, 'PAGE_CACHES', {})
+    yield tmp_path
+    TEMPLATES.clear()
+
+
+def _write_compiled(app_dir, view, code, source):
+    (app_dir / 'views.json').write_text(json.dumps({ 'views/' + view: {
+        'size': len(source), 'hash': hashlib.sha1(source).hexdigest(),
+        'code': code } }))
+
+
+def test_warm_templates_compiles_stale_views(app_dir):
+    fp = app_dir / 'views' / 'index.tpl'
+    fp.write_text('<p>{{name}}</p>\n')
+    # NOTE: recorded for an earlier version of the view, of the same size
+    _write_compiled(app_dir, 'index.tpl', '_printlist(("stale",))',
+                    b'<b>{{name}}</b>\n')
+    timings = templating.warm_templates()
+    assert [ view for view, _ in timings ] == [ 'index' ]
+    assert template('index', name='fresh') == '<p>fresh</p>\n'
+
+
+def test_warm_templates_uses_current_compiled_code(app_dir):
+    fp = app_dir / 'views' / 'index.tpl'
+    fp.write_text('<p>{{name}}</p>\n')
+    # NOTE: whatever its mtime, e.g. once unzipped on the server
+    os.utime(str(fp), (0, 0))
+    _write_compiled(app_dir, 'index.tpl', '_printlist(("precompiled",))',
+                    b'<p>{{name}}</p>\n')
+    templating.warm_templates()
+    assert template('index', name='fresh') == 'precompiled'
+
+
+##### Page Cache ###############################################################
+
+def _call(app, path, **environ):
+    # (status, headers, body) of a GET request to the app
+    query = path.partition('?')[2]
+    env = dict(REQUEST_METHOD='GET', PATH_INFO=path.partition('?')[0],
+               QUERY_STRING=query, SERVER_NAME='localhost', SERVER_PORT='80',
+               HTTP_HOST='localhost')
+    env.update(environ)
+    setup_testing_defaults(env)
+    started = []
+    body = b''.join(app(env, lambda status, headers, exc_info=None: started.append((status, headers))))
+    return started[0][0], started[0][1], body.decode('utf8')
+
+
+@pytest.fixture
+def page_cache(monkeypatch):
+    monkeypatch.setattr(templating, 'PAGE_CACHE', True)
+    monkeypatch.setattr(templating, 'PAGE_CACHES', {})
+    return templating.PAGE_CACHES
+
+
+def _counting_app(view, handler):
+    app, calls = Bottle(), []
+    @app.route('/')
+    @templating.cached_view(view)
+    def index():
+        calls.append(1)
+        return handler(len(calls))
+    return app, calls
+
+
+def test_parse_cache_directive():
+    cache = templating._parse_cache_directive('index',
+        '<p>\n %# cache ttl=300 key=host,Query,header:Accept-Language max=64\n')
+    assert (cache.ttl, cache.key, cache.size) == \
+           (300, ('host', 'query', 'header:accept-language'), 64)
+    cache = templating._parse_cache_directive('index', '%#cache\n')
+    assert (cache.ttl, cache.key, cache.size) == (templating.DEFAULT_CACHE_TTL,
+        templating.DEFAULT_CACHE_KEY, templating.DEFAULT_CACHE_ENTRIES)
+    assert templating._parse_cache_directive('index', '% # cache key=\n').key == ()
+    assert templating._parse_cache_directive('index', '%# caches ttl=1\n') is None
+    assert templating._parse_cache_directive('index', '<p>cache ttl=1</p>\n') is None
+
+
+@pytest.mark.parametrize('directive', [ 'ttl=soon', 'key=cookie', 'size=1', 'max=' ])
+def test_parse_cache_directive_errors(directive):
+    with pytest.raises(ValueError):
+        templating._parse_cache_directive('index', '%# cache ' + directive)
+
+
+def test_cached_view_replays_headers(page_cache):
+    def handler(n):
+        response.set_header('Cache-Control', 'public, max-age=60')
+        response.content_type = 'text/plain'
+        return 'page {}'.format(n)
+    app, calls = _counting_app('index', handler)
+    page_cache['index'] = templating.PageCache(60, ('host',), 8)
+    first = _call(app, '/')
+    second = _call(app, '/')
+    assert len(calls) == 1
+    assert second[2] == first[2] == 'page 1'
+    assert second[0] == '200 OK'
+    headers = dict(second[1])
+    assert headers['Cache-Control'] == 'public, max-age=60'
+    assert headers['Content-Type'] == 'text/plain'
+
+
+def test_cached_view_keys(page_cache):
+    app, calls = _counting_app('index', lambda n: 'page {}'.format(n))
+    page_cache['index'] = templating.PageCache(60, ('host', 'header:x-a'), 8)
+    assert _call(app, '/')[2] == 'page 1'
+    assert _call(app, '/?q=1')[2] == 'page 1' # the query isn't part of the key
+    assert _call(app, '/', HTTP_HOST='other')[2] == 'page 2'
+    assert _call(app, '/', HTTP_X_A='1')[2] == 'page 3'
+    assert _call(app, '/', HTTP_X_A='1')[2] == 'page 3'
+
+
+def test_cached_view_expires_and_evicts(page_cache, monkeypatch):
+    now = [ 1000.0 ]
+    monkeypatch.setattr(templating.time, 'monotonic', lambda: now[0])
+    app, calls = _counting_app('index', lambda n: 'page {}'.format(n))
+    page_cache['index'] = templating.PageCache(10, ('query',), 2)
+    assert [ _call(app, p)[2] for p in ('/?a', '/?b', '/?a', '/?c', '/?b') ] == \
+           [ 'page 1', 'page 2', 'page 1', 'page 3', 'page 4' ] # b was evicted
+    now[0] += 11
+    assert _call(app, '/?a')[2] == 'page 5'
+
+
+def test_cached_view_skips_cookies_and_errors(page_cache):
+    def handler(n):
+        if n == 1:
+            response.set_cookie('session', 'visitor-1')
+        elif n == 2:
+            response.status = 500
+        return 'page {}'.format(n)
+    app, calls = _counting_app('index', handler)
+    page_cache['index'] = templating.PageCache(60, (), 8)
+    assert _call(app, '/')[2] == 'page 1'
+    assert _call(app, '/')[2] == 'page 2'
+    assert _call(app, '/')[2] == 'page 3'
+    status, headers, body = _call(app, '/')
+    assert body == 'page 3'
+    assert 'Set-Cookie' not in dict(headers)
+
+
+def test_cached_view_only_when_enabled(page_cache, monkeypatch):
+    monkeypatch.setattr(templating, 'PAGE_CACHE', False)
+    app, calls = _counting_app('index', lambda n: 'page {}'.format(n))
+    page_cache['index'] = templating.PageCache(60, (), 8)
+    assert [ _call(app, '/')[2] for _ in range(2) ] == [ 'page 1', 'page 2' ]